@@ -0,0 +1,117 @@
+"""
+Бенчмарк: пропускная способность чтения SQLite при параллельной записи.
+
+Сравнивает профили default и production (WAL, прагмы, отдельный пул на чтение).
+
+    python -m bench.sqlite_profile [--seconds 5] [--readers 4]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from bot.db import PROFILE_DEFAULT, PROFILE_PRODUCTION, Base, create_db_engine
+from bot.models import Booking, BookingState, Item, User
+
+
+def _populate(engine, items: int) -> None:
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        session.add(User(tg_id=1, username="owner", owner_handle="@owner"))
+        session.add_all(
+            Item(sheet_row=i, name=f"Вещь {i} дрель", price_raw="10", owner_handle="@owner", area=f"Район {i % 7}")
+            for i in range(items)
+        )
+        session.commit()
+
+
+def _run(profile: str, seconds: float, readers: int, items: int) -> dict:
+    tmpdir = tempfile.mkdtemp(prefix="garage-bench-")
+    url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    write_engine = create_db_engine(url, profile)
+    _populate(write_engine, items)
+    read_engine = create_db_engine(url, profile, read_only=profile == PROFILE_PRODUCTION)
+
+    stop = threading.Event()
+    counters = {"reads": 0, "read_errors": 0, "writes": 0, "write_errors": 0}
+    lock = threading.Lock()
+
+    def writer() -> None:
+        start = date.today()
+        n = 0
+        while not stop.is_set():
+            try:
+                with Session(write_engine) as session:
+                    session.add(
+                        Booking(
+                            item_id=n % items + 1,
+                            renter_user_id=1,
+                            owner_user_id=1,
+                            start_date=start + timedelta(days=n % 300),
+                            end_date=start + timedelta(days=n % 300 + 1),
+                            state=BookingState.pending_owner_confirm,
+                        )
+                    )
+                    session.commit()
+                key = "writes"
+            except OperationalError:
+                key = "write_errors"
+            n += 1
+            with lock:
+                counters[key] += 1
+
+    query = (
+        select(Item.id, Item.name, Item.price_raw, Item.area)
+        .where(func.lower(Item.name).like("%дрель%"))
+        .order_by(Item.name)
+        .limit(30)
+    )
+
+    def reader() -> None:
+        while not stop.is_set():
+            try:
+                with Session(read_engine) as session:
+                    session.execute(query).all()
+                    session.execute(select(func.count(Booking.id))).scalar()
+                key = "reads"
+            except OperationalError:
+                key = "read_errors"
+            with lock:
+                counters[key] += 1
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    write_engine.dispose()
+    read_engine.dispose()
+    return {k: v / seconds for k, v in counters.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--items", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'profile':<12}{'reads/s':>10}{'read err/s':>12}{'writes/s':>10}{'write err/s':>13}")
+    for profile in (PROFILE_DEFAULT, PROFILE_PRODUCTION):
+        r = _run(profile, args.seconds, args.readers, args.items)
+        print(
+            f"{profile:<12}{r['reads']:>10.0f}{r['read_errors']:>12.1f}"
+            f"{r['writes']:>10.0f}{r['write_errors']:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Микробенчмарк: ORM-цепочка session.query(...) против заранее собранных запросов
+из bot.statements для горячих путей (пересечение броней, напоминания, владелец).
+
+    python -m bench.statements [--iterations 5000]
+"""
+import argparse
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from bot.db import Base, create_db_engine
+from bot.models import Booking, BookingState, Item, Notification, NotificationType, User
+from bot.statements import statements
+
+
+def _populate(session: Session) -> None:
+    session.add(User(tg_id=1, username="owner", owner_handle="@owner"))
+    session.add_all(Item(sheet_row=i, name=f"Вещь {i}", price_raw="10", owner_handle="@owner") for i in range(100))
+    today = date.today()
+    session.add_all(
+        Booking(
+            item_id=i % 100 + 1,
+            renter_user_id=1,
+            owner_user_id=1,
+            start_date=today + timedelta(days=i % 200),
+            end_date=today + timedelta(days=i % 200 + 2),
+            state=BookingState.confirmed_unpaid,
+        )
+        for i in range(2000)
+    )
+    session.flush()
+    session.add_all(
+        Notification(booking_id=i + 1, type=NotificationType.minus_24h, scheduled_for=datetime(2100, 1, 1))
+        for i in range(2000)
+    )
+    session.commit()
+
+
+def _orm_overlap(session: Session, item_id: int, start_date: date, end_date: date):
+    return (
+        session.query(Booking)
+        .filter(
+            Booking.item_id == item_id,
+            Booking.state.in_(
+                [
+                    BookingState.pending_owner_confirm,
+                    BookingState.confirmed_unpaid,
+                    BookingState.paid_confirmed,
+                ]
+            ),
+            or_(
+                and_(Booking.start_date <= start_date, Booking.end_date >= start_date),
+                and_(Booking.start_date <= end_date, Booking.end_date >= end_date),
+                and_(Booking.start_date >= start_date, Booking.end_date <= end_date),
+            ),
+        )
+        .first()
+    )
+
+
+def _orm_due(session: Session, now: datetime):
+    return (
+        session.query(Notification)
+        .filter(
+            Notification.type.in_([
+                NotificationType.minus_24h,
+                NotificationType.minus_12h,
+                NotificationType.minus_2h,
+            ]),
+            Notification.sent == False,
+            Notification.scheduled_for <= now,
+        )
+        .all()
+    )
+
+
+def _orm_owner(session: Session, handle: str):
+    return session.query(User).filter(User.owner_handle == handle).one_or_none()
+
+
+def _timeit(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return (time.perf_counter() - started) / iterations * 1_000_000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    engine = create_db_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = Session(engine)
+    _populate(session)
+
+    today = date.today()
+    now = datetime.utcnow()
+    cases = [
+        (
+            "booking_overlap",
+            lambda i: _orm_overlap(session, i % 100 + 1, today + timedelta(days=i % 30), today + timedelta(days=i % 30 + 3)),
+            lambda i: statements.execute(
+                session,
+                "booking_overlap",
+                item_id=i % 100 + 1,
+                start_date=today + timedelta(days=i % 30),
+                end_date=today + timedelta(days=i % 30 + 3),
+            ).first(),
+        ),
+        (
+            "due_notifications",
+            lambda i: _orm_due(session, now),
+            lambda i: statements.execute(session, "due_notifications", now=now).all(),
+        ),
+        (
+            "user_by_owner_handle",
+            lambda i: _orm_owner(session, "@owner"),
+            lambda i: statements.execute(session, "user_by_owner_handle", owner_handle="@owner").scalar_one_or_none(),
+        ),
+    ]
+
+    print(f"{'statement':<28}{'orm µs':>10}{'registry µs':>14}{'speedup':>10}")
+    for name, orm_fn, reg_fn in cases:
+        orm_fn(0)
+        reg_fn(0)
+        orm_us = _timeit(orm_fn, args.iterations)
+        reg_us = _timeit(reg_fn, args.iterations)
+        print(f"{name:<28}{orm_us:>10.1f}{reg_us:>14.1f}{orm_us / reg_us:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
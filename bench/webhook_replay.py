@@ -0,0 +1,100 @@
+"""
+Нагрузка на локальный webhook: POST записанных апдейтов (JSONL, один Update на строку)
+и замер времени ответа сервера.
+
+    python -m bench.webhook_replay updates.jsonl [--url http://127.0.0.1:8080/webhook]
+        [--secret SECRET] [--concurrency 50] [--repeat 1]
+    python -m bench.webhook_replay --synthetic 1000 --chats 100
+
+Синтетические апдейты — текстовые сообщения «/start» от chats разных пользователей.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import aiohttp
+
+from bot.webhook import SECRET_HEADER
+
+
+def _load(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _synthetic(count: int, chats: int) -> list[dict]:
+    updates = []
+    for i in range(count):
+        chat_id = 10_000 + i % chats
+        user = {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"}
+        updates.append(
+            {
+                "update_id": i + 1,
+                "message": {
+                    "message_id": i + 1,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private", "first_name": user["first_name"]},
+                    "from": user,
+                    "text": "/start",
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+                },
+            }
+        )
+    return updates
+
+
+async def _replay(url: str, updates: list[dict], concurrency: int, secret: str) -> None:
+    headers = {SECRET_HEADER: secret} if secret else {}
+    statuses: Counter = Counter()
+    latencies: list[float] = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+
+        async def post(update: dict) -> None:
+            async with sem:
+                started = time.perf_counter()
+                try:
+                    async with session.post(url, json=update) as resp:
+                        await resp.read()
+                        statuses[resp.status] += 1
+                except aiohttp.ClientError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(u) for u in updates))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0.0
+    p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000 if latencies else 0.0
+    print(f"апдейтов: {len(updates)} за {elapsed:.2f} с ({len(updates) / elapsed:.0f}/с)")
+    print(f"ответ: p50 {p50:.1f} мс, p99 {p99:.1f} мс")
+    print("статусы: " + ", ".join(f"{k}: {v}" for k, v in sorted(statuses.items(), key=str)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", nargs="?", help="JSONL с апдейтами")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--synthetic", type=int, default=0, help="сгенерировать N апдейтов вместо файла")
+    parser.add_argument("--chats", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.file:
+        updates = _load(args.file)
+    elif args.synthetic:
+        updates = _synthetic(args.synthetic, args.chats)
+    else:
+        parser.error("укажите файл с апдейтами или --synthetic N")
+    asyncio.run(_replay(args.url, updates * args.repeat, args.concurrency, args.secret))
+
+
+if __name__ == "__main__":
+    main()
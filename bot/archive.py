@@ -0,0 +1,113 @@
+"""Архивация закрытых броней: перенос из bookings в bookings_archive пачками."""
+import logging
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, delete, insert, literal, not_, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from .config import load_settings
+from .models import ACTIVE_BOOKING_STATES, Booking, BookingArchive, BookingState, Notification, OutboxMessage
+from .writer import submit_write
+
+log = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE = 500
+
+# Колонки, общие для bookings и bookings_archive
+_COLUMNS = (
+    "id",
+    "item_id",
+    "renter_user_id",
+    "owner_user_id",
+    "start_date",
+    "end_date",
+    "state",
+    "paid_confirmed_at",
+    "refund_confirmed_at",
+    "last_refund_reminder_at",
+    "created_at",
+    "updated_at",
+    "canceled_reason",
+)
+
+
+def bookings_with_archive(*columns: str):
+    """
+    Подзапрос UNION ALL по рабочей таблице и архиву — для экранов истории.
+    По умолчанию содержит все общие колонки.
+    """
+    names = columns or _COLUMNS
+    return union_all(
+        select(*(getattr(Booking, c) for c in names)),
+        select(*(getattr(BookingArchive, c) for c in names)),
+    ).subquery("booking_history")
+
+
+def _archivable_condition(today: date, now: datetime, keep_days: int):
+    # Отменённая оплаченная бронь ждёт подтверждения возврата — её не трогаем
+    refund_pending = and_(
+        Booking.state == BookingState.canceled_by_renter,
+        Booking.paid_confirmed_at.isnot(None),
+        Booking.refund_confirmed_at.is_(None),
+    )
+    ended_long_ago = Booking.end_date < today - timedelta(days=keep_days)
+    settled_cancellation = and_(
+        Booking.state.notin_(ACTIVE_BOOKING_STATES),
+        Booking.updated_at < now - timedelta(days=keep_days),
+    )
+    return and_(or_(ended_long_ago, settled_cancellation), not_(refund_pending))
+
+
+def _archive_batch(session: Session, today: date, now: datetime, keep_days: int, limit: int) -> int:
+    """Перенести одну пачку броней в архив. Операция писателя, коммит — на нём."""
+    ids = list(
+        session.scalars(
+            select(Booking.id)
+            .where(_archivable_condition(today, now, keep_days))
+            .order_by(Booking.id)
+            .limit(limit)
+        )
+    )
+    if not ids:
+        return 0
+    session.execute(
+        insert(BookingArchive).from_select(
+            [*_COLUMNS, "archived_at"],
+            select(*(getattr(Booking, c) for c in _COLUMNS), literal(now)).where(Booking.id.in_(ids)),
+        )
+    )
+    session.execute(delete(Notification).where(Notification.booking_id.in_(ids)))
+    session.execute(delete(Booking).where(Booking.id.in_(ids)))
+    return len(ids)
+
+
+def _purge_outbox(session: Session, before: datetime) -> int:
+    """Удалить давно доставленные и окончательно недоставленные сообщения outbox."""
+    result = session.execute(
+        delete(OutboxMessage).where(
+            or_(OutboxMessage.sent_at < before, OutboxMessage.failed_at < before)
+        )
+    )
+    return result.rowcount
+
+
+async def archive_closed_bookings() -> int:
+    """
+    Перенести в архив брони, закончившиеся давно, и урегулированные отмены.
+    Каждая пачка — отдельная транзакция. Возвращает количество перенесённых.
+    """
+    keep_days = load_settings().db.archive_after_days
+    today = date.today()
+    now = datetime.utcnow()
+    total = 0
+    while True:
+        moved = await submit_write(_archive_batch, today, now, keep_days, ARCHIVE_BATCH_SIZE)
+        total += moved
+        if moved < ARCHIVE_BATCH_SIZE:
+            break
+    if total:
+        log.info("В архив перенесено броней: %d", total)
+    purged = await submit_write(_purge_outbox, now - timedelta(days=keep_days))
+    if purged:
+        log.info("Из outbox удалено сообщений: %d", purged)
+    return total
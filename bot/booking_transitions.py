@@ -0,0 +1,154 @@
+"""
+Машина состояний брони.
+
+Каждый переход — один `UPDATE bookings ... WHERE id = ? AND state IN (...) RETURNING ...`.
+Если строка не обновилась (бронь не найдена, уже в другом состоянии или действие
+не от того участника), переход считается конфликтом и возвращается None.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum as PyEnum
+from typing import Any, Callable
+
+from sqlalchemy import select, update
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+
+from .models import ACTIVE_BOOKING_STATES, Booking, BookingState, Item
+
+
+class BookingEvent(str, PyEnum):
+    owner_confirm = "owner_confirm"
+    owner_decline = "owner_decline"
+    owner_paid = "owner_paid"
+    owner_cancel_unpaid = "owner_cancel_unpaid"
+    renter_cancel = "renter_cancel"
+    renter_confirm_refund = "renter_confirm_refund"
+    payment_timeout = "payment_timeout"
+
+
+ACTOR_OWNER = "owner"
+ACTOR_RENTER = "renter"
+# Переходы по расписанию: участник не проверяется
+ACTOR_SYSTEM = "system"
+
+
+@dataclass(frozen=True)
+class Transition:
+    from_states: tuple[BookingState, ...]
+    # None — состояние не меняется, обновляются только поля из values
+    to_state: BookingState | None
+    actor: str
+    # Дополнительные колонки: имя -> функция от текущего времени
+    values: dict[str, Callable[[datetime], Any]] = field(default_factory=dict)
+    # Дополнительные условия WHERE
+    guards: tuple = ()
+
+
+TRANSITIONS: dict[BookingEvent, Transition] = {
+    BookingEvent.owner_confirm: Transition(
+        (BookingState.pending_owner_confirm,), BookingState.confirmed_unpaid, ACTOR_OWNER
+    ),
+    BookingEvent.owner_decline: Transition(
+        (BookingState.pending_owner_confirm,), BookingState.canceled_by_owner, ACTOR_OWNER
+    ),
+    BookingEvent.owner_paid: Transition(
+        (BookingState.confirmed_unpaid,),
+        BookingState.paid_confirmed,
+        ACTOR_OWNER,
+        values={"paid_confirmed_at": lambda now: now},
+    ),
+    BookingEvent.owner_cancel_unpaid: Transition(
+        (BookingState.confirmed_unpaid,), BookingState.canceled_by_owner, ACTOR_OWNER
+    ),
+    BookingEvent.renter_cancel: Transition(
+        ACTIVE_BOOKING_STATES, BookingState.canceled_by_renter, ACTOR_RENTER
+    ),
+    BookingEvent.renter_confirm_refund: Transition(
+        (BookingState.canceled_by_renter,),
+        None,
+        ACTOR_RENTER,
+        values={"refund_confirmed_at": lambda now: now},
+        guards=(Booking.refund_confirmed_at.is_(None),),
+    ),
+    BookingEvent.payment_timeout: Transition(
+        (BookingState.confirmed_unpaid,), BookingState.canceled_unpaid_timeout, ACTOR_SYSTEM
+    ),
+}
+
+
+def _item_column(column):
+    return select(column).where(Item.id == Booking.item_id).scalar_subquery()
+
+
+# Всё, что нужно хендлерам для сообщений после перехода, приходит в RETURNING
+_RETURNING = (
+    Booking.id,
+    Booking.item_id,
+    Booking.renter_user_id,
+    Booking.owner_user_id,
+    Booking.start_date,
+    Booking.end_date,
+    Booking.state,
+    Booking.paid_confirmed_at,
+    _item_column(Item.name).label("item_name"),
+    _item_column(Item.price_raw).label("item_price_raw"),
+    _item_column(Item.owner_handle).label("item_owner_handle"),
+    _item_column(Item.deposit_required).label("item_deposit_required"),
+)
+
+
+def _transition_update(transition: Transition, *criteria):
+    now = datetime.utcnow()
+    values = {name: fn(now) for name, fn in transition.values.items()}
+    if transition.to_state is not None:
+        values["state"] = transition.to_state
+    values["updated_at"] = now
+    return (
+        update(Booking)
+        .where(Booking.state.in_(transition.from_states), *transition.guards, *criteria)
+        .values(**values)
+        .returning(*_RETURNING)
+    )
+
+
+def apply_transition(session: Session, booking_id: int, event: BookingEvent, actor_id: int) -> Row | None:
+    """
+    Выполнить переход одним UPDATE ... RETURNING. Операция писателя (writer.submit_write).
+    Возвращает строку брони после перехода или None при конфликте.
+    """
+    transition = TRANSITIONS[event]
+    actor_column = Booking.owner_user_id if transition.actor == ACTOR_OWNER else Booking.renter_user_id
+    stmt = _transition_update(transition, Booking.id == booking_id, actor_column == actor_id)
+    return session.execute(stmt, execution_options={"synchronize_session": False}).one_or_none()
+
+
+def apply_transition_many(
+    session: Session, booking_ids: list[int], event: BookingEvent, actor_id: int
+) -> list[Row]:
+    """
+    Тот же переход для нескольких броней одного участника одним UPDATE ... RETURNING.
+    Возвращает строки броней, для которых переход состоялся; остальные — конфликты.
+    """
+    if not booking_ids:
+        return []
+    transition = TRANSITIONS[event]
+    actor_column = Booking.owner_user_id if transition.actor == ACTOR_OWNER else Booking.renter_user_id
+    stmt = _transition_update(transition, Booking.id.in_(booking_ids), actor_column == actor_id)
+    return session.execute(stmt, execution_options={"synchronize_session": False}).all()
+
+
+def apply_system_transition(session: Session, event: BookingEvent, *criteria, limit: int) -> list[Row]:
+    """
+    Переход по расписанию для всех подходящих броней, не более limit за раз (берутся
+    по возрастанию id). Операция писателя; вызывающий повторяет, пока пачка полная.
+    """
+    transition = TRANSITIONS[event]
+    chunk = (
+        select(Booking.id)
+        .where(Booking.state.in_(transition.from_states), *transition.guards, *criteria)
+        .order_by(Booking.id)
+        .limit(limit)
+    )
+    stmt = _transition_update(transition, Booking.id.in_(chunk))
+    return session.execute(stmt, execution_options={"synchronize_session": False}).all()
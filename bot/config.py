@@ -14,6 +14,12 @@ class BotConfig:
     token: str
     admin_ids: list[int]
     timezone: str = "Europe/Madrid"
+    # polling — long polling; webhook — HTTP-сервер aiohttp (см. WebhookConfig)
+    run_mode: str = "polling"
+    # больше 1 — фронт-процесс и столько процессов-воркеров (bot/workers.py)
+    workers: int = 1
+    # сколько реплик бота работает на одной БД; больше 1 — FSM без кэша в памяти
+    replicas: int = 1
 
 
 @dataclass
@@ -26,6 +32,35 @@ class SheetsConfig:
 @dataclass
 class DatabaseConfig:
     url: str = "sqlite:///garage_bot.db"
+    # default — настройки драйвера по умолчанию; production — WAL, прагмы и пул только на чтение (SQLite)
+    profile: str = "default"
+    # окно группового коммита писателя, мс
+    write_batch_window_ms: int = 5
+    # через сколько дней закрытые брони переносятся в bookings_archive
+    archive_after_days: int = 30
+
+
+@dataclass
+class ReminderConfig:
+    # напоминания подтвердить возврат: первое через start часов после отмены,
+    # дальше каждые interval часов, не больше max_count штук
+    refund_start_hours: int = 24
+    refund_interval_hours: int = 24
+    refund_max_count: int = 7
+
+
+@dataclass
+class WebhookConfig:
+    # публичный адрес, который регистрируется в Telegram (без пути); пусто — не регистрировать
+    base_url: str = ""
+    path: str = "/webhook"
+    # секрет из заголовка X-Telegram-Bot-Api-Secret-Token; пусто — не проверять
+    secret_token: str = ""
+    host: str = "0.0.0.0"
+    port: int = 8080
+    # сколько апдейтов обрабатывается одновременно и сколько может ждать в очереди
+    concurrency: int = 32
+    queue_size: int = 1000
 
 
 @dataclass
@@ -33,6 +68,8 @@ class Settings:
     bot: BotConfig
     sheets: SheetsConfig
     db: DatabaseConfig
+    reminders: ReminderConfig
+    webhook: WebhookConfig
 
 
 def _parse_admin_ids(raw: str | None) -> list[int]:
@@ -50,6 +87,13 @@ def _parse_admin_ids(raw: str | None) -> list[int]:
     return result
 
 
+def _int_env(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
 def load_settings() -> Settings:
     token = os.getenv("BOT_TOKEN", "").strip()
     if not token:
@@ -68,14 +112,42 @@ def load_settings() -> Settings:
     items_ws_name = os.getenv("GOOGLE_ITEMS_WORKSHEET_NAME", "Лист1").strip() or "Лист1"
 
     db_url = os.getenv("DATABASE_URL", "sqlite:///garage_bot.db")
+    db_profile = os.getenv("DATABASE_PROFILE", "default").strip().lower() or "default"
+
+    run_mode = os.getenv("BOT_RUN_MODE", "polling").strip().lower() or "polling"
 
     return Settings(
-        bot=BotConfig(token=token, admin_ids=admin_ids),
+        bot=BotConfig(
+            token=token,
+            admin_ids=admin_ids,
+            run_mode=run_mode,
+            workers=max(_int_env("BOT_WORKERS", 1), 1),
+            replicas=max(_int_env("BOT_REPLICAS", 1), 1),
+        ),
         sheets=SheetsConfig(
             spreadsheet_id=spreadsheet_id,
             service_account_file=service_account_file,
             items_worksheet_name=items_ws_name,
         ),
-        db=DatabaseConfig(url=db_url),
+        db=DatabaseConfig(
+            url=db_url,
+            profile=db_profile,
+            write_batch_window_ms=max(_int_env("DB_WRITE_BATCH_MS", 5), 0),
+            archive_after_days=max(_int_env("ARCHIVE_AFTER_DAYS", 30), 1),
+        ),
+        reminders=ReminderConfig(
+            refund_start_hours=_int_env("REFUND_REMINDER_START_HOURS", 24),
+            refund_interval_hours=_int_env("REFUND_REMINDER_INTERVAL_HOURS", 24),
+            refund_max_count=_int_env("REFUND_REMINDER_MAX_COUNT", 7),
+        ),
+        webhook=WebhookConfig(
+            base_url=os.getenv("WEBHOOK_BASE_URL", "").strip().rstrip("/"),
+            path="/" + (os.getenv("WEBHOOK_PATH", "/webhook").strip().strip("/") or "webhook"),
+            secret_token=os.getenv("WEBHOOK_SECRET_TOKEN", "").strip(),
+            host=os.getenv("WEBHOOK_HOST", "0.0.0.0").strip() or "0.0.0.0",
+            port=_int_env("WEBHOOK_PORT", 8080),
+            concurrency=max(_int_env("WEBHOOK_CONCURRENCY", 32), 1),
+            queue_size=max(_int_env("WEBHOOK_QUEUE_SIZE", 1000), 1),
+        ),
     )
 
@@ -1,23 +1,141 @@
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import Session, declarative_base, sessionmaker
 
 engine = None
 SessionLocal = None
+ReadSessionLocal = None
+
+async_engine = None
+AsyncReadSessionLocal = None
+
+_initialized_for: tuple[str, str] | None = None
 
 Base = declarative_base()
 
+# Синхронный драйвер -> асинхронный для того же URL
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+PROFILE_DEFAULT = "default"
+PROFILE_PRODUCTION = "production"
+
+# Прагмы SQLite для профиля production, выставляются на каждое новое соединение
+SQLITE_PRODUCTION_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,  # отрицательное значение — в КиБ
+    "temp_store": "MEMORY",
+}
+
+
+def _is_file_sqlite(database_url: str) -> bool:
+    url = make_url(database_url)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def _sqlite_pragma_listener(read_only: bool):
+    def on_connect(dbapi_conn, _record) -> None:
+        cursor = dbapi_conn.cursor()
+        try:
+            if not read_only:
+                cursor.execute("PRAGMA journal_mode=WAL")
+            for name, value in SQLITE_PRODUCTION_PRAGMAS.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            if read_only:
+                cursor.execute("PRAGMA query_only=ON")
+        finally:
+            cursor.close()
+
+    return on_connect
 
-def init_db(database_url: str):
-    global engine, SessionLocal
-    engine = create_engine(database_url, echo=False, future=True)
+
+def _read_only_url(database_url: str) -> str:
+    """URL SQLite-файла, открытого только на чтение (mode=ro)."""
+    url = make_url(database_url)
+    return url.set(
+        database=f"file:{url.database}", query={**url.query, "mode": "ro", "uri": "true"}
+    ).render_as_string(hide_password=False)
+
+
+def create_db_engine(database_url: str, profile: str = PROFILE_DEFAULT, read_only: bool = False) -> Engine:
+    production = profile == PROFILE_PRODUCTION and _is_file_sqlite(database_url)
+    if production and read_only:
+        database_url = _read_only_url(database_url)
+    new_engine = create_engine(database_url, echo=False, future=True)
+    if production:
+        event.listen(new_engine, "connect", _sqlite_pragma_listener(read_only))
+    return new_engine
+
+
+def create_async_db_engine(database_url: str, profile: str = PROFILE_DEFAULT, read_only: bool = False):
+    production = profile == PROFILE_PRODUCTION and _is_file_sqlite(database_url)
+    if production and read_only:
+        database_url = _read_only_url(database_url)
+    new_engine = create_async_engine(to_async_url(database_url), echo=False)
+    if production:
+        event.listen(new_engine.sync_engine, "connect", _sqlite_pragma_listener(read_only))
+    return new_engine
+
+
+def init_db(database_url: str, profile: str = PROFILE_DEFAULT):
+    global engine, SessionLocal, ReadSessionLocal, _initialized_for
+    if engine is not None and _initialized_for == (database_url, profile):
+        return engine
+    engine = create_db_engine(database_url, profile)
     SessionLocal = sessionmaker(
         bind=engine, autoflush=False, autocommit=False, expire_on_commit=False, class_=Session
     )
+    # Отдельный пул только на чтение для поиска и списков (только production + файл SQLite)
+    read_engine = engine
+    if profile == PROFILE_PRODUCTION and _is_file_sqlite(database_url):
+        read_engine = create_db_engine(database_url, profile, read_only=True)
+    ReadSessionLocal = sessionmaker(
+        bind=read_engine, autoflush=False, autocommit=False, expire_on_commit=False, class_=Session
+    )
+    _initialized_for = (database_url, profile)
     return engine
 
 
+def to_async_url(database_url: str) -> str:
+    url = make_url(database_url)
+    driver = _ASYNC_DRIVERS.get(url.drivername, url.drivername)
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+
+def init_async_db(database_url: str, profile: str = PROFILE_DEFAULT):
+    """
+    Асинхронный движок для чтения в хендлерах (aiosqlite / asyncpg) поверх той же БД.
+    Асинхронной сессии на запись нет: все записи идут через писателя (bot/writer.py).
+    """
+    global async_engine, AsyncReadSessionLocal
+    async_engine = create_async_db_engine(database_url, profile)
+    read_engine = async_engine
+    if profile == PROFILE_PRODUCTION and _is_file_sqlite(database_url):
+        read_engine = create_async_db_engine(database_url, profile, read_only=True)
+    AsyncReadSessionLocal = async_sessionmaker(
+        bind=read_engine, autoflush=False, expire_on_commit=False, class_=AsyncSession
+    )
+    return async_engine
+
+
+def ensure_indexes() -> None:
+    """Создать индексы моделей, которых ещё нет в существующих таблицах (create_all их не добавляет)."""
+    if engine is None:
+        return
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
 @contextmanager
 def db_session() -> Session:
     if SessionLocal is None:
@@ -32,3 +150,29 @@ def db_session() -> Session:
     finally:
         session.close()
 
+
+@contextmanager
+def read_session() -> Session:
+    """Сессия только для чтения: без commit, из отдельного пула (если он есть)."""
+    if ReadSessionLocal is None:
+        raise RuntimeError("DB is not initialized. Call init_db() first.")
+    session: Session = ReadSessionLocal()
+    try:
+        yield session
+    finally:
+        # Без rollback: он помечает загруженные объекты устаревшими, и после блока они
+        # недоступны (DetachedInstanceError). Транзакцию откатывает пул при возврате соединения
+        session.close()
+
+
+@asynccontextmanager
+async def async_read_session() -> AsyncSession:
+    """Асинхронная сессия только для чтения (поиск, списки, история)."""
+    if AsyncReadSessionLocal is None:
+        raise RuntimeError("Async DB is not initialized. Call init_async_db() first.")
+    session: AsyncSession = AsyncReadSessionLocal()
+    try:
+        yield session
+    finally:
+        # См. read_session: close() без rollback, объекты остаются пригодны после блока
+        await session.close()
@@ -0,0 +1,318 @@
+"""
+FSM-хранилище aiogram в БД бота: состояния переживают перезапуск, Redis не нужен.
+
+Горячие состояния держатся в LRU-кэше в памяти, запись — отложенная: изменённые
+состояния раз в FSM_FLUSH_SECONDS уходят в fsm_states одной транзакцией писателя.
+Состояние, которое не менялось дольше FSM_STATE_TTL, считается брошенным: читается как
+пустое, раз в FSM_EVICT_SECONDS вытесняется из памяти, а из БД его удаляет задача
+fsm_purge (purge_expired). Кэш рассчитан на то, что чат обслуживает один процесс
+(так и раскладывают апдейты воркеры, bot/workers.py). Реплики за балансировщиком этого
+не гарантируют, поэтому при BOT_REPLICAS > 1 хранилище работает без кэша (shared):
+каждое чтение идёт в БД, каждое изменение записывается сразу.
+"""
+import asyncio
+import copy
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any
+
+from aiogram.dispatcher.storage import BaseStorage
+from sqlalchemy import and_, delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .db import async_read_session
+from .models import FsmStateRow
+from .writer import submit_write
+
+log = logging.getLogger(__name__)
+
+FSM_CACHE_SIZE = 10_000
+FSM_FLUSH_SECONDS = 2.0
+FSM_STATE_TTL = timedelta(hours=24)
+FSM_EVICT_SECONDS = 300.0
+# Строк на один INSERT: 6 параметров на строку, в пределах лимита переменных SQLite
+FSM_WRITE_CHUNK = 100
+
+Key = tuple[int, int]
+
+
+@dataclass
+class _Entry:
+    state: str | None = None
+    data: dict = field(default_factory=dict)
+    bucket: dict = field(default_factory=dict)
+    updated_at: datetime = field(default_factory=datetime.utcnow)
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data and not self.bucket
+
+
+@dataclass
+class FsmStats:
+    hits: int = 0
+    loads: int = 0
+    flushed: int = 0
+    evicted: int = 0
+    purged: int = 0
+
+
+@dataclass
+class FsmTableSize:
+    rows: int
+    # суммарный размер data и bucket, байт
+    payload_bytes: int
+
+
+def _purge_states(session: Session, cutoff: datetime) -> int:
+    return session.execute(delete(FsmStateRow).where(FsmStateRow.updated_at < cutoff)).rowcount
+
+
+def _save_states(session: Session, rows: list[dict], removed: list[Key]) -> None:
+    """Записать изменённые состояния, пустые — удалить. Операция писателя."""
+    insert = pg_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    for i in range(0, len(rows), FSM_WRITE_CHUNK):
+        stmt = insert(FsmStateRow).values(rows[i : i + FSM_WRITE_CHUNK])
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["chat_id", "user_id"],
+                set_={
+                    "state": stmt.excluded.state,
+                    "data": stmt.excluded.data,
+                    "bucket": stmt.excluded.bucket,
+                    "updated_at": stmt.excluded.updated_at,
+                },
+            )
+        )
+    for chat_id, user_id in removed:
+        session.execute(
+            delete(FsmStateRow).where(and_(FsmStateRow.chat_id == chat_id, FsmStateRow.user_id == user_id))
+        )
+
+
+def _rows(entries: dict[Key, _Entry]) -> tuple[list[dict[str, Any]], list[Key]]:
+    """Строки для _save_states: непустые состояния и ключи пустых (на удаление)."""
+    rows: list[dict[str, Any]] = []
+    removed: list[Key] = []
+    for (chat_id, user_id), entry in entries.items():
+        if entry.empty:
+            removed.append((chat_id, user_id))
+            continue
+        rows.append(
+            {
+                "chat_id": chat_id,
+                "user_id": user_id,
+                "state": entry.state,
+                "data": json.dumps(entry.data, ensure_ascii=False),
+                "bucket": json.dumps(entry.bucket, ensure_ascii=False),
+                "updated_at": entry.updated_at,
+            }
+        )
+    return rows, removed
+
+
+class DbStorage(BaseStorage):
+    def __init__(
+        self,
+        maxsize: int = FSM_CACHE_SIZE,
+        flush_seconds: float = FSM_FLUSH_SECONDS,
+        ttl: timedelta = FSM_STATE_TTL,
+    ) -> None:
+        self.maxsize = maxsize
+        self.flush_seconds = flush_seconds
+        self.ttl = ttl
+        self._entries: OrderedDict[Key, _Entry] = OrderedDict()
+        # Изменённые, но ещё не записанные; вытеснение из LRU их не теряет
+        self._dirty: dict[Key, _Entry] = {}
+        self._task: asyncio.Task | None = None
+        self.stats = FsmStats()
+        # Без кэша и отложенной записи: чат могут обслуживать разные реплики
+        self.shared = False
+
+    @property
+    def cached(self) -> int:
+        return len(self._entries)
+
+    @property
+    def dirty(self) -> int:
+        return len(self._dirty)
+
+    def _key(self, chat, user) -> Key:
+        chat, user = self.check_address(chat=chat, user=user)
+        return int(chat), int(user)
+
+    def _remember(self, key: Key, entry: _Entry) -> _Entry:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+    def _expired(self, entry: _Entry) -> bool:
+        return not entry.empty and entry.updated_at < datetime.utcnow() - self.ttl
+
+    async def _load(self, key: Key) -> _Entry:
+        async with async_read_session() as session:
+            row = (
+                await session.execute(
+                    select(FsmStateRow.state, FsmStateRow.data, FsmStateRow.bucket, FsmStateRow.updated_at).where(
+                        FsmStateRow.chat_id == key[0], FsmStateRow.user_id == key[1]
+                    )
+                )
+            ).one_or_none()
+        if row is None:
+            return _Entry()
+        return _Entry(row.state, json.loads(row.data), json.loads(row.bucket), row.updated_at)
+
+    async def _get(self, chat, user) -> tuple[Key, _Entry]:
+        key = self._key(chat, user)
+        if self.shared:
+            self.stats.loads += 1
+            entry = await self._load(key)
+            return key, (_Entry() if self._expired(entry) else entry)
+        entry = self._entries.get(key) or self._dirty.get(key)
+        if entry is None:
+            self.stats.loads += 1
+            loaded = await self._load(key)
+            # Пока шло чтение, состояние мог создать другой апдейт этого чата
+            entry = self._entries.get(key) or self._dirty.get(key) or loaded
+        else:
+            self.stats.hits += 1
+        if self._expired(entry):
+            entry = _Entry()
+            self._dirty[key] = entry
+        return key, self._remember(key, entry)
+
+    async def _touch(self, key: Key, entry: _Entry) -> None:
+        entry.updated_at = datetime.utcnow()
+        if self.shared:
+            await submit_write(_save_states, *_rows({key: entry}))
+            self.stats.flushed += 1
+        else:
+            self._dirty[key] = entry
+
+    async def get_state(self, *, chat=None, user=None, default: str | None = None) -> str | None:
+        _, entry = await self._get(chat, user)
+        return entry.state if entry.state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default: dict | None = None) -> dict:
+        _, entry = await self._get(chat, user)
+        return copy.deepcopy(entry.data)
+
+    async def set_state(self, *, chat=None, user=None, state=None) -> None:
+        key, entry = await self._get(chat, user)
+        entry.state = self.resolve_state(state)
+        await self._touch(key, entry)
+
+    async def set_data(self, *, chat=None, user=None, data: dict | None = None) -> None:
+        key, entry = await self._get(chat, user)
+        entry.data = copy.deepcopy(data or {})
+        await self._touch(key, entry)
+
+    async def update_data(self, *, chat=None, user=None, data: dict | None = None, **kwargs) -> None:
+        key, entry = await self._get(chat, user)
+        entry.data.update(copy.deepcopy(data or {}), **copy.deepcopy(kwargs))
+        await self._touch(key, entry)
+
+    def has_bucket(self) -> bool:
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default: dict | None = None) -> dict:
+        _, entry = await self._get(chat, user)
+        return copy.deepcopy(entry.bucket)
+
+    async def set_bucket(self, *, chat=None, user=None, bucket: dict | None = None) -> None:
+        key, entry = await self._get(chat, user)
+        entry.bucket = copy.deepcopy(bucket or {})
+        await self._touch(key, entry)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket: dict | None = None, **kwargs) -> None:
+        key, entry = await self._get(chat, user)
+        entry.bucket.update(copy.deepcopy(bucket or {}), **copy.deepcopy(kwargs))
+        await self._touch(key, entry)
+
+    async def flush(self) -> int:
+        """Записать изменённые состояния. Возвращает их количество."""
+        if not self._dirty:
+            return 0
+        batch, self._dirty = self._dirty, {}
+        try:
+            await submit_write(_save_states, *_rows(batch))
+        except Exception:
+            # Вернуть в очередь: в записях те же объекты, следующая попытка возьмёт свежие данные
+            for key, entry in batch.items():
+                self._dirty.setdefault(key, entry)
+            raise
+        self.stats.flushed += len(batch)
+        return len(batch)
+
+    def evict_idle(self) -> int:
+        """Убрать из памяти состояния, не менявшиеся дольше ttl. Незаписанные остаются."""
+        cutoff = datetime.utcnow() - self.ttl
+        idle = [key for key, entry in self._entries.items() if entry.updated_at < cutoff and key not in self._dirty]
+        for key in idle:
+            del self._entries[key]
+        self.stats.evicted += len(idle)
+        return len(idle)
+
+    async def purge_expired(self) -> int:
+        """Удалить из БД брошенные состояния (со всех процессов). Возвращает количество."""
+        purged = await submit_write(_purge_states, datetime.utcnow() - self.ttl)
+        self.stats.purged += purged
+        return purged
+
+    async def table_size(self) -> FsmTableSize:
+        async with async_read_session() as session:
+            rows, payload = (
+                await session.execute(
+                    select(
+                        func.count(),
+                        func.coalesce(func.sum(func.length(FsmStateRow.data) + func.length(FsmStateRow.bucket)), 0),
+                    ).select_from(FsmStateRow)
+                )
+            ).one()
+        return FsmTableSize(rows, payload)
+
+    async def _run(self) -> None:
+        evicted_at = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Не удалось записать FSM-состояния")
+            if time.monotonic() - evicted_at >= FSM_EVICT_SECONDS:
+                evicted_at = time.monotonic()
+                if self.evict_idle():
+                    log.info("FSM: вытеснено брошенных состояний, в памяти %d", self.cached)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="fsm-flush")
+
+    async def stop(self) -> None:
+        """Остановить фоновую запись и дописать оставшееся (до остановки писателя)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def close(self) -> None:
+        # Executor aiogram вызывает close уже после on_shutdown: всё записано в stop()
+        self._entries.clear()
+
+    async def wait_closed(self) -> None:
+        pass
+
+
+fsm_storage = DbStorage()
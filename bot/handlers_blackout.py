@@ -0,0 +1,263 @@
+"""Массовая блокировка дат владельцем сразу по нескольким вещам."""
+from datetime import date, datetime
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .calendar_keyboard import build_calendar_keyboard, parse_calendar_callback
+from .db import async_read_session
+from .handlers_booking import parse_dates
+from .models import ACTIVE_BOOKING_STATES, Booking, BookingState, Item
+from .users import CachedUser
+from .writer import submit_write
+
+
+class BulkBlockStates(StatesGroup):
+    choosing_items = State()
+    waiting_for_dates = State()
+
+
+async def _load_owner_items(owner_handle: str) -> list[tuple[int, str]]:
+    async with async_read_session() as session:
+        rows = await session.execute(
+            select(Item.id, Item.name).where(Item.owner_handle == owner_handle).order_by(Item.name.asc())
+        )
+    return [(r[0], r[1]) for r in rows]
+
+
+def _items_picker_keyboard(items: list[tuple[int, str]], selected: set[int]) -> types.InlineKeyboardMarkup:
+    kb = types.InlineKeyboardMarkup(row_width=1)
+    for item_id, name in items:
+        mark = "✅" if item_id in selected else "⬜"
+        kb.add(types.InlineKeyboardButton(text=f"{mark} {name}", callback_data=f"bulkblock:t:{item_id}"))
+    kb.row(
+        types.InlineKeyboardButton(text="Выбрать все", callback_data="bulkblock:all"),
+        types.InlineKeyboardButton(text="Снять все", callback_data="bulkblock:none"),
+    )
+    kb.add(types.InlineKeyboardButton(text="📅 Далее — выбрать даты", callback_data="bulkblock:dates"))
+    return kb
+
+
+def _picker_text(selected_count: int, total: int) -> str:
+    return (
+        "Заблокировать даты для нескольких вещей.\n"
+        f"Выбрано вещей: <b>{selected_count}</b> из {total}. Отметьте нужные и нажмите «Далее»."
+    )
+
+
+def _insert_bulk_block(
+    session: Session, owner_tg_id: int, owner_handle: str, item_ids: list[int], start_date: date, end_date: date
+) -> tuple[list[str], list[str]]:
+    """
+    Блокирует даты по всем выбранным вещам владельца одной транзакцией.
+    Возвращает (заблокированные вещи, вещи с пересечениями).
+    """
+    items = (
+        session.query(Item.id, Item.name)
+        .filter(Item.id.in_(item_ids), Item.owner_handle == owner_handle)
+        .order_by(Item.name.asc())
+        .all()
+    )
+    if not items:
+        return [], []
+
+    # Одним запросом находим вещи, у которых уже есть брони в этом диапазоне
+    conflicting_ids = {
+        r[0]
+        for r in session.query(Booking.item_id)
+        .filter(
+            Booking.item_id.in_([it.id for it in items]),
+            Booking.state.in_(ACTIVE_BOOKING_STATES),
+            Booking.start_date <= end_date,
+            Booking.end_date >= start_date,
+        )
+        .distinct()
+        .all()
+    }
+
+    now = datetime.utcnow()
+    blocked: list[str] = []
+    skipped: list[str] = []
+    new_bookings = []
+    for it in items:
+        if it.id in conflicting_ids:
+            skipped.append(it.name)
+            continue
+        new_bookings.append(
+            Booking(
+                item_id=it.id,
+                renter_user_id=owner_tg_id,
+                owner_user_id=owner_tg_id,
+                start_date=start_date,
+                end_date=end_date,
+                state=BookingState.paid_confirmed,
+                paid_confirmed_at=now,
+            )
+        )
+        blocked.append(it.name)
+    session.add_all(new_bookings)
+    return blocked, skipped
+
+
+async def _finish_bulk_block(
+    state: FSMContext, message: types.Message, user: CachedUser, start_date: date, end_date: date
+) -> None:
+    data = await state.get_data()
+    item_ids = data.get("bulk_selected") or []
+    await state.finish()
+    if not user.owner_handle or not item_ids:
+        await message.answer("Контекст блокировки потерян, начните заново из «Мои вещи».")
+        return
+
+    blocked, skipped = await submit_write(
+        _insert_bulk_block, user.tg_id, user.owner_handle, item_ids, start_date, end_date
+    )
+    dates_str = f"{start_date.strftime('%d.%m')}–{end_date.strftime('%d.%m')}"
+    lines = []
+    if blocked:
+        lines.append(f"Даты <b>{dates_str}</b> заблокированы для вещей ({len(blocked)}):")
+        lines.extend(f"• {name}" for name in blocked)
+    if skipped:
+        if lines:
+            lines.append("")
+        lines.append("Не заблокированы — в эти даты уже есть брони:")
+        lines.extend(f"• {name}" for name in skipped)
+    if not lines:
+        lines.append("Не удалось найти выбранные вещи.")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+def register_blackout_handlers(dp: Dispatcher) -> None:
+    @dp.callback_query_handler(lambda c: c.data and c.data == "bulkblock:start", state="*")
+    async def bulk_block_start(callback: types.CallbackQuery, state: FSMContext, user: CachedUser) -> None:
+        await callback.answer()
+        if not user.owner_handle:
+            await callback.message.answer("Эта опция доступна только владельцам вещей.")
+            return
+        items = await _load_owner_items(user.owner_handle)
+        if not items:
+            await callback.message.answer("В таблице нет вещей с вашим ником во столбце «Контакт».")
+            return
+
+        selected = [it_id for it_id, _ in items]
+        await state.finish()
+        await BulkBlockStates.choosing_items.set()
+        await state.update_data(bulk_selected=selected)
+        await callback.message.answer(
+            _picker_text(len(selected), len(items)),
+            reply_markup=_items_picker_keyboard(items, set(selected)),
+            parse_mode="HTML",
+        )
+
+    @dp.callback_query_handler(
+        lambda c: c.data and c.data.startswith("bulkblock:"),
+        state=BulkBlockStates.choosing_items,
+    )
+    async def bulk_block_pick(callback: types.CallbackQuery, state: FSMContext, user: CachedUser) -> None:
+        action = callback.data.split(":", 1)[1]
+        items = await _load_owner_items(user.owner_handle) if user.owner_handle else []
+        owned_ids = [it_id for it_id, _ in items]
+        data = await state.get_data()
+        selected = {i for i in (data.get("bulk_selected") or []) if i in owned_ids}
+
+        if action == "dates":
+            if not selected:
+                await callback.answer("Выберите хотя бы одну вещь", show_alert=True)
+                return
+            await callback.answer()
+            today = date.today()
+            await state.update_data(
+                bulk_selected=sorted(selected),
+                cal_step="start",
+                cal_start_date=None,
+            )
+            await BulkBlockStates.waiting_for_dates.set()
+            kb = build_calendar_keyboard(today.year, today.month)
+            await callback.message.edit_text(
+                f"Вещей выбрано: <b>{len(selected)}</b>. Выберите <b>дату начала</b> блокировки:",
+                reply_markup=kb,
+                parse_mode="HTML",
+            )
+            return
+
+        if action == "all":
+            selected = set(owned_ids)
+        elif action == "none":
+            selected = set()
+        elif action.startswith("t:"):
+            raw_id = action[2:]
+            if raw_id.isdigit() and int(raw_id) in owned_ids:
+                selected ^= {int(raw_id)}
+        await callback.answer()
+        await state.update_data(bulk_selected=sorted(selected))
+        try:
+            await callback.message.edit_text(
+                _picker_text(len(selected), len(items)),
+                reply_markup=_items_picker_keyboard(items, selected),
+                parse_mode="HTML",
+            )
+        except Exception:
+            pass
+
+    @dp.callback_query_handler(
+        lambda c: c.data and c.data.startswith("cal:"),
+        state=BulkBlockStates.waiting_for_dates,
+    )
+    async def bulk_block_calendar(callback: types.CallbackQuery, state: FSMContext, user: CachedUser) -> None:
+        parsed = parse_calendar_callback(callback.data)
+        if not parsed:
+            await callback.answer()
+            return
+        action, y, m, val = parsed
+        data = await state.get_data()
+        start_str = data.get("cal_start_date")
+        start_date = date.fromisoformat(start_str) if isinstance(start_str, str) else None
+
+        if action == "nav":
+            new_month = m + val
+            new_year = y
+            if new_month > 12:
+                new_month = 1
+                new_year += 1
+            elif new_month < 1:
+                new_month = 12
+                new_year -= 1
+            kb = build_calendar_keyboard(new_year, new_month, min_date=start_date, one_day_btn=start_date)
+            try:
+                await callback.message.edit_reply_markup(reply_markup=kb)
+            except Exception:
+                pass
+            await callback.answer()
+            return
+
+        sel_date = date(y, m, val)
+        if data.get("cal_step", "start") == "start":
+            await state.update_data(cal_step="end", cal_start_date=sel_date.isoformat())
+            kb = build_calendar_keyboard(y, m, min_date=sel_date, one_day_btn=sel_date)
+            await callback.message.edit_text(
+                f"Дата начала: <b>{sel_date.strftime('%d.%m')}</b>. Выберите <b>дату окончания</b>:",
+                reply_markup=kb,
+                parse_mode="HTML",
+            )
+            await callback.answer()
+            return
+
+        if not start_date or sel_date < start_date:
+            await callback.answer("Дата окончания не может быть раньше начала", show_alert=True)
+            return
+        await callback.answer()
+        await _finish_bulk_block(state, callback.message, user, start_date, sel_date)
+
+    @dp.message_handler(state=BulkBlockStates.waiting_for_dates)
+    async def bulk_block_dates_text(message: types.Message, state: FSMContext, user: CachedUser) -> None:
+        """Ручной ввод дат (ДД.ММ–ДД.ММ) как запасной вариант."""
+        parsed = parse_dates(message.text or "")
+        if not parsed:
+            await message.answer(
+                "Не удалось распознать даты. Используйте календарь выше или введите в формате ДД.ММ–ДД.ММ.",
+            )
+            return
+        await _finish_bulk_block(state, message, user, parsed[0], parsed[1])
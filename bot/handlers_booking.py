@@ -6,16 +6,23 @@ from typing import Optional
 from aiogram import Dispatcher, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from sqlalchemy import and_, or_
-from sqlalchemy.orm import joinedload
+from sqlalchemy import and_, case, func, or_, select, tuple_, union_all, update
+from sqlalchemy.orm import Session, joinedload
 
+from .archive import bookings_with_archive
+from .booking_transitions import BookingEvent, apply_transition
 from .calendar_keyboard import build_calendar_keyboard, parse_calendar_callback
-from .db import db_session
+from .db import async_read_session
 from .keyboards import items_list_keyboard
-from .models import Booking, BookingState, Item, User
-from .payment_reminders import schedule_payment_notifications
-from .users import get_or_create_user
+from .models import ACTIVE_BOOKING_STATES, Booking, BookingArchive, BookingState, Item, User
+from .outbox import enqueue_message, outbox_worker
+from .owners import owner_directory
+from .reminders import push_scheduled, schedule_payment_notifications_many, schedule_refund_notifications
+from .sender import PRIORITY_INTERACTIVE, send_message
+from .statements import statements
+from .users import CachedUser
 from .utils import format_price
+from .writer import submit_write
 
 
 class BookingStates(StatesGroup):
@@ -26,30 +33,46 @@ class BookingStates(StatesGroup):
 class PendingBookingContext:
     item_id: int
     is_self_booking: bool = False
+    # выбрана дата начала — ждём дату окончания
+    start_date: date | None = None
 
+    def pack(self) -> list:
+        """Компактный вид для FSM: [item_id, self, дата начала или None]."""
+        return [self.item_id, int(self.is_self_booking), self.start_date.isoformat() if self.start_date else None]
 
-def _get_blocked_dates_for_item(item_id: int, year: int, month: int) -> set[date]:
+    @classmethod
+    def unpack(cls, raw) -> "PendingBookingContext | None":
+        if not raw:
+            return None
+        if isinstance(raw, dict):
+            # сохранено до компактного формата
+            return cls(raw["item_id"], raw.get("is_self_booking", False))
+        item_id, is_self_booking, start = raw
+        return cls(item_id, bool(is_self_booking), date.fromisoformat(start) if start else None)
+
+
+async def _get_blocked_dates_for_item(item_id: int, year: int, month: int) -> set[date]:
     """Возвращает занятые даты для вещи в указанном месяце."""
     first = date(year, month, 1)
     last_day = cal_mod.monthrange(year, month)[1]
     last = date(year, month, last_day)
-    with db_session() as session:
+    async with async_read_session() as session:
         bookings = (
-            session.query(Booking)
-            .filter(
-                Booking.item_id == item_id,
-                Booking.state.in_(
-                    [
-                        BookingState.pending_owner_confirm,
-                        BookingState.confirmed_unpaid,
-                        BookingState.paid_confirmed,
-                    ]
-                ),
-                Booking.start_date <= last,
-                Booking.end_date >= first,
+            await session.execute(
+                select(Booking.start_date, Booking.end_date).where(
+                    Booking.item_id == item_id,
+                    Booking.state.in_(
+                        [
+                            BookingState.pending_owner_confirm,
+                            BookingState.confirmed_unpaid,
+                            BookingState.paid_confirmed,
+                        ]
+                    ),
+                    Booking.start_date <= last,
+                    Booking.end_date >= first,
+                )
             )
-            .all()
-        )
+        ).all()
         result = set()
         for b in bookings:
             start = max(b.start_date, first)
@@ -61,98 +84,57 @@ def _get_blocked_dates_for_item(item_id: int, year: int, month: int) -> set[date
         return result
 
 
-async def _do_booking(
-    state: FSMContext,
-    message: types.Message,
-    tg_user,
-    ctx: PendingBookingContext,
+def _insert_booking(
+    session: Session,
+    item_id: int,
+    renter_id: int,
     start_date: date,
     end_date: date,
-) -> None:
-    """Выполняет создание бронирования после выбора дат."""
-    renter = get_or_create_user(tg_user)
-
-    with db_session() as session:
-        item = session.query(Item).get(ctx.item_id)
-        if not item:
-            await state.finish()
-            await message.answer("Вещь больше не найдена в базе.")
-            return
-
-        overlapping = (
-            session.query(Booking)
-            .filter(
-                Booking.item_id == item.id,
-                Booking.state.in_(
-                    [
-                        BookingState.pending_owner_confirm,
-                        BookingState.confirmed_unpaid,
-                        BookingState.paid_confirmed,
-                    ]
-                ),
-                or_(
-                    and_(Booking.start_date <= start_date, Booking.end_date >= start_date),
-                    and_(Booking.start_date <= end_date, Booking.end_date >= end_date),
-                    and_(Booking.start_date >= start_date, Booking.end_date <= end_date),
-                ),
-            )
-            .first()
-        )
-
-        if overlapping:
-            await message.answer(
-                "В эти даты вещь уже занята. Попробуйте выбрать другой диапазон дат.",
-            )
-            return
-
-        if ctx.is_self_booking:
-            booking = Booking(
-                item_id=item.id,
-                renter_user_id=renter.tg_id,
-                owner_user_id=renter.tg_id,
-                start_date=start_date,
-                end_date=end_date,
-                state=BookingState.paid_confirmed,
-                paid_confirmed_at=datetime.utcnow(),
-            )
-            session.add(booking)
-            await state.finish()
-            await message.answer(
-                f"Вы заблокировали даты <b>{item.name}</b>: "
-                f"{start_date.strftime('%d.%m')}–{end_date.strftime('%d.%m')}.",
-                parse_mode="HTML",
-            )
-            return
-
-        owner_user: User | None = (
-            session.query(User).filter(User.owner_handle == item.owner_handle).one_or_none()
-        )
-
+    is_self_booking: bool,
+    renter_label: str = "",
+) -> tuple[Item | None, Booking | None, int | None, list[int]]:
+    """
+    Проверка пересечений и вставка брони одной операцией писателя.
+    Запрос владельцу кладётся в outbox той же транзакцией.
+    Возвращает (вещь, новая бронь или None при пересечении, Telegram id владельца,
+    id запроса в outbox для deliver_now).
+    """
+    item = session.get(Item, item_id)
+    if not item:
+        return None, None, None, []
+
+    overlapping = statements.execute(
+        session, "booking_overlap", item_id=item.id, start_date=start_date, end_date=end_date
+    ).first()
+    if overlapping:
+        return item, None, None, []
+
+    if is_self_booking:
         booking = Booking(
             item_id=item.id,
-            renter_user_id=renter.tg_id,
-            owner_user_id=owner_user.tg_id if owner_user else renter.tg_id,
+            renter_user_id=renter_id,
+            owner_user_id=renter_id,
             start_date=start_date,
             end_date=end_date,
-            state=BookingState.pending_owner_confirm,
+            state=BookingState.paid_confirmed,
+            paid_confirmed_at=datetime.utcnow(),
         )
         session.add(booking)
-
-    await state.finish()
-
-    text_summary = (
-        f"Вы хотите забронировать <b>{item.name}</b>\n"
-        f"Даты: <b>{start_date.strftime('%d.%m')}–{end_date.strftime('%d.%m')}</b>\n"
-        f"Цена: <b>{format_price(item.price_raw)}</b>\n"
-        f"Район: {item.area or 'не указан'}\n"
-        f"Владелец: {item.owner_handle}\n"
+        session.flush()
+        return item, booking, None, []
+
+    owner_id = owner_directory.resolve(session, item.owner_handle)
+    booking = Booking(
+        item_id=item.id,
+        renter_user_id=renter_id,
+        owner_user_id=owner_id or renter_id,
+        start_date=start_date,
+        end_date=end_date,
+        state=BookingState.pending_owner_confirm,
     )
-    await message.answer(
-        text_summary + "\nЗапрос на бронирование отправлен владельцу, ждём подтверждения.",
-        parse_mode="HTML",
-    )
-
-    if owner_user and owner_user.tg_id != renter.tg_id:
+    session.add(booking)
+    session.flush()
+    if owner_id and owner_id != renter_id:
         btns = types.InlineKeyboardMarkup()
         btns.add(
             types.InlineKeyboardButton(
@@ -164,17 +146,79 @@ async def _do_booking(
                 callback_data=f"owner_decline:{booking.id}",
             ),
         )
-        await message.bot.send_message(
-            owner_user.tg_id,
+        # Запрос ждёт решения владельца — отправляем сразу из этого процесса, без окна дайджеста
+        request = enqueue_message(
+            session,
+            owner_id,
             (
-                f"Новый запрос на бронь от @{tg_user.username or tg_user.id}.\n\n"
+                f"Новый запрос на бронь от @{renter_label}.\n\n"
                 f"Вещь: {item.name}\n"
                 f"Даты: {start_date.strftime('%d.%m')}–{end_date.strftime('%d.%m')}\n"
                 f"Цена: {format_price(item.price_raw)}\n"
             ),
             reply_markup=btns,
+            priority=PRIORITY_INTERACTIVE,
+            claimed=True,
+        )
+        session.flush()
+        return item, booking, owner_id, [request.id]
+    return item, booking, owner_id, []
+
+
+async def _do_booking(
+    state: FSMContext,
+    message: types.Message,
+    renter: CachedUser,
+    ctx: PendingBookingContext,
+    start_date: date,
+    end_date: date,
+) -> None:
+    """Выполняет создание бронирования после выбора дат."""
+    item, booking, owner_id, outbox_ids = await submit_write(
+        _insert_booking,
+        ctx.item_id,
+        renter.tg_id,
+        start_date,
+        end_date,
+        ctx.is_self_booking,
+        renter.username or str(renter.tg_id),
+    )
+    if not item:
+        await state.finish()
+        await message.answer("Вещь больше не найдена в базе.")
+        return
+
+    if booking is None:
+        await message.answer(
+            "В эти даты вещь уже занята. Попробуйте выбрать другой диапазон дат.",
+        )
+        return
+
+    if ctx.is_self_booking:
+        await state.finish()
+        await message.answer(
+            f"Вы заблокировали даты <b>{item.name}</b>: "
+            f"{start_date.strftime('%d.%m')}–{end_date.strftime('%d.%m')}.",
+            parse_mode="HTML",
         )
-        schedule_payment_notifications(booking.id)
+        return
+
+    await state.finish()
+
+    text_summary = (
+        f"Вы хотите забронировать <b>{item.name}</b>\n"
+        f"Даты: <b>{start_date.strftime('%d.%m')}–{end_date.strftime('%d.%m')}</b>\n"
+        f"Цена: <b>{format_price(item.price_raw)}</b>\n"
+        f"Район: {item.area or 'не указан'}\n"
+        f"Владелец: {item.owner_handle}\n"
+    )
+    await message.answer(
+        text_summary + "\nЗапрос на бронирование отправлен владельцу, ждём подтверждения.",
+        parse_mode="HTML",
+    )
+
+    if owner_id and owner_id != renter.tg_id:
+        outbox_worker.deliver_now(message.bot, outbox_ids)
     else:
         await message.answer(
             "Владелец ещё не запускал бота, поэтому я не могу отправить ему запрос.\n"
@@ -202,83 +246,358 @@ def parse_dates(text: str) -> Optional[tuple[date, date]]:
     return start, end
 
 
+MY_BOOKINGS_HISTORY_PREVIEW = 5
+MY_BOOKINGS_HISTORY_PAGE = 10
+
+_RENTER_STATE_LABELS = {
+    BookingState.pending_owner_confirm: "ожидает подтверждения владельца",
+    BookingState.confirmed_unpaid: "подтверждена, оплата не подтверждена",
+    BookingState.paid_confirmed: "подтверждена и оплачена",
+    BookingState.canceled_by_owner: "отменена владельцем",
+    BookingState.canceled_by_renter: "отменена вами",
+    BookingState.canceled_unpaid_timeout: "отменена из‑за неоплаты",
+}
+
+
+def _renter_booking_line(row) -> str:
+    item_name = row.item_name or "Вещь (удалена)"
+    label = _RENTER_STATE_LABELS.get(row.state, row.state.value)
+    return f"{item_name} — {row.start_date.strftime('%d.%m')}–{row.end_date.strftime('%d.%m')} ({label})"
+
+
+def _renter_bookings_select():
+    """Проекция брони арендатора с названием вещи — без загрузки ORM-объектов."""
+    return select(
+        Booking.id,
+        Booking.start_date,
+        Booking.end_date,
+        Booking.state,
+        Item.name.label("item_name"),
+    ).outerjoin(Item, Item.id == Booking.item_id)
+
+
+async def _renter_upcoming(session, renter_id: int, today: date) -> list:
+    rows = await session.execute(
+        _renter_bookings_select()
+        .where(
+            Booking.renter_user_id == renter_id,
+            Booking.state.in_(ACTIVE_BOOKING_STATES),
+            Booking.end_date >= today,
+        )
+        .order_by(Booking.start_date.asc(), Booking.id.asc())
+    )
+    return rows.all()
+
+
+async def _renter_history_page(
+    session, renter_id: int, today: date, cursor: tuple[date, int] | None, limit: int
+) -> tuple[list, tuple[date, int] | None]:
+    """
+    Страница истории (от новых к старым). cursor — (start_date, id) последней
+    показанной строки. Возвращает (строки, курсор следующей страницы или None).
+    """
+    # Как в _item_history_page: поиск, сортировка и LIMIT — в каждой таблице по индексу
+    # (renter_user_id, start_date), наружу UNION ALL отдаёт не больше 2 × (limit + 1) строк
+    legs = []
+    for model in (Booking, BookingArchive):
+        leg = select(
+            model.id, model.item_id, model.start_date, model.end_date, model.state
+        ).where(
+            model.renter_user_id == renter_id,
+            or_(model.state.notin_(ACTIVE_BOOKING_STATES), model.end_date < today),
+        )
+        if cursor:
+            leg = leg.where(tuple_(model.start_date, model.id) < tuple_(cursor[0], cursor[1]))
+        leg = leg.order_by(model.start_date.desc(), model.id.desc()).limit(limit + 1)
+        legs.append(select(leg.subquery()))
+    h = union_all(*legs).subquery("renter_history")
+    q = (
+        select(h.c.id, h.c.start_date, h.c.end_date, h.c.state, Item.name.label("item_name"))
+        .outerjoin(Item, Item.id == h.c.item_id)
+        .order_by(h.c.start_date.desc(), h.c.id.desc())
+        .limit(limit + 1)
+    )
+    rows = (await session.execute(q)).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, (rows[-1].start_date, rows[-1].id)
+    return rows, None
+
+
+def _parse_history_cursor(raw: str) -> tuple[date, int] | None:
+    parts = raw.split(":")
+    if len(parts) != 2:
+        return None
+    try:
+        return date.fromisoformat(parts[0]), int(parts[1])
+    except ValueError:
+        return None
+
+
+ITEM_HISTORY_PAGE = 10
+ITEM_HISTORY_UPCOMING = "up"
+ITEM_HISTORY_PAST = "past"
+ITEM_HISTORY_CANCELED = "cnl"
+ITEM_HISTORY_FILTERS = {
+    ITEM_HISTORY_UPCOMING: "Предстоящие",
+    ITEM_HISTORY_PAST: "Прошедшие",
+    ITEM_HISTORY_CANCELED: "Отменённые",
+}
+
+_OWNER_STATE_LABELS = {
+    BookingState.pending_owner_confirm: "ожидает подтверждения",
+    BookingState.confirmed_unpaid: "ожидает оплаты",
+    BookingState.paid_confirmed: "оплачена",
+    BookingState.canceled_by_owner: "отменена владельцем",
+    BookingState.canceled_by_renter: "отменена арендатором",
+    BookingState.canceled_unpaid_timeout: "отменена (неоплата)",
+}
+
+
+def _item_history_condition(cols, flt: str, today: date):
+    active = cols.state.in_(ACTIVE_BOOKING_STATES)
+    if flt == ITEM_HISTORY_UPCOMING:
+        return and_(active, cols.end_date >= today)
+    if flt == ITEM_HISTORY_PAST:
+        return and_(active, cols.end_date < today)
+    return cols.state.notin_(ACTIVE_BOOKING_STATES)
+
+
+def _item_history_source():
+    return bookings_with_archive("id", "item_id", "renter_user_id", "start_date", "end_date", "state")
+
+
+async def _item_history_counts(session, item_id: int, today: date) -> dict[str, int]:
+    """Количество броней вещи по фильтрам (включая архив) — одним агрегирующим запросом."""
+    h = _item_history_source()
+    row = (
+        await session.execute(
+            select(
+                *(
+                    func.coalesce(func.sum(case((_item_history_condition(h.c, flt, today), 1), else_=0)), 0)
+                    for flt in ITEM_HISTORY_FILTERS
+                )
+            ).where(h.c.item_id == item_id)
+        )
+    ).one()
+    return dict(zip(ITEM_HISTORY_FILTERS, (int(v) for v in row)))
+
+
+async def _item_history_page(
+    session, item_id: int, flt: str, direction: str | None, cursor: tuple[date, int] | None, today: date
+) -> tuple[list, bool, bool]:
+    """
+    Страница броней вещи (рабочая таблица + архив) с поиском по индексу (item_id, start_date).
+    Предстоящие идут по возрастанию даты, прошедшие и отменённые — по убыванию.
+    direction: None — первая страница, "n" — после cursor, "p" — до cursor.
+    Возвращает (строки, есть_предыдущая, есть_следующая).
+    """
+    ascending = flt == ITEM_HISTORY_UPCOMING
+    backwards = direction == "p"
+    forward_order = ascending != backwards
+
+    def ordered(*columns):
+        if forward_order:
+            return [c.asc() for c in columns]
+        return [c.desc() for c in columns]
+
+    # Поиск, сортировка и LIMIT — внутри каждой таблицы, чтобы оба запроса шли по индексу
+    # (item_id, start_date); UNION ALL сливает не больше 2 × (страница + 1) строк
+    legs = []
+    for model in (Booking, BookingArchive):
+        leg = select(
+            model.id, model.start_date, model.end_date, model.state, model.renter_user_id
+        ).where(model.item_id == item_id, _item_history_condition(model, flt, today))
+        if cursor:
+            key, bound = tuple_(model.start_date, model.id), tuple_(cursor[0], cursor[1])
+            leg = leg.where(key > bound if forward_order else key < bound)
+        leg = leg.order_by(*ordered(model.start_date, model.id)).limit(ITEM_HISTORY_PAGE + 1)
+        legs.append(select(leg.subquery()))
+    h = union_all(*legs).subquery("booking_history")
+    q = (
+        select(
+            h.c.id,
+            h.c.start_date,
+            h.c.end_date,
+            h.c.state,
+            h.c.renter_user_id,
+            User.username.label("renter_username"),
+        )
+        .outerjoin(User, User.tg_id == h.c.renter_user_id)
+        .order_by(*ordered(h.c.start_date, h.c.id))
+    )
+    rows = (await session.execute(q.limit(ITEM_HISTORY_PAGE + 1))).all()
+    has_more = len(rows) > ITEM_HISTORY_PAGE
+    rows = rows[:ITEM_HISTORY_PAGE]
+    if backwards:
+        return list(reversed(rows)), has_more, True
+    return rows, direction == "n", has_more
+
+
+async def _render_item_history(
+    item: Item, counts: dict[str, int], flt: str, direction: str | None, cursor: tuple[date, int] | None
+) -> tuple[str, types.InlineKeyboardMarkup]:
+    async with async_read_session() as session:
+        rows, has_prev, has_next = await _item_history_page(
+            session, item.id, flt, direction, cursor, date.today()
+        )
+
+    lines = [f"<b>Бронирования «{item.name}»</b> · {ITEM_HISTORY_FILTERS[flt].lower()}", ""]
+    for r in rows:
+        dates_str = f"{r.start_date.strftime('%d.%m.%y')}–{r.end_date.strftime('%d.%m.%y')}"
+        renter_str = f"@{r.renter_username}" if r.renter_username else f"id{r.renter_user_id}"
+        lines.append(f"• {dates_str} · {renter_str} · {_OWNER_STATE_LABELS.get(r.state, str(r.state))}")
+    if not rows:
+        lines.append("Нет бронирований.")
+
+    kb = types.InlineKeyboardMarkup()
+    kb.row(
+        *(
+            types.InlineKeyboardButton(
+                text=f"{'✓ ' if key == flt else ''}{label} ({counts[key]})",
+                callback_data=f"ib:{item.id}:{key}",
+            )
+            for key, label in ITEM_HISTORY_FILTERS.items()
+        )
+    )
+    nav = []
+    if has_prev and rows:
+        first = rows[0]
+        nav.append(
+            types.InlineKeyboardButton(
+                text="◀ Назад", callback_data=f"ib:{item.id}:{flt}:p:{first.start_date.isoformat()}:{first.id}"
+            )
+        )
+    if has_next and rows:
+        last = rows[-1]
+        nav.append(
+            types.InlineKeyboardButton(
+                text="Дальше ▶", callback_data=f"ib:{item.id}:{flt}:n:{last.start_date.isoformat()}:{last.id}"
+            )
+        )
+    if nav:
+        kb.row(*nav)
+    return "\n".join(lines), kb
+
+
+def _owner_confirm(session: Session, booking_id: int, owner_id: int):
+    """
+    Подтверждение владельцем и расписание напоминаний об оплате — одной транзакцией.
+    Возвращает (строка перехода или None, моменты напоминаний для push_scheduled).
+    """
+    row = apply_transition(session, booking_id, BookingEvent.owner_confirm, owner_id)
+    if row is None:
+        return None, []
+    # Строка RETURNING уже в confirmed_unpaid и с датой начала — бронь не перечитываем
+    return row, schedule_payment_notifications_many(session, [row])
+
+
+def _renter_cancel(session: Session, booking_id: int, renter_id: int):
+    """
+    Отмена арендатором. Если бронь была оплачена — сразу планируем напоминания
+    подтвердить возврат (первое сообщение уходит из хендлера немедленно).
+    Возвращает (строка перехода или None, моменты напоминаний для push_scheduled).
+    """
+    row = apply_transition(session, booking_id, BookingEvent.renter_cancel, renter_id)
+    times: list[datetime] = []
+    if row is not None and row.paid_confirmed_at is not None:
+        now = datetime.utcnow()
+        times = schedule_refund_notifications(session, booking_id, now)
+        session.execute(update(Booking).where(Booking.id == booking_id).values(last_refund_reminder_at=now))
+    return row, times
+
+
+ALREADY_HANDLED_TEXT = "Бронь уже обработана."
+
+
+def _booking_dates(row) -> str:
+    return f"{row.start_date.strftime('%d.%m')}–{row.end_date.strftime('%d.%m')}"
+
+
+def renter_confirmed_text(row) -> str:
+    """Сообщение арендатору о подтверждении (row — строка RETURNING перехода)."""
+    return (
+        f"Владелец подтвердил вашу бронь:\n"
+        f"Вещь: {row.item_name}\n"
+        f"Даты: {_booking_dates(row)}\n"
+        f"Цена: {format_price(row.item_price_raw)}\n"
+        f"Свяжитесь с владельцем @{row.item_owner_handle.lstrip('@')} для оплаты."
+    )
+
+
+def renter_declined_text(row) -> str:
+    return (
+        f"Владелец отклонил вашу бронь:\n"
+        f"Вещь: {row.item_name}\n"
+        f"Даты: {_booking_dates(row)}"
+    )
+
+
+def _buttons_without_booking(markup: types.InlineKeyboardMarkup | None, booking_id: int) -> list[list]:
+    if not markup:
+        return []
+    suffix = f":{booking_id}"
+    rows = [[b for b in row if not (b.callback_data or "").endswith(suffix)] for row in markup.inline_keyboard]
+    return [row for row in rows if row]
+
+
+async def _close_booking_message(callback: types.CallbackQuery, booking_id: int, text: str) -> None:
+    """
+    Отметить действие по брони в сообщении с кнопками. В дайджесте (outbox) кнопки
+    других броней остаются, убираются только кнопки этой, а итог приходит ответом.
+    """
+    rest = _buttons_without_booking(callback.message.reply_markup, booking_id)
+    if not rest:
+        await callback.message.edit_text(text)
+        return
+    await callback.message.edit_reply_markup(reply_markup=types.InlineKeyboardMarkup(inline_keyboard=rest))
+    await callback.message.answer(text)
+
+
+async def _answer_conflict(callback: types.CallbackQuery, booking_id: int) -> None:
+    rest = _buttons_without_booking(callback.message.reply_markup, booking_id)
+    try:
+        await callback.message.edit_reply_markup(
+            reply_markup=types.InlineKeyboardMarkup(inline_keyboard=rest) if rest else None
+        )
+    except Exception:
+        pass
+    await callback.message.answer(ALREADY_HANDLED_TEXT)
+
+
 def register_booking_handlers(dp: Dispatcher) -> None:
     @dp.message_handler(lambda m: m.text and "Мои бронирования" in m.text, state="*")
-    async def my_bookings(message: types.Message, state: FSMContext) -> None:
+    async def my_bookings(message: types.Message, state: FSMContext, user: CachedUser) -> None:
         await state.finish()
-        user = get_or_create_user(message.from_user)
 
         today = date.today()
-        with db_session() as session:
-            bookings = (
-                session.query(Booking)
-                .filter(Booking.renter_user_id == user.tg_id)
-                .order_by(Booking.start_date.asc())
-                .all()
+        async with async_read_session() as session:
+            upcoming = await _renter_upcoming(session, user.tg_id, today)
+            history, next_cursor = await _renter_history_page(
+                session, user.tg_id, today, None, MY_BOOKINGS_HISTORY_PREVIEW
             )
 
-            if not bookings:
-                text_to_send = "У вас пока нет броней."
-                confirmed_unpaid_list = []
-                cancelable_list = []
-            else:
-                def state_label(state: BookingState) -> str:
-                    return {
-                        BookingState.pending_owner_confirm: "ожидает подтверждения владельца",
-                        BookingState.confirmed_unpaid: "подтверждена, оплата не подтверждена",
-                        BookingState.paid_confirmed: "подтверждена и оплачена",
-                        BookingState.canceled_by_owner: "отменена владельцем",
-                        BookingState.canceled_by_renter: "отменена вами",
-                        BookingState.canceled_unpaid_timeout: "отменена из‑за неоплаты",
-                    }.get(state, state.value)
-
-                lines_upcoming: list[str] = []
-                lines_history: list[str] = []
-
-                for b in bookings:
-                    item_name = b.item.name if b.item else "Вещь (удалена)"
-                    line = (
-                        f"{item_name} — {b.start_date.strftime('%d.%m')}–{b.end_date.strftime('%d.%m')} "
-                        f"({state_label(b.state)})"
-                    )
-                    if b.end_date >= today and b.state not in {
-                        BookingState.canceled_by_owner,
-                        BookingState.canceled_by_renter,
-                        BookingState.canceled_unpaid_timeout,
-                    }:
-                        lines_upcoming.append(line)
-                    else:
-                        lines_history.append(line)
-
-                text_parts = []
-                if lines_upcoming:
-                    text_parts.append("<b>Текущие и будущие брони:</b>")
-                    text_parts.extend(f"• {l}" for l in lines_upcoming)
-                if lines_history:
-                    if text_parts:
-                        text_parts.append("")
-                    text_parts.append("<b>История:</b>")
-                    text_parts.extend(f"• {l}" for l in lines_history)
-
-                text_to_send = "\n".join(text_parts)
-
-                # Кнопки «Я оплатил» и «Отменить» для броней (с датами для различения)
-                confirmed_unpaid_list = [
-                    (b.id, (b.item.name if b.item else "Вещь"), b.start_date, b.end_date)
-                    for b in bookings
-                    if b.state == BookingState.confirmed_unpaid and b.end_date >= today
-                ]
-                cancelable_list = [
-                    (b.id, (b.item.name if b.item else "Вещь"), b.start_date, b.end_date, b.state)
-                    for b in bookings
-                    if b.state
-                    in (
-                        BookingState.pending_owner_confirm,
-                        BookingState.confirmed_unpaid,
-                        BookingState.paid_confirmed,
-                    )
-                    and b.end_date >= today
-                ]
+        if not upcoming and not history:
+            text_to_send = "У вас пока нет броней."
+        else:
+            text_parts = []
+            if upcoming:
+                text_parts.append("<b>Текущие и будущие брони:</b>")
+                text_parts.extend(f"• {_renter_booking_line(r)}" for r in upcoming)
+            if history:
+                if text_parts:
+                    text_parts.append("")
+                text_parts.append("<b>История:</b>")
+                text_parts.extend(f"• {_renter_booking_line(r)}" for r in history)
+            text_to_send = "\n".join(text_parts)
+
+        # Кнопки «Я оплатил» и «Отменить» для броней (с датами для различения)
+        confirmed_unpaid_list = [
+            (r.id, r.item_name or "Вещь", r.start_date, r.end_date)
+            for r in upcoming
+            if r.state == BookingState.confirmed_unpaid
+        ]
+        cancelable_list = [(r.id, r.item_name or "Вещь", r.start_date, r.end_date, r.state) for r in upcoming]
 
         reply_markup = None
         if confirmed_unpaid_list or cancelable_list:
@@ -300,13 +619,46 @@ def register_booking_handlers(dp: Dispatcher) -> None:
                     )
                 )
             reply_markup = kb
+        if next_cursor:
+            reply_markup = reply_markup or types.InlineKeyboardMarkup()
+            reply_markup.add(types.InlineKeyboardButton(text="📜 Вся история", callback_data="mybk_h:"))
 
         await message.answer(text_to_send, parse_mode="HTML", reply_markup=reply_markup)
 
+    @dp.callback_query_handler(lambda c: c.data and c.data.startswith("mybk_h:"), state="*")
+    async def my_bookings_history(callback: types.CallbackQuery) -> None:
+        """Страница истории броней арендатора (keyset по дате начала и id)."""
+        await callback.answer()
+        cursor = _parse_history_cursor(callback.data.split(":", 1)[1])
+        today = date.today()
+        async with async_read_session() as session:
+            rows, next_cursor = await _renter_history_page(
+                session, callback.from_user.id, today, cursor, MY_BOOKINGS_HISTORY_PAGE
+            )
+
+        lines = ["<b>История броней</b>", ""]
+        lines.extend(f"• {_renter_booking_line(r)}" for r in rows)
+        if not rows:
+            lines.append("Больше броней нет.")
+        kb = types.InlineKeyboardMarkup()
+        if cursor:
+            kb.insert(types.InlineKeyboardButton(text="⏮ В начало", callback_data="mybk_h:"))
+        if next_cursor:
+            kb.insert(
+                types.InlineKeyboardButton(
+                    text="Дальше ▶",
+                    callback_data=f"mybk_h:{next_cursor[0].isoformat()}:{next_cursor[1]}",
+                )
+            )
+        text = "\n".join(lines)
+        if cursor:
+            await callback.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
+        else:
+            await callback.message.answer(text, parse_mode="HTML", reply_markup=kb)
+
     @dp.message_handler(lambda m: m.text and "Мои вещи" in m.text, state="*")
-    async def my_items(message: types.Message, state: FSMContext) -> None:
+    async def my_items(message: types.Message, state: FSMContext, user: CachedUser) -> None:
         await state.finish()
-        user = get_or_create_user(message.from_user)
 
         if not user.owner_handle:
             await message.answer(
@@ -315,13 +667,14 @@ def register_booking_handlers(dp: Dispatcher) -> None:
             )
             return
 
-        with db_session() as session:
+        async with async_read_session() as session:
             items = (
-                session.query(Item)
-                .filter(Item.owner_handle == user.owner_handle)
-                .order_by(Item.name.asc())
-                .all()
-            )
+                await session.execute(
+                    select(Item.id, Item.name, Item.price_raw)
+                    .where(Item.owner_handle == user.owner_handle)
+                    .order_by(Item.name.asc())
+                )
+            ).all()
 
         if not items:
             await message.answer(
@@ -331,24 +684,48 @@ def register_booking_handlers(dp: Dispatcher) -> None:
             return
 
         kb_items = [(it.id, f"{it.name} · {format_price(it.price_raw)}") for it in items]
+        items_kb = items_list_keyboard(kb_items)
+        if len(items) > 1:
+            items_kb.add(
+                types.InlineKeyboardButton(
+                    text="🗓 Заблокировать даты для нескольких вещей",
+                    callback_data="bulkblock:start",
+                )
+            )
+        async with async_read_session() as session:
+            pending = await session.scalar(
+                select(func.count(Booking.id)).where(
+                    Booking.owner_user_id == user.tg_id,
+                    Booking.renter_user_id != user.tg_id,
+                    Booking.state == BookingState.pending_owner_confirm,
+                )
+            )
+        if pending:
+            items_kb.add(
+                types.InlineKeyboardButton(
+                    text=f"📥 Запросы на бронь ({pending})",
+                    callback_data="inbox:open",
+                )
+            )
         await message.answer(
             "Нажмите на вещь, чтобы открыть карточку:",
-            reply_markup=items_list_keyboard(kb_items),
+            reply_markup=items_kb,
         )
 
         # Брони, ожидающие подтверждения оплаты
-        with db_session() as session:
+        async with async_read_session() as session:
             unpaid = (
-                session.query(Booking)
-                .options(joinedload(Booking.renter), joinedload(Booking.item))
-                .filter(
-                    Booking.owner_user_id == user.tg_id,
-                    Booking.state == BookingState.confirmed_unpaid,
-                    Booking.end_date >= date.today(),
+                await session.scalars(
+                    select(Booking)
+                    .options(joinedload(Booking.renter), joinedload(Booking.item))
+                    .where(
+                        Booking.owner_user_id == user.tg_id,
+                        Booking.state == BookingState.confirmed_unpaid,
+                        Booking.end_date >= date.today(),
+                    )
+                    .order_by(Booking.start_date.asc())
                 )
-                .order_by(Booking.start_date.asc())
-                .all()
-            )
+            ).all()
 
         if unpaid:
             pay_kb = types.InlineKeyboardMarkup()
@@ -380,7 +757,7 @@ def register_booking_handlers(dp: Dispatcher) -> None:
             )
 
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("item_bookings:"), state="*")
-    async def handle_item_bookings(callback: types.CallbackQuery) -> None:
+    async def handle_item_bookings(callback: types.CallbackQuery, user: CachedUser) -> None:
         """Показать все бронирования вещи (даты + арендатор)."""
         await callback.answer()
         _, raw_id = callback.data.split(":", 1)
@@ -389,51 +766,53 @@ def register_booking_handlers(dp: Dispatcher) -> None:
         except ValueError:
             return
 
-        with db_session() as session:
-            item = session.query(Item).get(item_id)
+        async with async_read_session() as session:
+            item = await session.get(Item, item_id)
         if not item:
             await callback.message.answer("Эта вещь больше не найдена в базе.")
             return
 
-        user = get_or_create_user(callback.from_user)
-        if not user.owner_handle or user.owner_handle.lower() != item.owner_handle.lower():
+        if not user.owner_handle or user.owner_handle != item.owner_handle:
             await callback.message.answer("Эта опция доступна только владельцу вещи.")
             return
 
-        with db_session() as session:
-            bookings = (
-                session.query(Booking)
-                .options(joinedload(Booking.renter))
-                .filter(Booking.item_id == item_id)
-                .order_by(Booking.start_date.desc())
-                .all()
-            )
-
-        if not bookings:
+        async with async_read_session() as session:
+            counts = await _item_history_counts(session, item_id, date.today())
+        if not any(counts.values()):
             await callback.message.answer(f"У «{item.name}» пока нет бронирований.")
             return
 
-        def _state_label(s: BookingState) -> str:
-            labels = {
-                BookingState.pending_owner_confirm: "ожидает подтверждения",
-                BookingState.confirmed_unpaid: "ожидает оплаты",
-                BookingState.paid_confirmed: "оплачена",
-                BookingState.canceled_by_owner: "отменена владельцем",
-                BookingState.canceled_by_renter: "отменена арендатором",
-                BookingState.canceled_unpaid_timeout: "отменена (неоплата)",
-            }
-            return labels.get(s, str(s))
+        flt = ITEM_HISTORY_UPCOMING if counts[ITEM_HISTORY_UPCOMING] else ITEM_HISTORY_PAST
+        text, kb = await _render_item_history(item, counts, flt, None, None)
+        await callback.message.answer(text, parse_mode="HTML", reply_markup=kb)
 
-        lines = [f"<b>Бронирования «{item.name}»</b>", ""]
-        for b in bookings:
-            dates_str = f"{b.start_date.strftime('%d.%m')}–{b.end_date.strftime('%d.%m')}"
-            renter_str = "—"
-            if b.renter:
-                renter_str = f"@{b.renter.username}" if b.renter.username else f"id{b.renter.tg_id}"
-            state_str = _state_label(b.state)
-            lines.append(f"• {dates_str} · {renter_str} · {state_str}")
+    @dp.callback_query_handler(lambda c: c.data and c.data.startswith("ib:"), state="*")
+    async def handle_item_bookings_page(callback: types.CallbackQuery, user: CachedUser) -> None:
+        """Фильтр и листание истории бронирований вещи: ib:<item>:<фильтр>[:<n|p>:<дата>:<id>]."""
+        await callback.answer()
+        parts = callback.data.split(":")
+        if len(parts) < 3 or not parts[1].isdigit() or parts[2] not in ITEM_HISTORY_FILTERS:
+            return
+        item_id, flt = int(parts[1]), parts[2]
+        direction, cursor = None, None
+        if len(parts) == 6 and parts[3] in ("n", "p"):
+            direction, cursor = parts[3], _parse_history_cursor(f"{parts[4]}:{parts[5]}")
+
+        async with async_read_session() as session:
+            item = await session.get(Item, item_id)
+            counts = await _item_history_counts(session, item_id, date.today()) if item else None
+        if not item:
+            await callback.message.answer("Эта вещь больше не найдена в базе.")
+            return
+        if not user.owner_handle or user.owner_handle != item.owner_handle:
+            await callback.message.answer("Эта опция доступна только владельцу вещи.")
+            return
 
-        await callback.message.answer("\n".join(lines), parse_mode="HTML")
+        text, kb = await _render_item_history(item, counts, flt, direction, cursor)
+        try:
+            await callback.message.edit_text(text, parse_mode="HTML", reply_markup=kb)
+        except Exception:
+            pass
 
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("book:"), state="*")
     async def handle_book_start(callback: types.CallbackQuery, state: FSMContext) -> None:
@@ -444,21 +823,23 @@ def register_booking_handlers(dp: Dispatcher) -> None:
         except ValueError:
             return
 
-        with db_session() as session:
-            item = session.query(Item).get(item_id)
+        async with async_read_session() as session:
+            item = await session.get(Item, item_id)
         if not item:
             await callback.message.answer("Эта вещь больше не найдена в базе.")
             return
+        # Запрос владельцу отправить некому — сообщаем сразу, а не после выбора дат
+        if not (owner_directory.item_owner(item.id) or await owner_directory.aresolve(item.owner_handle)):
+            await callback.message.answer(
+                "Владелец ещё не запускал бота, поэтому я не могу отправить ему запрос.\n"
+                f"Пока что свяжитесь с ним напрямую: {item.owner_handle}",
+            )
+            return
 
         today = date.today()
-        await state.update_data(
-            pending_booking=PendingBookingContext(item_id=item_id, is_self_booking=False).__dict__,
-            cal_step="start",
-            cal_year=today.year,
-            cal_month=today.month,
-        )
+        await state.set_data({"pending_booking": PendingBookingContext(item_id, is_self_booking=False).pack()})
         await BookingStates.waiting_for_dates.set()
-        blocked = _get_blocked_dates_for_item(item_id, today.year, today.month)
+        blocked = await _get_blocked_dates_for_item(item_id, today.year, today.month)
         kb = build_calendar_keyboard(today.year, today.month, blocked_dates=blocked)
         await callback.message.answer(
             "Выберите <b>дату начала</b> аренды:",
@@ -467,7 +848,7 @@ def register_booking_handlers(dp: Dispatcher) -> None:
         )
 
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("selfbook:"), state="*")
-    async def handle_self_book_start(callback: types.CallbackQuery, state: FSMContext) -> None:
+    async def handle_self_book_start(callback: types.CallbackQuery, state: FSMContext, user: CachedUser) -> None:
         await callback.answer()
         _, raw_id = callback.data.split(":", 1)
         try:
@@ -475,26 +856,20 @@ def register_booking_handlers(dp: Dispatcher) -> None:
         except ValueError:
             return
 
-        with db_session() as session:
-            item = session.query(Item).get(item_id)
+        async with async_read_session() as session:
+            item = await session.get(Item, item_id)
         if not item:
             await callback.message.answer("Эта вещь больше не найдена в базе.")
             return
 
-        user = get_or_create_user(callback.from_user)
-        if not user.owner_handle or user.owner_handle.lower() != item.owner_handle.lower():
+        if not user.owner_handle or user.owner_handle != item.owner_handle:
             await callback.message.answer("Эта опция доступна только владельцу вещи.")
             return
 
         today = date.today()
-        await state.update_data(
-            pending_booking=PendingBookingContext(item_id=item_id, is_self_booking=True).__dict__,
-            cal_step="start",
-            cal_year=today.year,
-            cal_month=today.month,
-        )
+        await state.set_data({"pending_booking": PendingBookingContext(item_id, is_self_booking=True).pack()})
         await BookingStates.waiting_for_dates.set()
-        blocked = _get_blocked_dates_for_item(item_id, today.year, today.month)
+        blocked = await _get_blocked_dates_for_item(item_id, today.year, today.month)
         kb = build_calendar_keyboard(today.year, today.month, blocked_dates=blocked)
         await callback.message.answer(
             "Заблокировать даты как владелец. Выберите <b>дату начала</b>:",
@@ -506,20 +881,17 @@ def register_booking_handlers(dp: Dispatcher) -> None:
         lambda c: c.data and c.data.startswith("cal:"),
         state=BookingStates.waiting_for_dates,
     )
-    async def handle_calendar_callback(callback: types.CallbackQuery, state: FSMContext) -> None:
+    async def handle_calendar_callback(callback: types.CallbackQuery, state: FSMContext, user: CachedUser) -> None:
         parsed = parse_calendar_callback(callback.data)
         if not parsed:
             await callback.answer()
             return
         action, y, m, val = parsed[0], parsed[1], parsed[2], parsed[3]
-        data = await state.get_data()
-        ctx_raw = data.get("pending_booking")
-        if not ctx_raw:
+        ctx = PendingBookingContext.unpack((await state.get_data()).get("pending_booking"))
+        if ctx is None:
             await callback.answer()
             await state.finish()
             return
-        ctx = PendingBookingContext(**ctx_raw)
-        today = date.today()
 
         if action == "nav":
             delta = val
@@ -531,10 +903,8 @@ def register_booking_handlers(dp: Dispatcher) -> None:
             elif new_month < 1:
                 new_month = 12
                 new_year -= 1
-            await state.update_data(cal_year=new_year, cal_month=new_month)
-            start_str = data.get("cal_start_date")
-            min_date = date.fromisoformat(start_str) if isinstance(start_str, str) else None
-            blocked = _get_blocked_dates_for_item(ctx.item_id, new_year, new_month)
+            min_date = ctx.start_date
+            blocked = await _get_blocked_dates_for_item(ctx.item_id, new_year, new_month)
             kb = build_calendar_keyboard(
                 new_year, new_month, min_date=min_date, one_day_btn=min_date, blocked_dates=blocked
             )
@@ -548,11 +918,10 @@ def register_booking_handlers(dp: Dispatcher) -> None:
 
         if action == "sel":
             sel_date = date(y, m, val)
-            step = data.get("cal_step", "start")
-
-            if step == "start":
-                await state.update_data(cal_step="end", cal_start_date=sel_date.isoformat())
-                blocked = _get_blocked_dates_for_item(ctx.item_id, y, m)
+            if ctx.start_date is None:
+                ctx.start_date = sel_date
+                await state.update_data(pending_booking=ctx.pack())
+                blocked = await _get_blocked_dates_for_item(ctx.item_id, y, m)
                 kb = build_calendar_keyboard(y, m, min_date=sel_date, one_day_btn=sel_date, blocked_dates=blocked)
                 await callback.message.edit_text(
                     f"Дата начала: <b>{sel_date.strftime('%d.%m')}</b>. Выберите <b>дату окончания</b>:",
@@ -562,19 +931,18 @@ def register_booking_handlers(dp: Dispatcher) -> None:
                 await callback.answer()
                 return
 
-            # step == "end"
-            start_str = data.get("cal_start_date")
-            start_date = date.fromisoformat(start_str) if isinstance(start_str, str) else start_str
-            if not start_date or sel_date < start_date:
+            start_date = ctx.start_date
+            if sel_date < start_date:
                 await callback.answer("Дата окончания не может быть раньше начала", show_alert=True)
                 return
             end_date = sel_date
             await callback.answer()
-            await state.update_data(cal_step="start", cal_start_date=None)
-            await _do_booking(state, callback.message, callback.from_user, ctx, start_date, end_date)
+            ctx.start_date = None
+            await state.update_data(pending_booking=ctx.pack())
+            await _do_booking(state, callback.message, user, ctx, start_date, end_date)
 
     @dp.message_handler(state=BookingStates.waiting_for_dates)
-    async def handle_dates(message: types.Message, state: FSMContext) -> None:
+    async def handle_dates(message: types.Message, state: FSMContext, user: CachedUser) -> None:
         """Ручной ввод дат (ДД.ММ–ДД.ММ) как запасной вариант."""
         parsed = parse_dates(message.text or "")
         if not parsed:
@@ -585,15 +953,13 @@ def register_booking_handlers(dp: Dispatcher) -> None:
 
         start_date, end_date = parsed
 
-        data = await state.get_data()
-        ctx_raw = data.get("pending_booking")
-        if not ctx_raw:
+        ctx = PendingBookingContext.unpack((await state.get_data()).get("pending_booking"))
+        if ctx is None:
             await state.finish()
             await message.answer("Контекст бронирования потерян, начните заново с карточки вещи.")
             return
 
-        ctx = PendingBookingContext(**ctx_raw)
-        await _do_booking(state, message, message.from_user, ctx, start_date, end_date)
+        await _do_booking(state, message, user, ctx, start_date, end_date)
 
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("owner_confirm:"), state="*")
     async def owner_confirm(callback: types.CallbackQuery) -> None:
@@ -604,26 +970,18 @@ def register_booking_handlers(dp: Dispatcher) -> None:
         except ValueError:
             return
 
-        with db_session() as session:
-            booking = session.query(Booking).get(booking_id)
-            if not booking:
-                await callback.message.answer("Бронь не найдена.")
-                return
-            booking.state = BookingState.confirmed_unpaid
-            item = booking.item
-            renter = booking.renter
+        row, times = await submit_write(_owner_confirm, booking_id, callback.from_user.id)
+        push_scheduled(times)
+        if row is None:
+            await _answer_conflict(callback, booking_id)
+            return
 
-        await callback.message.edit_text("Вы подтвердили бронь. Ожидается оплата.")
+        await _close_booking_message(callback, booking_id, "Вы подтвердили бронь. Ожидается оплата.")
 
-        await callback.message.bot.send_message(
-            renter.tg_id,
-            (
-                f"Владелец подтвердил вашу бронь:\n"
-                f"Вещь: {item.name}\n"
-                f"Даты: {booking.start_date.strftime('%d.%m')}–{booking.end_date.strftime('%d.%m')}\n"
-                f"Цена: {format_price(item.price_raw)}\n"
-                f"Свяжитесь с владельцем @{item.owner_handle.lstrip('@')} для оплаты."
-            ),
+        await send_message(
+            callback.message.bot,
+            row.renter_user_id,
+            renter_confirmed_text(row),
         )
 
         # Владельцу сразу предлагаем подтвердить оплату, когда получит
@@ -632,12 +990,12 @@ def register_booking_handlers(dp: Dispatcher) -> None:
             types.InlineKeyboardButton(text="✅ Оплата получена", callback_data=f"owner_paid:{booking_id}"),
             types.InlineKeyboardButton(text="❌ Отменить бронь (оплаты нет)", callback_data=f"owner_cancel_unpaid:{booking_id}"),
         )
-        await callback.message.bot.send_message(
+        await send_message(
+            callback.message.bot,
             callback.from_user.id,
-            f"Когда арендатор оплатит, нажмите «Оплата получена»:\n\n{item.name} — {booking.start_date.strftime('%d.%m')}–{booking.end_date.strftime('%d.%m')}",
+            f"Когда арендатор оплатит, нажмите «Оплата получена»:\n\n{row.item_name} — {_booking_dates(row)}",
             reply_markup=pay_kb,
         )
-        schedule_payment_notifications(booking_id)
 
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("owner_paid:"), state="*")
     async def owner_paid(callback: types.CallbackQuery) -> None:
@@ -648,23 +1006,20 @@ def register_booking_handlers(dp: Dispatcher) -> None:
         except ValueError:
             return
 
-        with db_session() as session:
-            booking = session.query(Booking).get(booking_id)
-            if not booking:
-                return
-            booking.state = BookingState.paid_confirmed
-            booking.paid_confirmed_at = datetime.utcnow()
-            item = booking.item
-            renter = booking.renter
+        row = await submit_write(apply_transition, booking_id, BookingEvent.owner_paid, callback.from_user.id)
+        if row is None:
+            await _answer_conflict(callback, booking_id)
+            return
 
-        await callback.message.edit_text("Оплата подтверждена.")
+        await _close_booking_message(callback, booking_id, "Оплата подтверждена.")
 
-        await callback.message.bot.send_message(
-            renter.tg_id,
+        await send_message(
+            callback.message.bot,
+            row.renter_user_id,
             (
                 f"Владелец подтвердил получение оплаты по брони:\n"
-                f"Вещь: {item.name}\n"
-                f"Даты: {booking.start_date.strftime('%d.%m')}–{booking.end_date.strftime('%d.%m')}."
+                f"Вещь: {row.item_name}\n"
+                f"Даты: {_booking_dates(row)}."
             ),
         )
 
@@ -677,22 +1032,19 @@ def register_booking_handlers(dp: Dispatcher) -> None:
         except ValueError:
             return
 
-        with db_session() as session:
-            booking = session.query(Booking).get(booking_id)
-            if not booking:
-                return
-            booking.state = BookingState.canceled_by_owner
-            item = booking.item
-            renter = booking.renter
+        row = await submit_write(
+            apply_transition, booking_id, BookingEvent.owner_cancel_unpaid, callback.from_user.id
+        )
+        if row is None:
+            await _answer_conflict(callback, booking_id)
+            return
 
-        await callback.message.edit_text("Бронь отменена (оплата не получена).")
+        await _close_booking_message(callback, booking_id, "Бронь отменена (оплата не получена).")
 
-        await callback.message.bot.send_message(
-            renter.tg_id,
-            (
-                f"Владелец отменил вашу бронь на {item.name} "
-                f"({booking.start_date.strftime('%d.%m')}–{booking.end_date.strftime('%d.%m')})."
-            ),
+        await send_message(
+            callback.message.bot,
+            row.renter_user_id,
+            f"Владелец отменил вашу бронь на {row.item_name} ({_booking_dates(row)}).",
         )
 
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("renter_cancel:"), state="*")
@@ -704,39 +1056,29 @@ def register_booking_handlers(dp: Dispatcher) -> None:
             await callback.answer()
             return
 
-        with db_session() as session:
-            booking = session.query(Booking).get(booking_id)
-            if not booking or booking.renter_user_id != callback.from_user.id:
-                await callback.answer()
-                return
-            if booking.state not in (
-                BookingState.pending_owner_confirm,
-                BookingState.confirmed_unpaid,
-                BookingState.paid_confirmed,
-            ):
-                await callback.answer()
-                return
-
-            was_paid = booking.state == BookingState.paid_confirmed
-            booking.state = BookingState.canceled_by_renter
-            item_name = (booking.item.name if booking.item else "Вещь")
-            item_deposit = bool(booking.item and booking.item.deposit_required)
-            owner_tg_id = booking.owner.tg_id if booking.owner else None
-
+        row, times = await submit_write(_renter_cancel, booking_id, callback.from_user.id)
+        push_scheduled(times)
         await callback.answer()
+        if row is None:
+            await _answer_conflict(callback, booking_id)
+            return
+
+        # Оплата подтверждается только переходом owner_paid, поэтому метка времени надёжнее прежнего состояния
+        was_paid = row.paid_confirmed_at is not None
+        item_name = row.item_name or "Вещь"
         try:
             await callback.message.edit_reply_markup(reply_markup=None)
         except Exception:
             pass
         await callback.message.answer("Бронь отменена.")
 
-        if owner_tg_id and owner_tg_id != callback.from_user.id:
-            dates_str = f"{booking.start_date.strftime('%d.%m')}–{booking.end_date.strftime('%d.%m')}"
+        if row.owner_user_id != callback.from_user.id:
+            dates_str = _booking_dates(row)
             renter_handle = f"@{callback.from_user.username}" if callback.from_user.username else f"id{callback.from_user.id}"
 
             if was_paid:
                 refund_hint = "Необходимо вернуть оплату"
-                if item_deposit:
+                if row.item_deposit_required:
                     refund_hint += " и залог"
                 refund_hint += "."
                 owner_text = (
@@ -753,15 +1095,16 @@ def register_booking_handlers(dp: Dispatcher) -> None:
                     url=f"tg://user?id={callback.from_user.id}",
                 )
             )
-            await callback.message.bot.send_message(
-                owner_tg_id,
+            await send_message(
+                callback.message.bot,
+                row.owner_user_id,
                 owner_text,
                 reply_markup=chat_btn,
             )
 
         if was_paid:
             renter_msg = (
-                f"Вы отменили бронь «{item_name}» ({booking.start_date.strftime('%d.%m')}–{booking.end_date.strftime('%d.%m')}).\n\n"
+                f"Вы отменили бронь «{item_name}» ({_booking_dates(row)}).\n\n"
                 "Подтвердите, пожалуйста, когда владелец вернёт вам деньги (и залог, если был)."
             )
             renter_kb = types.InlineKeyboardMarkup()
@@ -771,54 +1114,62 @@ def register_booking_handlers(dp: Dispatcher) -> None:
                     callback_data=f"renter_confirm_refund:{booking_id}",
                 )
             )
-            await callback.message.bot.send_message(
+            await send_message(
+                callback.message.bot,
                 callback.from_user.id,
                 renter_msg,
                 reply_markup=renter_kb,
             )
-            with db_session() as s:
-                b = s.query(Booking).get(booking_id)
-                if b:
-                    b.last_refund_reminder_at = datetime.utcnow()
 
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("renter_confirm_refund:"), state="*")
     async def renter_confirm_refund(callback: types.CallbackQuery) -> None:
-        await callback.answer("Спасибо, возврат подтверждён.")
         _, raw_id = callback.data.split(":", 1)
         try:
             booking_id = int(raw_id)
         except ValueError:
+            await callback.answer()
             return
 
-        with db_session() as session:
-            booking = session.query(Booking).get(booking_id)
-            if not booking or booking.renter_user_id != callback.from_user.id:
-                return
-            if booking.refund_confirmed_at:
-                return
-            booking.refund_confirmed_at = datetime.utcnow()
+        row = await submit_write(
+            apply_transition, booking_id, BookingEvent.renter_confirm_refund, callback.from_user.id
+        )
+        if row is None:
+            await callback.answer(ALREADY_HANDLED_TEXT)
+            return
+        await callback.answer("Спасибо, возврат подтверждён.")
 
         try:
-            await callback.message.edit_text("Вы подтвердили возврат денег. Спасибо!")
+            await _close_booking_message(callback, booking_id, "Вы подтвердили возврат денег. Спасибо!")
         except Exception:
             await callback.message.answer("Вы подтвердили возврат денег. Спасибо!")
 
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("renter_paid:"), state="*")
     async def renter_paid(callback: types.CallbackQuery) -> None:
         """Арендатор нажал «Я оплатил» — отправляем владельцу запрос на подтверждение."""
-        await callback.answer("Сообщение владельцу отправлено.")
         _, raw_id = callback.data.split(":", 1)
         try:
             booking_id = int(raw_id)
         except ValueError:
+            await callback.answer()
             return
 
-        with db_session() as session:
-            booking = session.query(Booking).get(booking_id)
-            if not booking or booking.state != BookingState.confirmed_unpaid:
-                return
-            item = booking.item
-            owner = booking.owner
+        # Только сам арендатор и только пока бронь ждёт оплаты
+        async with async_read_session() as session:
+            row = (
+                await session.execute(
+                    select(Booking.owner_user_id, Booking.start_date, Booking.end_date, Item.name.label("item_name"))
+                    .join(Item, Item.id == Booking.item_id)
+                    .where(
+                        Booking.id == booking_id,
+                        Booking.renter_user_id == callback.from_user.id,
+                        Booking.state == BookingState.confirmed_unpaid,
+                    )
+                )
+            ).one_or_none()
+        if row is None:
+            await callback.answer(ALREADY_HANDLED_TEXT)
+            return
+        await callback.answer("Сообщение владельцу отправлено.")
 
         pay_kb = types.InlineKeyboardMarkup()
         pay_kb.add(
@@ -826,9 +1177,10 @@ def register_booking_handlers(dp: Dispatcher) -> None:
             types.InlineKeyboardButton(text="❌ Отменить бронь (оплаты нет)", callback_data=f"owner_cancel_unpaid:{booking_id}"),
         )
         renter_handle = f"@{callback.from_user.username}" if callback.from_user.username else f"id{callback.from_user.id}"
-        await callback.message.bot.send_message(
-            owner.tg_id,
-            f"Арендатор {renter_handle} сообщает, что оплатил. Подтвердите получение:\n\n{item.name} — {booking.start_date.strftime('%d.%m')}–{booking.end_date.strftime('%d.%m')}",
+        await send_message(
+            callback.message.bot,
+            row.owner_user_id,
+            f"Арендатор {renter_handle} сообщает, что оплатил. Подтвердите получение:\n\n{row.item_name} — {row.start_date.strftime('%d.%m')}–{row.end_date.strftime('%d.%m')}",
             reply_markup=pay_kb,
         )
 
@@ -841,23 +1193,15 @@ def register_booking_handlers(dp: Dispatcher) -> None:
         except ValueError:
             return
 
-        with db_session() as session:
-            booking = session.query(Booking).get(booking_id)
-            if not booking:
-                await callback.message.answer("Бронь не найдена.")
-                return
-            booking.state = BookingState.canceled_by_owner
-            item = booking.item
-            renter = booking.renter
+        row = await submit_write(apply_transition, booking_id, BookingEvent.owner_decline, callback.from_user.id)
+        if row is None:
+            await _answer_conflict(callback, booking_id)
+            return
 
-        await callback.message.edit_text("Вы отклонили бронь.")
+        await _close_booking_message(callback, booking_id, "Вы отклонили бронь.")
 
-        await callback.message.bot.send_message(
-            renter.tg_id,
-            (
-                f"Владелец отклонил вашу бронь:\n"
-                f"Вещь: {item.name}\n"
-                f"Даты: {booking.start_date.strftime('%d.%m')}–{booking.end_date.strftime('%d.%m')}"
-            ),
+        await send_message(
+            callback.message.bot,
+            row.renter_user_id,
+            renter_declined_text(row),
         )
-
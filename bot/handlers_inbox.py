@@ -0,0 +1,231 @@
+"""Входящие запросы на бронь у владельца: подтверждение и отклонение пачкой."""
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from .booking_transitions import BookingEvent, apply_transition_many
+from .db import async_read_session
+from .handlers_booking import renter_confirmed_text, renter_declined_text
+from .models import Booking, BookingState, Item, User
+from .outbox import DIGEST_MAX_TEXT, enqueue_messages, outbox_worker
+from .reminders import push_scheduled, schedule_payment_notifications_many
+from .sender import PRIORITY_INTERACTIVE
+from .users import CachedUser
+from .writer import submit_write
+
+# Сколько запросов показываем за раз: кнопки и текст должны влезть в одно сообщение
+INBOX_LIMIT = 40
+
+
+class OwnerInboxStates(StatesGroup):
+    choosing = State()
+
+
+def _pending_filter(owner_id: int) -> tuple:
+    return (
+        Booking.owner_user_id == owner_id,
+        Booking.renter_user_id != owner_id,
+        Booking.state == BookingState.pending_owner_confirm,
+    )
+
+
+async def _count_pending(owner_id: int) -> int:
+    async with async_read_session() as session:
+        return await session.scalar(select(func.count(Booking.id)).where(*_pending_filter(owner_id)))
+
+
+async def _pending_ids(owner_id: int) -> list[int]:
+    """Все ожидающие запросы владельца — для «Подтвердить все», не только показанные."""
+    async with async_read_session() as session:
+        rows = await session.execute(
+            select(Booking.id).where(*_pending_filter(owner_id)).order_by(Booking.start_date.asc(), Booking.id.asc())
+        )
+    return list(rows.scalars())
+
+
+async def _load_pending(owner_id: int) -> list:
+    async with async_read_session() as session:
+        rows = await session.execute(
+            select(
+                Booking.id,
+                Booking.start_date,
+                Booking.end_date,
+                Booking.renter_user_id,
+                Item.name.label("item_name"),
+                User.username.label("renter_username"),
+            )
+            .join(Item, Item.id == Booking.item_id)
+            .outerjoin(User, User.tg_id == Booking.renter_user_id)
+            .where(*_pending_filter(owner_id))
+            .order_by(Booking.start_date.asc(), Booking.id.asc())
+            .limit(INBOX_LIMIT)
+        )
+    return rows.all()
+
+
+def _request_label(row) -> str:
+    renter = f"@{row.renter_username}" if row.renter_username else f"id{row.renter_user_id}"
+    return f"{row.item_name} · {row.start_date.strftime('%d.%m')}–{row.end_date.strftime('%d.%m')} · {renter}"
+
+
+def _inbox_text(rows: list, selected: set[int], total: int) -> str:
+    lines = [f"📥 Запросы на бронь: <b>{total}</b>"]
+    if total > len(rows):
+        lines.append(f"Показаны первые {len(rows)}, остальные — после обработки этих.")
+    lines.append(f"Выбрано: <b>{len(selected)}</b>. Отметьте запросы или подтвердите все сразу.")
+    return "\n".join(lines)
+
+
+def _inbox_keyboard(rows: list, selected: set[int], total: int) -> types.InlineKeyboardMarkup:
+    kb = types.InlineKeyboardMarkup(row_width=1)
+    for row in rows:
+        mark = "✅" if row.id in selected else "⬜"
+        kb.add(types.InlineKeyboardButton(text=f"{mark} {_request_label(row)}"[:64], callback_data=f"inbox:t:{row.id}"))
+    kb.add(types.InlineKeyboardButton(text=f"✅ Подтвердить все ({total})", callback_data="inbox:all"))
+    if selected:
+        kb.row(
+            types.InlineKeyboardButton(text=f"✅ Подтвердить выбранные ({len(selected)})", callback_data="inbox:ok"),
+            types.InlineKeyboardButton(text=f"❌ Отклонить выбранные ({len(selected)})", callback_data="inbox:no"),
+        )
+    return kb
+
+
+def _per_renter_messages(rows: list, text) -> list[tuple[int, str, None]]:
+    """Ответы одному арендатору — одним сообщением (с разбиением по лимиту Telegram)."""
+    messages: list[tuple[int, str, None]] = []
+    texts: dict[int, list[str]] = {}
+    for row in rows:
+        texts.setdefault(row.renter_user_id, []).append(text(row))
+    for renter_id, parts in texts.items():
+        chunk: list[str] = []
+        for part in parts:
+            if chunk and sum(len(p) + 2 for p in chunk) + len(part) > DIGEST_MAX_TEXT:
+                messages.append((renter_id, "\n\n".join(chunk), None))
+                chunk = []
+            chunk.append(part)
+        messages.append((renter_id, "\n\n".join(chunk), None))
+    return messages
+
+
+def _owner_decide_many(
+    session: Session, booking_ids: list[int], event: BookingEvent, owner_id: int
+) -> tuple[list, list, list[int]]:
+    """
+    Подтвердить или отклонить пачку запросов одной транзакцией: один UPDATE ... RETURNING,
+    один INSERT напоминаний об оплате и один INSERT сообщений арендаторам в outbox.
+    Возвращает (строки броней, для которых переход состоялся; моменты напоминаний для
+    push_scheduled; id сообщений арендаторам для deliver_now).
+    """
+    rows = apply_transition_many(session, booking_ids, event, owner_id)
+    times = []
+    if event == BookingEvent.owner_confirm:
+        times = schedule_payment_notifications_many(session, rows)
+        text = renter_confirmed_text
+    else:
+        text = renter_declined_text
+    # Без digest: арендатор ждёт ответа сейчас, а несколько ответов ему склеены здесь же
+    outbox_ids = enqueue_messages(
+        session, _per_renter_messages(rows, text), priority=PRIORITY_INTERACTIVE, claimed=True
+    )
+    return rows, times, outbox_ids
+
+
+def _pay_keyboard(rows: list) -> types.InlineKeyboardMarkup:
+    kb = types.InlineKeyboardMarkup()
+    for row in rows:
+        name = (row.item_name or "Вещь")[:25]
+        kb.row(
+            types.InlineKeyboardButton(text=f"✅ Оплата — {name}", callback_data=f"owner_paid:{row.id}"),
+            types.InlineKeyboardButton(text=f"❌ Отмена — {name}", callback_data=f"owner_cancel_unpaid:{row.id}"),
+        )
+    return kb
+
+
+async def _show_inbox(message: types.Message, state: FSMContext, user: CachedUser) -> None:
+    rows = await _load_pending(user.tg_id)
+    if not rows:
+        await message.answer("Новых запросов на бронь нет.")
+        return
+    total = await _count_pending(user.tg_id) if len(rows) >= INBOX_LIMIT else len(rows)
+    await OwnerInboxStates.choosing.set()
+    await state.update_data(inbox_ids=[r.id for r in rows], inbox_selected=[], inbox_total=total)
+    await message.answer(_inbox_text(rows, set(), total), reply_markup=_inbox_keyboard(rows, set(), total), parse_mode="HTML")
+
+
+def register_inbox_handlers(dp: Dispatcher) -> None:
+    @dp.message_handler(commands=["inbox"], state="*")
+    async def inbox_command(message: types.Message, state: FSMContext, user: CachedUser) -> None:
+        await state.finish()
+        await _show_inbox(message, state, user)
+
+    @dp.callback_query_handler(lambda c: c.data == "inbox:open", state="*")
+    async def inbox_open(callback: types.CallbackQuery, state: FSMContext, user: CachedUser) -> None:
+        await callback.answer()
+        await state.finish()
+        await _show_inbox(callback.message, state, user)
+
+    @dp.callback_query_handler(lambda c: c.data and c.data.startswith("inbox:"), state=OwnerInboxStates.choosing)
+    async def inbox_pick(callback: types.CallbackQuery, state: FSMContext, user: CachedUser) -> None:
+        action = callback.data.split(":", 1)[1]
+        data = await state.get_data()
+        shown = data.get("inbox_ids") or []
+        selected = set(data.get("inbox_selected") or [])
+
+        if action.startswith("t:"):
+            raw_id = action[2:]
+            if raw_id.isdigit() and int(raw_id) in shown:
+                selected ^= {int(raw_id)}
+            await callback.answer()
+            await state.update_data(inbox_selected=sorted(selected))
+            rows = [r for r in await _load_pending(user.tg_id) if r.id in shown]
+            try:
+                await callback.message.edit_text(
+                    _inbox_text(rows, selected, data.get("inbox_total") or len(rows)),
+                    reply_markup=_inbox_keyboard(rows, selected, data.get("inbox_total") or len(rows)),
+                    parse_mode="HTML",
+                )
+            except Exception:
+                pass
+            return
+
+        if action == "all":
+            # Все ожидающие, а не только показанные INBOX_LIMIT
+            booking_ids = await _pending_ids(user.tg_id)
+            event = BookingEvent.owner_confirm
+        elif action in ("ok", "no"):
+            booking_ids = sorted(selected)
+            event = BookingEvent.owner_confirm if action == "ok" else BookingEvent.owner_decline
+        else:
+            await callback.answer()
+            return
+        if not booking_ids:
+            await callback.answer("Выберите хотя бы один запрос", show_alert=True)
+            return
+        await callback.answer()
+
+        rows = []
+        # Пачками по INBOX_LIMIT: короткие транзакции писателя и клавиатура оплаты в пределах лимита кнопок
+        for i in range(0, len(booking_ids), INBOX_LIMIT):
+            decided, times, outbox_ids = await submit_write(
+                _owner_decide_many, booking_ids[i : i + INBOX_LIMIT], event, user.tg_id
+            )
+            push_scheduled(times)
+            outbox_worker.deliver_now(callback.bot, outbox_ids)
+            rows += decided
+        skipped = len(booking_ids) - len(rows)
+        if event == BookingEvent.owner_confirm:
+            lines = [f"Подтверждено броней: {len(rows)}. Ожидается оплата."]
+        else:
+            lines = [f"Отклонено броней: {len(rows)}."]
+        if skipped:
+            lines.append(f"Уже обработаны ранее: {skipped}.")
+        await callback.message.edit_text("\n".join(lines))
+        if event == BookingEvent.owner_confirm:
+            for i in range(0, len(rows), INBOX_LIMIT):
+                await callback.message.answer(
+                    "Когда арендаторы оплатят, нажмите «Оплата» у нужной брони:",
+                    reply_markup=_pay_keyboard(rows[i : i + INBOX_LIMIT]),
+                )
+        await state.finish()
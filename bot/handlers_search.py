@@ -1,13 +1,17 @@
+import zlib
+from collections import OrderedDict
+
 from aiogram import Bot, Dispatcher, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from sqlalchemy import func
+from sqlalchemy import func, select
 
 from .config import load_settings
-from .db import db_session
+from .db import async_read_session
 from .keyboards import items_list_keyboard, item_actions_keyboard, main_menu_keyboard
 from .models import Item
-from .users import get_or_create_user
+from .sender import send_message, send_photo
+from .users import CachedUser
 from .utils import _e, format_price
 
 
@@ -25,18 +29,18 @@ async def _run_search(
     extra_markup: types.InlineKeyboardMarkup | None = None,
 ) -> bool:
     """Выполняет поиск и отправляет результат. Возвращает True если есть результаты."""
-    with db_session() as session:
-        q = session.query(Item)
-        if query and query.strip() and query.strip() != "*":
-            like = f"%{query.strip().lower()}%"
-            q = q.filter(func.lower(Item.name).like(like))
-        if area:
-            q = q.filter(Item.area.isnot(None), Item.area == area)
-        if type_filter:
-            q = q.filter(Item.type.isnot(None), Item.type == type_filter)
-        if owner_filter:
-            q = q.filter(Item.owner_handle == owner_filter)
-        items = q.order_by(Item.name).limit(30).all()
+    q = select(Item.id, Item.name, Item.price_raw, Item.area)
+    if query and query.strip() and query.strip() != "*":
+        like = f"%{query.strip().lower()}%"
+        q = q.where(func.lower(Item.name).like(like))
+    if area:
+        q = q.where(Item.area.isnot(None), Item.area == area)
+    if type_filter:
+        q = q.where(Item.type.isnot(None), Item.type == type_filter)
+    if owner_filter:
+        q = q.where(Item.owner_handle == owner_filter)
+    async with async_read_session() as session:
+        items = (await session.execute(q.order_by(Item.name).limit(30))).all()
 
     if not items:
         return False
@@ -60,7 +64,7 @@ async def _run_search(
     if filters_info:
         header += f" (фильтры: {', '.join(filters_info)})"
     body = header
-    await bot.send_message(chat_id, body, reply_markup=kb, parse_mode="HTML")
+    await send_message(bot, chat_id, body, reply_markup=kb, parse_mode="HTML")
     return True
 
 
@@ -81,6 +85,54 @@ def _filters_keyboard(
     return kb
 
 
+# Списки для выбора фильтра: колонка, «любой», заголовок, сообщение при пустом списке
+_FACETS = {
+    "area": (Item.area, "Любой район", "Выберите район:", "Нет данных по районам."),
+    "type": (Item.type, "Любой тип", "Выберите тип вещи:", "Нет данных по типам."),
+    "owner": (Item.owner_handle, "Любой владелец", "Выберите владельца:", "Нет данных по владельцам."),
+}
+_FILTER_KEYS = {"area": "area", "type": "type_filter", "owner": "owner_filter"}
+FACET_CACHE_SIZE = 32
+# (вид, версия) -> значения. В FSM и кнопках — только версия и индекс, сами списки живут здесь
+_facet_cache: OrderedDict[tuple[str, str], list[str]] = OrderedDict()
+_STALE = object()
+
+
+def _facet_version(values: list[str]) -> str:
+    return format(zlib.crc32("\n".join(values).encode()), "08x")
+
+
+async def _load_facet(kind: str) -> tuple[str, list[str]]:
+    column = _FACETS[kind][0]
+    async with async_read_session() as session:
+        rows = await session.scalars(select(column).where(column.isnot(None), column != "").distinct())
+        values = sorted({r.strip() for r in rows if r and r.strip()})
+    version = _facet_version(values)
+    _facet_cache[(kind, version)] = values
+    _facet_cache.move_to_end((kind, version))
+    while len(_facet_cache) > FACET_CACHE_SIZE:
+        _facet_cache.popitem(last=False)
+    return version, values
+
+
+async def _facet_value(kind: str, version: str, index: int):
+    """Значение по версии списка и индексу; _STALE — список с тех пор изменился."""
+    values = _facet_cache.get((kind, version))
+    if values is None:
+        current, values = await _load_facet(kind)
+        if current != version:
+            return _STALE
+    return values[index] if index < len(values) else None
+
+
+def _facet_keyboard(kind: str, version: str, values: list[str], any_label: str) -> types.InlineKeyboardMarkup:
+    kb = types.InlineKeyboardMarkup()
+    kb.add(types.InlineKeyboardButton(text=any_label, callback_data=f"sf:{kind}:_none"))
+    for i, value in enumerate(values):
+        kb.add(types.InlineKeyboardButton(text=value, callback_data=f"sf:{kind}:{version}:{i}"))
+    return kb
+
+
 async def show_main_menu(message: types.Message) -> None:
     text = (
         "Привет! Это бот гаражки аренды вещей.\n\n"
@@ -96,19 +148,16 @@ async def show_main_menu(message: types.Message) -> None:
 def register_search_handlers(dp: Dispatcher) -> None:
     @dp.message_handler(commands=["start"])
     async def cmd_start(message: types.Message, state: FSMContext) -> None:
-        get_or_create_user(message.from_user)
         await state.finish()
         await show_main_menu(message)
 
     @dp.message_handler(lambda m: m.text and "На главную" in m.text, state="*")
     async def back_to_main(message: types.Message, state: FSMContext) -> None:
-        get_or_create_user(message.from_user)
         await state.finish()
         await show_main_menu(message)
 
     @dp.message_handler(lambda m: m.text and "Найти вещь" in m.text, state="*")
     async def ask_search_query(message: types.Message, state: FSMContext) -> None:
-        get_or_create_user(message.from_user)
         await state.set_state(SearchStates.active.state)
         await state.update_data(query="", area=None, type_filter=None, owner_filter=None)
         kb = _filters_keyboard(None, None, None)
@@ -120,7 +169,6 @@ def register_search_handlers(dp: Dispatcher) -> None:
 
     @dp.message_handler(lambda m: m.text and "Добавить свои вещи" in m.text, state="*")
     async def add_own_items(message: types.Message, state: FSMContext) -> None:
-        get_or_create_user(message.from_user)
         await state.finish()
         settings = load_settings()
         url = f"https://docs.google.com/spreadsheets/d/{settings.sheets.spreadsheet_id}/edit"
@@ -147,7 +195,6 @@ def register_search_handlers(dp: Dispatcher) -> None:
         state=SearchStates.active,
     )
     async def handle_search_query(message: types.Message, state: FSMContext) -> None:
-        get_or_create_user(message.from_user)
         query = (message.text or "").strip()
         if not query:
             return
@@ -191,119 +238,52 @@ def register_search_handlers(dp: Dispatcher) -> None:
             await callback.message.edit_text("Фильтры сброшены. Введите запрос или * для всех.")
             return
 
-        if action == "area":
-            with db_session() as session:
-                rows = session.query(Item.area).filter(Item.area.isnot(None), Item.area != "").distinct().all()
-                areas = sorted({r[0].strip() for r in rows if r[0] and r[0].strip()})
-            if not areas:
-                await callback.answer("Нет данных по районам.", show_alert=True)
-                return
-            await state.update_data(_areas_picker=areas)
-            kb = types.InlineKeyboardMarkup()
-            kb.add(types.InlineKeyboardButton(text="Любой район", callback_data="sf:area:_none"))
-            for i, a in enumerate(areas):
-                kb.add(types.InlineKeyboardButton(text=a, callback_data=f"sf:area:{i}"))
-            await callback.message.edit_text("Выберите район:", reply_markup=kb)
+        kind, _, choice = action.partition(":")
+        if kind not in _FACETS:
             return
 
-        if action == "type":
-            with db_session() as session:
-                rows = session.query(Item.type).filter(Item.type.isnot(None), Item.type != "").distinct().all()
-                types_list = sorted({r[0].strip() for r in rows if r[0] and r[0].strip()})
-            if not types_list:
-                await callback.answer("Нет данных по типам.", show_alert=True)
-                return
-            await state.update_data(_types_picker=types_list)
-            kb = types.InlineKeyboardMarkup()
-            kb.add(types.InlineKeyboardButton(text="Любой тип", callback_data="sf:type:_none"))
-            for i, t in enumerate(types_list):
-                kb.add(types.InlineKeyboardButton(text=t, callback_data=f"sf:type:{i}"))
-            await callback.message.edit_text("Выберите тип вещи:", reply_markup=kb)
-            return
-
-        if action == "owner":
-            with db_session() as session:
-                rows = (
-                    session.query(Item.owner_handle)
-                    .filter(Item.owner_handle.isnot(None), Item.owner_handle != "")
-                    .distinct()
-                    .all()
-                )
-                owners = sorted({r[0].strip() for r in rows if r[0] and r[0].strip()})
-            if not owners:
-                await callback.answer("Нет данных по владельцам.", show_alert=True)
+        if not choice:
+            version, values = await _load_facet(kind)
+            any_label, prompt, empty = _FACETS[kind][1:]
+            if not values:
+                await callback.answer(empty, show_alert=True)
                 return
-            await state.update_data(_owners_picker=owners)
-            kb = types.InlineKeyboardMarkup()
-            kb.add(types.InlineKeyboardButton(text="Любой владелец", callback_data="sf:owner:_none"))
-            for i, o in enumerate(owners):
-                kb.add(types.InlineKeyboardButton(text=o, callback_data=f"sf:owner:{i}"))
-            await callback.message.edit_text("Выберите владельца:", reply_markup=kb)
+            await callback.message.edit_text(prompt, reply_markup=_facet_keyboard(kind, version, values, any_label))
             return
 
-        if action.startswith("area:"):
-            val = action[5:]
-            picker = (await state.get_data()).get("_areas_picker") or []
-            area = None if val == "_none" else (picker[int(val)] if val.isdigit() and 0 <= int(val) < len(picker) else None)
-            await state.update_data(area=area)
-            found = await _run_search(
-                callback.message.chat.id,
-                callback.message.bot,
-                query,
-                area,
-                type_filter,
-                owner_filter,
-                extra_markup=_filters_keyboard(area, type_filter, owner_filter),
-            )
-            if not found:
-                await callback.message.edit_text(
-                    "Ничего не нашлось с такими фильтрами.",
-                    reply_markup=_filters_keyboard(area, type_filter, owner_filter),
-                )
-
-        elif action.startswith("type:"):
-            val = action[5:]
-            picker = (await state.get_data()).get("_types_picker") or []
-            type_filter = None if val == "_none" else (picker[int(val)] if val.isdigit() and 0 <= int(val) < len(picker) else None)
-            await state.update_data(type_filter=type_filter)
-            found = await _run_search(
-                callback.message.chat.id,
-                callback.message.bot,
-                query,
-                area,
-                type_filter,
-                owner_filter,
-                extra_markup=_filters_keyboard(area, type_filter, owner_filter),
-            )
-            if not found:
+        if choice == "_none":
+            value = None
+        else:
+            version, _, raw_index = choice.partition(":")
+            # Кнопки старого формата (без версии) тоже считаем устаревшими
+            value = await _facet_value(kind, version, int(raw_index)) if raw_index.isdigit() else _STALE
+            if value is _STALE:
+                # Список изменился после синхронизации — показываем актуальный
+                version, values = await _load_facet(kind)
+                any_label, prompt, _ = _FACETS[kind][1:]
                 await callback.message.edit_text(
-                    "Ничего не нашлось с такими фильтрами.",
-                    reply_markup=_filters_keyboard(area, type_filter, owner_filter),
+                    "Список обновился. " + prompt, reply_markup=_facet_keyboard(kind, version, values, any_label)
                 )
+                return
 
-        elif action.startswith("owner:"):
-            val = action[6:]
-            picker = (await state.get_data()).get("_owners_picker") or []
-            owner_filter = (
-                None
-                if val == "_none"
-                else (picker[int(val)] if val.isdigit() and 0 <= int(val) < len(picker) else None)
-            )
-            await state.update_data(owner_filter=owner_filter)
-            found = await _run_search(
-                callback.message.chat.id,
-                callback.message.bot,
-                query,
-                area,
-                type_filter,
-                owner_filter,
-                extra_markup=_filters_keyboard(area, type_filter, owner_filter),
+        filters = {"area": area, "type": type_filter, "owner": owner_filter}
+        filters[kind] = value
+        await state.update_data(**{_FILTER_KEYS[kind]: value})
+        area, type_filter, owner_filter = filters["area"], filters["type"], filters["owner"]
+        found = await _run_search(
+            callback.message.chat.id,
+            callback.message.bot,
+            query,
+            area,
+            type_filter,
+            owner_filter,
+            extra_markup=_filters_keyboard(area, type_filter, owner_filter),
+        )
+        if not found:
+            await callback.message.edit_text(
+                "Ничего не нашлось с такими фильтрами.",
+                reply_markup=_filters_keyboard(area, type_filter, owner_filter),
             )
-            if not found:
-                await callback.message.edit_text(
-                    "Ничего не нашлось с такими фильтрами.",
-                    reply_markup=_filters_keyboard(area, type_filter, owner_filter),
-                )
 
     @dp.message_handler(
         lambda m: m.text
@@ -313,29 +293,28 @@ def register_search_handlers(dp: Dispatcher) -> None:
     )
     async def handle_search_query_no_state(message: types.Message, state: FSMContext) -> None:
         """Текст вне режима поиска — включаем поиск и обрабатываем."""
-        get_or_create_user(message.from_user)
         await state.set_state(SearchStates.active.state)
         await state.update_data(query="", area=None, type_filter=None, owner_filter=None)
         await handle_search_query(message, state)
 
     @dp.callback_query_handler(lambda c: c.data and c.data.startswith("item:"), state="*")
-    async def show_item_card(callback: types.CallbackQuery) -> None:
+    async def show_item_card(callback: types.CallbackQuery, user: CachedUser) -> None:
         await callback.answer()
-        user = get_or_create_user(callback.from_user)
         _, raw_id = callback.data.split(":", 1)
         try:
             item_id = int(raw_id)
         except ValueError:
             return
 
-        with db_session() as session:
-            item = session.query(Item).get(item_id)
+        async with async_read_session() as session:
+            item = await session.get(Item, item_id)
 
         if not item:
             await callback.message.edit_text("Эта вещь больше не найдена в базе (возможно, её удалили из таблицы).")
             return
 
-        is_owner = bool(user.owner_handle and user.owner_handle.lower() == item.owner_handle.lower())
+        # Оба ника уже в каноническом виде (sync_items, users), сравнение — простое равенство
+        is_owner = user.owner_handle is not None and user.owner_handle == item.owner_handle
         deposit_text = "Залог обязателен" if item.deposit_required else "Без залога"
         text_lines = [
             f"<b>{_e(item.name)}</b>",
@@ -357,7 +336,8 @@ def register_search_handlers(dp: Dispatcher) -> None:
         if item.photo_url:
             try:
                 await callback.message.delete()
-                await callback.message.bot.send_photo(
+                await send_photo(
+                    callback.message.bot,
                     callback.message.chat.id,
                     photo=item.photo_url,
                     caption=caption,
@@ -365,7 +345,8 @@ def register_search_handlers(dp: Dispatcher) -> None:
                     parse_mode="HTML",
                 )
             except Exception:
-                await callback.message.bot.send_message(
+                await send_message(
+                    callback.message.bot,
                     callback.message.chat.id,
                     caption,
                     reply_markup=kb,
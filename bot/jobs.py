@@ -0,0 +1,185 @@
+"""
+Запуск фоновых задач по расписанию.
+
+Поверх AsyncIOScheduler:
+- одна задача не выполняется в процессе дважды одновременно (и по расписанию, и командой),
+  а между репликами её держит аренда (bot/leases.py);
+- пропущенные запуски (долгая задача, пауза процесса) схлопываются в один;
+- первый запуск сдвигается на случайную задержку, чтобы реплики и воркеры,
+  стартовавшие вместе, не били в БД и таблицу одновременно;
+- каждый запуск записывается в job_runs: время, длительность, результат или ошибка.
+Синхронные задачи выполняются в потоке, чтобы не блокировать цикл событий.
+"""
+import asyncio
+import inspect
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Callable
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from .db import async_read_session
+from .leases import lease_manager
+from .models import JobRun
+from .writer import submit_write
+
+log = logging.getLogger(__name__)
+
+# Не больше этой доли интервала и не больше JOB_STARTUP_JITTER_MAX
+JOB_STARTUP_JITTER_SHARE = 0.1
+JOB_STARTUP_JITTER_MAX = timedelta(minutes=1)
+JOB_RUNS_KEEP = timedelta(days=14)
+
+
+@dataclass
+class _Job:
+    job_id: str
+    fn: Callable[[], Any]
+    lease: str
+    interval: timedelta
+
+
+@dataclass
+class JobRunRecord:
+    job_id: str
+    trigger: str
+    started_at: datetime
+    duration_ms: int
+    status: str
+    result: str | None = None
+    error: str | None = None
+    # что вернула задача (в job_runs пишется строкой в result)
+    value: Any = field(default=None, repr=False)
+
+
+def _record_run(session: Session, run: JobRunRecord, owner: str) -> None:
+    session.add(
+        JobRun(
+            job_id=run.job_id,
+            owner=owner,
+            trigger=run.trigger,
+            started_at=run.started_at,
+            duration_ms=run.duration_ms,
+            status=run.status,
+            result=run.result,
+            error=run.error,
+        )
+    )
+    session.execute(
+        delete(JobRun).where(JobRun.job_id == run.job_id, JobRun.started_at < run.started_at - JOB_RUNS_KEEP)
+    )
+
+
+@dataclass
+class JobRunner:
+    # сколько раз запуск не состоялся, потому что предыдущий ещё шёл
+    overlaps: dict[str, int] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self._jobs: dict[str, _Job] = {}
+        self._running: set[str] = set()
+        self._scheduler: AsyncIOScheduler | None = None
+
+    def add(self, job_id: str, fn: Callable[[], Any], lease: str | None = None, **interval) -> None:
+        """Зарегистрировать задачу (до start). interval — аргументы timedelta: minutes=10, hours=1..."""
+        self._jobs[job_id] = _Job(job_id, fn, lease or f"job:{job_id}", timedelta(**interval))
+
+    def start(self, timezone: str) -> None:
+        self._scheduler = AsyncIOScheduler(
+            timezone=timezone,
+            # misfire_grace_time=None: пропущенный запуск всё равно выполнится, но один
+            job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": None},
+        )
+        now = datetime.now(self._scheduler.timezone)
+        for job in self._jobs.values():
+            jitter = min(job.interval * JOB_STARTUP_JITTER_SHARE, JOB_STARTUP_JITTER_MAX)
+            self._scheduler.add_job(
+                self._scheduled,
+                "interval",
+                args=[job.job_id],
+                id=job.job_id,
+                seconds=job.interval.total_seconds(),
+                start_date=now + job.interval + jitter * random.random(),
+            )
+        self._scheduler.start()
+
+    def stop(self) -> None:
+        if self._scheduler is not None and self._scheduler.running:
+            self._scheduler.shutdown(wait=False)
+
+    def next_run(self, job_id: str) -> datetime | None:
+        job = self._scheduler.get_job(job_id) if self._scheduler else None
+        return job.next_run_time if job else None
+
+    def running(self, job_id: str) -> bool:
+        return job_id in self._running
+
+    async def _scheduled(self, job_id: str) -> None:
+        job = self._jobs[job_id]
+        if not await lease_manager.ensure(job.lease):
+            return
+        try:
+            await self.run_now(job_id, trigger="schedule")
+        except Exception:
+            # уже записано в job_runs и в лог
+            pass
+
+    async def run_now(self, job_id: str, trigger: str = "manual") -> JobRunRecord | None:
+        """
+        Выполнить задачу сейчас и записать запуск. None — она уже выполняется в этом процессе.
+        Исключение задачи записывается и пробрасывается дальше.
+        """
+        if job_id in self._running:
+            self.overlaps[job_id] = self.overlaps.get(job_id, 0) + 1
+            log.warning("Задача %s ещё выполняется, запуск пропущен", job_id)
+            return None
+        job = self._jobs[job_id]
+        self._running.add(job_id)
+        started_at = datetime.utcnow()
+        started = time.monotonic()
+        run = JobRunRecord(job_id, trigger, started_at, 0, "ok")
+        try:
+            if inspect.iscoroutinefunction(job.fn):
+                result = await job.fn()
+            else:
+                result = await asyncio.to_thread(job.fn)
+            run.value = result
+            run.result = None if result is None else str(result)[:500]
+            return run
+        except Exception as e:
+            run.status = "error"
+            run.error = f"{type(e).__name__}: {e}"[:1000]
+            log.exception("Задача %s завершилась с ошибкой", job_id)
+            raise
+        finally:
+            self._running.discard(job_id)
+            run.duration_ms = int((time.monotonic() - started) * 1000)
+            try:
+                await submit_write(_record_run, run, lease_manager.owner)
+            except Exception:
+                log.exception("Не удалось записать запуск задачи %s", job_id)
+
+    async def recent_runs(self, limit: int) -> dict[str, list]:
+        """Последние limit запусков каждой задачи (со всех реплик), новые сверху."""
+        ranked = select(
+            JobRun,
+            func.row_number().over(partition_by=JobRun.job_id, order_by=JobRun.started_at.desc()).label("rn"),
+        ).subquery()
+        async with async_read_session() as session:
+            rows = (
+                await session.execute(
+                    select(ranked).where(ranked.c.rn <= limit).order_by(ranked.c.job_id, ranked.c.started_at.desc())
+                )
+            ).all()
+        runs: dict[str, list] = {job_id: [] for job_id in self._jobs}
+        for row in rows:
+            runs.setdefault(row.job_id, []).append(row)
+        return runs
+
+
+job_runner = JobRunner()
@@ -0,0 +1,179 @@
+"""
+Аренды (leases) в БД: фоновые задачи выполняются ровно на одной реплике.
+
+Аренда — строка job_leases (имя, владелец, срок). Захват и продление — один условный
+UPDATE (свободна, истекла или уже наша), для новой строки — INSERT ... ON CONFLICT DO NOTHING,
+так что двое одновременно её не получат. Heartbeat раз в HEARTBEAT_SECONDS продлевает
+удерживаемые аренды и пытается захватить нужные; упавшая реплика перестаёт продлевать,
+и через LEASE_TTL задачу подхватывает другая. Внешний координатор не нужен — хватает
+SQLite или Postgres.
+
+Локально аренда считается своей на HEARTBEAT_SECONDS меньше срока в БД, чтобы реплика
+перестала работать раньше, чем аренду сможет забрать другая.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import case, or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .models import JobLease
+from .writer import submit_write
+
+log = logging.getLogger(__name__)
+
+LEASE_TTL = timedelta(seconds=30)
+HEARTBEAT_SECONDS = 10.0
+
+
+def _acquire(session: Session, name: str, owner: str, now: datetime, ttl: timedelta) -> bool:
+    """Захватить или продлить аренду. Операция писателя."""
+    renewed = session.execute(
+        update(JobLease)
+        .where(JobLease.name == name, or_(JobLease.owner == owner, JobLease.expires_at < now))
+        .values(
+            owner=owner,
+            acquired_at=case((JobLease.owner == owner, JobLease.acquired_at), else_=now),
+            renewed_at=now,
+            expires_at=now + ttl,
+        ),
+        execution_options={"synchronize_session": False},
+    )
+    if renewed.rowcount:
+        return True
+    insert = pg_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    created = session.execute(
+        insert(JobLease)
+        .values(name=name, owner=owner, acquired_at=now, renewed_at=now, expires_at=now + ttl)
+        .on_conflict_do_nothing(index_elements=["name"])
+    )
+    return bool(created.rowcount)
+
+
+def _heartbeat(session: Session, names: list[str], owner: str, ttl: timedelta) -> tuple[datetime, list[str]]:
+    now = datetime.utcnow()
+    return now, [name for name in names if _acquire(session, name, owner, now, ttl)]
+
+
+def _release(session: Session, names: list[str], owner: str) -> None:
+    session.execute(
+        update(JobLease)
+        .where(JobLease.name.in_(names), JobLease.owner == owner)
+        .values(expires_at=datetime.utcnow()),
+        execution_options={"synchronize_session": False},
+    )
+
+
+Callback = Callable[[], Awaitable[Any]]
+
+
+class LeaseManager:
+    def __init__(self, ttl: timedelta = LEASE_TTL, heartbeat_seconds: float = HEARTBEAT_SECONDS) -> None:
+        self.ttl = ttl
+        self.heartbeat_seconds = heartbeat_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        # имя -> до какого момента аренда считается своей
+        self._held: dict[str, datetime] = {}
+        self._wanted: set[str] = set()
+        self._followers: dict[str, tuple[Callback, Callback]] = {}
+        self._active: set[str] = set()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def holds(self, name: str) -> bool:
+        until = self._held.get(name)
+        return until is not None and until > datetime.utcnow()
+
+    def held(self) -> list[str]:
+        return sorted(name for name in self._held if self.holds(name))
+
+    def follow(self, name: str, on_acquire: Callback, on_release: Callback) -> None:
+        """
+        Держать аренду постоянно: on_acquire — когда она досталась этому процессу,
+        on_release — когда потеряна или процесс останавливается. Регистрировать до start().
+        """
+        self._followers[name] = (on_acquire, on_release)
+
+    async def ensure(self, name: str) -> bool:
+        """Аренда наша (или удалось захватить сейчас). Дальше её продлевает heartbeat."""
+        self._wanted.add(name)
+        if self.holds(name):
+            return True
+        await self._beat([name])
+        return self.holds(name)
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        # Первый захват сразу, чтобы сервисы-последователи стартовали вместе с процессом
+        await self._tick()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="leases")
+
+    async def stop(self) -> None:
+        """Остановить последователей и отдать аренды, чтобы другая реплика подхватила их сразу."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for name in list(self._active):
+            await self._call(name, release=True)
+        names = self.held()
+        self._held.clear()
+        if names:
+            await submit_write(_release, names, self.owner)
+
+    async def _beat(self, names: list[str]) -> None:
+        now, acquired = await submit_write(_heartbeat, names, self.owner, self.ttl)
+        until = now + self.ttl - timedelta(seconds=self.heartbeat_seconds)
+        for name in names:
+            if name in acquired:
+                if name not in self._held:
+                    log.info("Аренда %s получена (%s)", name, self.owner)
+                self._held[name] = until
+            elif self._held.pop(name, None) is not None:
+                log.warning("Аренда %s потеряна (%s)", name, self.owner)
+
+    async def _call(self, name: str, release: bool) -> None:
+        on_acquire, on_release = self._followers[name]
+        try:
+            await (on_release if release else on_acquire)()
+        except Exception:
+            log.exception("Ошибка при %s аренды %s", "освобождении" if release else "получении", name)
+        if release:
+            self._active.discard(name)
+        else:
+            self._active.add(name)
+
+    async def _tick(self) -> None:
+        try:
+            await self._beat(sorted(self._wanted | set(self._followers)))
+        except Exception:
+            log.exception("Ошибка продления аренд")
+        for name in self._followers:
+            holds = self.holds(name)
+            if holds and name not in self._active:
+                await self._call(name, release=False)
+            elif not holds and name in self._active:
+                await self._call(name, release=True)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            await self._tick()
+
+
+lease_manager = LeaseManager()
+
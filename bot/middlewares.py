@@ -0,0 +1,15 @@
+from aiogram import types
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from .users import user_cache
+
+
+class UserMiddleware(BaseMiddleware):
+    """Определяет пользователя один раз на апдейт и передаёт его хендлерам аргументом `user`."""
+
+    async def on_pre_process_message(self, message: types.Message, data: dict) -> None:
+        if message.from_user:
+            data["user"] = await user_cache.resolve(message.from_user)
+
+    async def on_pre_process_callback_query(self, callback: types.CallbackQuery, data: dict) -> None:
+        data["user"] = await user_cache.resolve(callback.from_user)
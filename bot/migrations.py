@@ -0,0 +1,95 @@
+"""Миграции схемы и данных, которые create_all не делает сам."""
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import exists, select, text
+
+from . import db
+from .config import load_settings
+from .models import Booking, BookingState, Notification, NotificationType
+from .reminders import schedule_refund_notifications
+
+log = logging.getLogger(__name__)
+
+
+def ensure_item_photo_column() -> None:
+    """Добавить колонку photo_url в items, если её нет (миграция)."""
+    engine = db.engine
+    if engine is None:
+        return
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("ALTER TABLE items ADD COLUMN photo_url VARCHAR(512)"))
+            conn.commit()
+    except Exception as e:
+        if "duplicate" not in str(e).lower() and "already exists" not in str(e).lower():
+            raise
+
+
+def ensure_refund_columns() -> None:
+    """Добавить колонки для возврата, если их нет (миграция)."""
+    engine = db.engine
+    if engine is None:
+        return
+    for col in ("refund_confirmed_at", "last_refund_reminder_at"):
+        try:
+            with engine.connect() as conn:
+                conn.execute(text(f"ALTER TABLE bookings ADD COLUMN {col} DATETIME"))
+                conn.commit()
+        except Exception as e:
+            if "duplicate" not in str(e).lower() and "already exists" not in str(e).lower():
+                raise
+
+
+def ensure_outbox_digest_column() -> None:
+    """Добавить колонку digest в outbox, если её нет (миграция)."""
+    engine = db.engine
+    if engine is None:
+        return
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("ALTER TABLE outbox ADD COLUMN digest BOOLEAN NOT NULL DEFAULT FALSE"))
+            conn.commit()
+    except Exception as e:
+        if "duplicate" not in str(e).lower() and "already exists" not in str(e).lower():
+            raise
+
+
+def ensure_notification_types() -> None:
+    """Добавить новые значения NotificationType в enum-тип Postgres (SQLite хранит строки без проверки)."""
+    engine = db.engine
+    if engine is None or engine.dialect.name != "postgresql":
+        return
+    # ALTER TYPE ... ADD VALUE нельзя выполнять внутри транзакции на старых версиях Postgres
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for ntype in NotificationType:
+            conn.execute(text(f"ALTER TYPE notificationtype ADD VALUE IF NOT EXISTS '{ntype.name}'"))
+
+
+def backfill_refund_notifications() -> int:
+    """
+    Перевести отменённые оплаченные брони без подтверждённого возврата на запланированные
+    напоминания (раньше их рассылал ежедневный обход всех таких броней). Идемпотентно.
+    """
+    if db.SessionLocal is None:
+        return 0
+    with db.db_session() as session:
+        rows = session.execute(
+            select(Booking.id, Booking.last_refund_reminder_at, Booking.updated_at).where(
+                Booking.state == BookingState.canceled_by_renter,
+                Booking.paid_confirmed_at.isnot(None),
+                Booking.refund_confirmed_at.is_(None),
+                ~exists().where(
+                    Notification.booking_id == Booking.id,
+                    Notification.type == NotificationType.refund_reminder,
+                ),
+            )
+        ).all()
+        # Расписание отсчитываем от последнего напоминания (или от отмены), но так,
+        # чтобы давно просроченные не ушли пачкой: первое — не раньше, чем сейчас
+        earliest = datetime.utcnow() - timedelta(hours=load_settings().reminders.refund_start_hours)
+        for booking_id, last_reminder_at, updated_at in rows:
+            schedule_refund_notifications(session, booking_id, max(last_reminder_at or updated_at, earliest))
+    if rows:
+        log.info("Запланированы напоминания о возврате для %d старых броней", len(rows))
+    return len(rows)
@@ -1,6 +1,6 @@
 from datetime import date, datetime
 
-from sqlalchemy import Boolean, Column, Date, DateTime, Enum, ForeignKey, Integer, String, Text
+from sqlalchemy import Boolean, Column, Date, DateTime, Enum, ForeignKey, Index, Integer, String, Text, text
 from sqlalchemy.orm import relationship
 
 from .db import Base
@@ -51,6 +51,14 @@ class BookingState(str, PyEnum):
     canceled_unpaid_timeout = "canceled_unpaid_timeout"
 
 
+# Состояния, в которых бронь занимает даты вещи
+ACTIVE_BOOKING_STATES = (
+    BookingState.pending_owner_confirm,
+    BookingState.confirmed_unpaid,
+    BookingState.paid_confirmed,
+)
+
+
 class Booking(Base):
     __tablename__ = "bookings"
 
@@ -73,12 +81,48 @@ class Booking(Base):
     owner = relationship("User", back_populates="owner_bookings", foreign_keys=[owner_user_id])
     notifications = relationship("Notification", back_populates="booking")
 
+    __table_args__ = (
+        # История броней вещи и арендатора с листанием по дате начала
+        Index("ix_bookings_item_start", "item_id", "start_date"),
+        Index("ix_bookings_renter_start", "renter_user_id", "start_date"),
+    )
+
+
+class BookingArchive(Base):
+    """Закрытые брони, перенесённые из bookings задачей архивации (bot/archive.py)."""
+
+    __tablename__ = "bookings_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    item_id = Column(Integer, nullable=False, index=True)
+    renter_user_id = Column(Integer, nullable=False, index=True)
+    owner_user_id = Column(Integer, nullable=False, index=True)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+    state = Column(Enum(BookingState), nullable=False)
+    paid_confirmed_at = Column(DateTime, nullable=True)
+    refund_confirmed_at = Column(DateTime, nullable=True)
+    last_refund_reminder_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    canceled_reason = Column(Text, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_bookings_archive_item_start", "item_id", "start_date"),
+        Index("ix_bookings_archive_renter_start", "renter_user_id", "start_date"),
+    )
+
 
 class NotificationType(str, PyEnum):
     minus_24h = "minus_24h"
     minus_12h = "minus_12h"
     minus_2h = "minus_2h"
     start_check = "start_check"
+    refund_reminder = "refund_reminder"
+
+
+PAYMENT_NOTIFICATION_TYPES = (NotificationType.minus_24h, NotificationType.minus_12h, NotificationType.minus_2h)
 
 
 class Notification(Base):
@@ -93,3 +137,97 @@ class Notification(Base):
 
     booking = relationship("Booking", back_populates="notifications")
 
+    __table_args__ = (
+        # Очередь неотправленных уведомлений по времени: частичный индекс только по sent = false
+        Index(
+            "ix_notifications_unsent_due",
+            "scheduled_for",
+            sqlite_where=text("sent = 0"),
+            postgresql_where=text("sent = false"),
+        ),
+    )
+
+
+
+class OutboxMessage(Base):
+    """
+    Исходящее сообщение, записанное в одной транзакции с изменением состояния.
+    Доставляет bot/outbox.py уже после коммита.
+    """
+
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    # JSON-разметка клавиатуры (InlineKeyboardMarkup.as_json())
+    reply_markup = Column(Text, nullable=True)
+    parse_mode = Column(String(16), nullable=True)
+    priority = Column(Integer, default=1, nullable=False)
+    # можно объединить с другими сообщениями в тот же чат в одно (дайджест)
+    digest = Column(Boolean, default=False, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    sent_at = Column(DateTime, nullable=True)
+    failed_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_outbox_pending", "sent_at", "failed_at", "next_attempt_at"),
+    )
+
+
+class JobLease(Base):
+    """
+    Аренда фоновой задачи: выполняет её только владелец (реплика/процесс) до expires_at.
+    Продлевается heartbeat'ом, после истечения её может забрать другая реплика (bot/leases.py).
+    """
+
+    __tablename__ = "job_leases"
+
+    name = Column(String(100), primary_key=True)
+    owner = Column(String(255), nullable=False)
+    acquired_at = Column(DateTime, nullable=False)
+    renewed_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class JobRun(Base):
+    """Один запуск фоновой задачи: когда, где, сколько длился и чем закончился (bot/jobs.py)."""
+
+    __tablename__ = "job_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(100), nullable=False)
+    # процесс, выполнивший задачу (LeaseManager.owner)
+    owner = Column(String(255), nullable=False)
+    # schedule — по расписанию, manual — вызвана командой
+    trigger = Column(String(16), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    duration_ms = Column(Integer, nullable=False)
+    # ok или error
+    status = Column(String(16), nullable=False)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_job_runs_job_started", "job_id", "started_at"),
+    )
+
+
+class FsmStateRow(Base):
+    """FSM-состояние пользователя в чате (bot/fsm_storage.py). data и bucket — JSON."""
+
+    __tablename__ = "fsm_states"
+
+    chat_id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    state = Column(String(255), nullable=True)
+    data = Column(Text, nullable=False, default="{}")
+    bucket = Column(Text, nullable=False, default="{}")
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_fsm_states_updated", "updated_at"),
+    )
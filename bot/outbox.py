@@ -0,0 +1,404 @@
+"""
+Транзакционный outbox.
+
+Операция записи, меняющая состояние, кладёт исходящие сообщения в таблицу outbox
+той же транзакцией (enqueue_message). OutboxWorker после коммита читает готовые
+к отправке строки, отправляет их через общую очередь (sender) и отмечает результат.
+Транзакции БД не держатся открытыми во время запросов к Telegram.
+
+Сообщения с digest=True ждут DIGEST_WINDOW и уходят в чат одним сообщением
+со всеми накопившимися за это время (тексты нумеруются, клавиатуры склеиваются).
+Это для напоминаний и массовых уведомлений; то, чего ждут прямо сейчас (запрос
+владельцу на бронь, ответ владельца арендатору), ставится без digest.
+
+Опрашивает outbox только держатель аренды (в многопроцессном режиме — своего раздела
+чатов), и wake() будит лишь воркер своего процесса: записанное в другой реплике или
+в чужой раздел ждёт до OUTBOX_POLL_SECONDS. Поэтому срочные сообщения ставятся с
+claimed=True: их сразу после коммита отправляет процесс, который их записал
+(deliver_now), а опрос подхватывает их, только если за OUTBOX_CLAIM это не удалось.
+"""
+import asyncio
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from aiogram import Bot, types
+from aiogram.utils.exceptions import (
+    BotBlocked,
+    BotKicked,
+    CantInitiateConversation,
+    ChatNotFound,
+    UserDeactivated,
+)
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+from .db import async_read_session
+from .models import OutboxMessage
+from .sender import PRIORITY_BULK, send_message
+from .writer import submit_write
+
+log = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_POLL_SECONDS = 5.0
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BACKOFF_BASE_SECONDS = 5
+OUTBOX_BACKOFF_MAX_SECONDS = 3600
+DIGEST_WINDOW = timedelta(seconds=10)
+# Сколько опрос не трогает сообщение, которое отправляет записавший его процесс
+OUTBOX_CLAIM = timedelta(seconds=60)
+# Лимиты Telegram: 4096 символов в сообщении, до 100 кнопок в клавиатуре
+DIGEST_MAX_TEXT = 4000
+DIGEST_MAX_BUTTONS = 90
+
+# Повтор не поможет: пользователь заблокировал бота или чата больше нет
+_PERMANENT_ERRORS = (BotBlocked, BotKicked, CantInitiateConversation, ChatNotFound, UserDeactivated)
+
+
+# Что нужно для доставки строки outbox
+_DELIVERY_COLUMNS = (
+    OutboxMessage.id,
+    OutboxMessage.chat_id,
+    OutboxMessage.text,
+    OutboxMessage.reply_markup,
+    OutboxMessage.parse_mode,
+    OutboxMessage.priority,
+    OutboxMessage.attempts,
+    OutboxMessage.digest,
+)
+_PENDING = (OutboxMessage.sent_at.is_(None), OutboxMessage.failed_at.is_(None))
+
+
+def _first_attempt_at(now: datetime, digest: bool, claimed: bool) -> datetime:
+    if digest:
+        return now + DIGEST_WINDOW
+    return now + OUTBOX_CLAIM if claimed else now
+
+
+def enqueue_message(
+    session: Session,
+    chat_id: int,
+    text: str,
+    reply_markup: types.InlineKeyboardMarkup | None = None,
+    parse_mode: str | None = None,
+    priority: int = PRIORITY_BULK,
+    digest: bool = False,
+    claimed: bool = False,
+) -> OutboxMessage:
+    """
+    Положить сообщение в outbox. Вызывается внутри операции записи, коммитит вызывающий.
+    digest=True — можно объединить с другими сообщениями в этот чат за DIGEST_WINDOW.
+    claimed=True — после коммита вызывающий сам отправляет его через deliver_now.
+    """
+    now = datetime.utcnow()
+    msg = OutboxMessage(
+        chat_id=chat_id,
+        text=text,
+        reply_markup=reply_markup.as_json() if reply_markup else None,
+        parse_mode=parse_mode,
+        priority=priority,
+        digest=digest,
+        next_attempt_at=_first_attempt_at(now, digest, claimed),
+    )
+    session.add(msg)
+    return msg
+
+
+def enqueue_messages(
+    session: Session,
+    messages: list[tuple[int, str, types.InlineKeyboardMarkup | None]],
+    priority: int = PRIORITY_BULK,
+    digest: bool = False,
+    claimed: bool = False,
+) -> list[int]:
+    """
+    Положить пачку сообщений (chat_id, текст, клавиатура) в outbox одним INSERT.
+    Вызывается внутри операции записи, коммитит вызывающий. Возвращает id сообщений
+    (для deliver_now при claimed=True).
+    """
+    if not messages:
+        return []
+    now = datetime.utcnow()
+    next_attempt_at = _first_attempt_at(now, digest, claimed)
+    result = session.execute(
+        insert(OutboxMessage).returning(OutboxMessage.id),
+        [
+            {
+                "chat_id": chat_id,
+                "text": text,
+                "reply_markup": reply_markup.as_json() if reply_markup else None,
+                "priority": priority,
+                "digest": digest,
+                "created_at": now,
+                "next_attempt_at": next_attempt_at,
+            }
+            for chat_id, text, reply_markup in messages
+        ],
+    )
+    return list(result.scalars())
+
+
+def _backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(OUTBOX_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX_SECONDS))
+
+
+def _record_results(session: Session, sent: list[int], failed: list[tuple[int, int, str, bool]]) -> None:
+    """Отметить результат доставки пачки: sent — id, failed — (id, attempts, ошибка, окончательно)."""
+    now = datetime.utcnow()
+    if sent:
+        session.execute(
+            update(OutboxMessage)
+            .where(OutboxMessage.id.in_(sent))
+            .values(sent_at=now, attempts=OutboxMessage.attempts + 1)
+        )
+    for msg_id, attempts, error, permanent in failed:
+        values = {"attempts": attempts, "last_error": error[:1000]}
+        if permanent or attempts >= OUTBOX_MAX_ATTEMPTS:
+            values["failed_at"] = now
+        else:
+            values["next_attempt_at"] = now + _backoff(attempts)
+        session.execute(update(OutboxMessage).where(OutboxMessage.id == msg_id).values(**values))
+
+
+@dataclass
+class _Delivery:
+    """Одно сообщение в Telegram: одна строка outbox или дайджест из нескольких."""
+
+    rows: list
+    chat_id: int
+    text: str
+    reply_markup: str | None
+    parse_mode: str | None
+    priority: int
+
+
+def _single(row) -> _Delivery:
+    return _Delivery([row], row.chat_id, row.text, row.reply_markup, row.parse_mode, row.priority)
+
+
+def _numbered_buttons(markup: str | None, n: int) -> list[list[dict]]:
+    if not markup:
+        return []
+    rows = json.loads(markup).get("inline_keyboard", [])
+    return [[{**btn, "text": f"{n} · {btn['text']}"} for btn in row] for row in rows]
+
+
+def _digest(rows: list) -> _Delivery:
+    head = rows[0]
+    parts = [f"🔔 Уведомлений: {len(rows)}"]
+    keyboard: list[list[dict]] = []
+    for n, row in enumerate(rows, start=1):
+        parts.append(f"{n}) {row.text.strip()}")
+        keyboard.extend(_numbered_buttons(row.reply_markup, n))
+    markup = json.dumps({"inline_keyboard": keyboard}, ensure_ascii=False) if keyboard else None
+    return _Delivery(
+        rows, head.chat_id, "\n\n".join(parts), markup, head.parse_mode, min(r.priority for r in rows)
+    )
+
+
+def build_deliveries(rows: list) -> list[_Delivery]:
+    """
+    Разложить строки outbox на сообщения: обычные — по одному, digest — одним сообщением
+    на чат (и parse_mode), с разбиением по лимитам Telegram.
+    """
+    deliveries: list[_Delivery] = []
+    groups: dict[tuple[int, str | None], list] = {}
+    for row in rows:
+        if row.digest:
+            groups.setdefault((row.chat_id, row.parse_mode), []).append(row)
+        else:
+            deliveries.append(_single(row))
+    for group in groups.values():
+        chunk: list = []
+        text_len = buttons = 0
+        for row in group:
+            row_buttons = sum(len(r) for r in json.loads(row.reply_markup)["inline_keyboard"]) if row.reply_markup else 0
+            if chunk and (text_len + len(row.text) > DIGEST_MAX_TEXT or buttons + row_buttons > DIGEST_MAX_BUTTONS):
+                deliveries.append(_digest(chunk) if len(chunk) > 1 else _single(chunk[0]))
+                chunk, text_len, buttons = [], 0, 0
+            chunk.append(row)
+            text_len += len(row.text) + 8
+            buttons += row_buttons
+        if chunk:
+            deliveries.append(_digest(chunk) if len(chunk) > 1 else _single(chunk[0]))
+    return deliveries
+
+
+@dataclass
+class OutboxStats:
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+    # сколько сообщений Telegram сэкономили дайджесты
+    digested: int = 0
+
+
+@dataclass
+class OutboxWorker:
+    poll_seconds: float = OUTBOX_POLL_SECONDS
+    batch_size: int = OUTBOX_BATCH_SIZE
+    stats: OutboxStats = field(default_factory=OutboxStats)
+    # (номер, всего) — в многопроцессном режиме процесс доставляет только в свои чаты
+    partition: tuple[int, int] | None = None
+
+    def __post_init__(self) -> None:
+        self._bot: Bot | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        # Отправки deliver_now, ещё не записавшие результат
+        self._now_tasks: set[asyncio.Task] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, bot: Bot) -> None:
+        if self.running:
+            return
+        self._bot = bot
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="outbox")
+
+    async def stop(self) -> None:
+        # Начатые deliver_now дописывают результат, пока писатель ещё работает
+        if self._now_tasks:
+            await asyncio.gather(*self._now_tasks, return_exceptions=True)
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def wake(self) -> None:
+        """
+        Разбудить воркер сразу после коммита новых сообщений, не дожидаясь опроса.
+        Действует только в процессе, который опрашивает outbox (см. docstring модуля).
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def deliver_now(self, bot: Bot, ids: list[int]) -> None:
+        """
+        Отправить из этого процесса только что закоммиченные сообщения с claimed=True.
+        Не ждёт отправки: результат записывается в outbox, как при опросе.
+        """
+        if not ids:
+            return
+        task = asyncio.get_running_loop().create_task(self._deliver_ids(bot, ids), name="outbox-now")
+        self._now_tasks.add(task)
+        task.add_done_callback(self._now_tasks.discard)
+
+    async def _deliver_ids(self, bot: Bot, ids: list[int]) -> None:
+        try:
+            async with async_read_session() as session:
+                rows = (
+                    await session.execute(select(*_DELIVERY_COLUMNS).where(*_PENDING, OutboxMessage.id.in_(ids)))
+                ).all()
+            if rows:
+                await self._deliver(bot, rows)
+        except Exception:
+            # Строки остаются в outbox: после OUTBOX_CLAIM их отправит опрос
+            log.exception("Не удалось отправить сообщения outbox %s сразу", ids)
+
+    async def _due(self) -> list:
+        columns = _DELIVERY_COLUMNS
+        pending = _PENDING
+        if self.partition is not None:
+            index, count = self.partition
+            # Как chat_id % count в Python: остаток неотрицательный и для групп (id < 0)
+            pending += ((OutboxMessage.chat_id % count + count) % count == index,)
+        async with async_read_session() as session:
+            rows = (
+                await session.execute(
+                    select(*columns)
+                    .where(*pending, OutboxMessage.next_attempt_at <= datetime.utcnow())
+                    .order_by(OutboxMessage.priority, OutboxMessage.id)
+                    .limit(self.batch_size)
+                )
+            ).all()
+            # Окно дайджеста отсчитывается от первого сообщения в чат: остальные, ещё
+            # не дождавшиеся своего окна, забираем вместе с ним
+            digest_chats = {r.chat_id for r in rows if r.digest and r.attempts == 0}
+            if digest_chats:
+                seen = {r.id for r in rows}
+                extra = (
+                    await session.execute(
+                        select(*columns)
+                        .where(
+                            *pending,
+                            OutboxMessage.digest == True,
+                            OutboxMessage.attempts == 0,
+                            OutboxMessage.chat_id.in_(digest_chats),
+                        )
+                        .order_by(OutboxMessage.id)
+                    )
+                ).all()
+                rows += [r for r in extra if r.id not in seen]
+        return rows
+
+    async def _send(self, bot: Bot, delivery: _Delivery) -> Exception | None:
+        try:
+            await send_message(
+                bot,
+                delivery.chat_id,
+                delivery.text,
+                priority=delivery.priority,
+                reply_markup=delivery.reply_markup,
+                parse_mode=delivery.parse_mode,
+            )
+        except Exception as e:
+            return e
+        return None
+
+    async def deliver_due(self) -> int:
+        """Отправить одну пачку готовых сообщений. Возвращает количество строк outbox в ней."""
+        rows = await self._due()
+        if not rows:
+            return 0
+        await self._deliver(self._bot, rows)
+        return len(rows)
+
+    async def _deliver(self, bot: Bot, rows: list) -> None:
+        """Отправить строки outbox и записать результат (повтор — с отсрочкой, через опрос)."""
+        deliveries = build_deliveries(rows)
+        errors = await asyncio.gather(*(self._send(bot, d) for d in deliveries))
+        sent: list[int] = []
+        failed: list[tuple[int, int, str, bool]] = []
+        for delivery, error in zip(deliveries, errors):
+            if error is None:
+                sent.extend(r.id for r in delivery.rows)
+                self.stats.digested += len(delivery.rows) - 1
+                continue
+            permanent = isinstance(error, _PERMANENT_ERRORS)
+            for row in delivery.rows:
+                failed.append((row.id, row.attempts + 1, f"{type(error).__name__}: {error}", permanent))
+                if permanent or row.attempts + 1 >= OUTBOX_MAX_ATTEMPTS:
+                    self.stats.failed += 1
+                    log.warning("Сообщение outbox %s не доставлено в чат %s: %s", row.id, row.chat_id, error)
+                else:
+                    self.stats.retried += 1
+        await submit_write(_record_results, sent, failed)
+        self.stats.sent += len(sent)
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                delivered = await self.deliver_due()
+            except Exception:
+                log.exception("Ошибка доставки outbox")
+                delivered = 0
+            if delivered >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+
+outbox_worker = OutboxWorker()
@@ -0,0 +1,98 @@
+"""
+Ник владельца из таблицы -> Telegram id.
+
+Ники хранятся в каноническом виде (`@` + нижний регистр), как их пишут sync_items и users.
+Карта загружается при старте, пополняется, когда пользователи запускают бота или меняют ник,
+а привязка вещей к никам обновляется после каждой синхронизации с таблицей.
+
+Всё это видит только свой процесс: синхронизацию выполняет держатель аренды, смену ника —
+процесс, получивший апдейт. Поэтому при нескольких процессах (BOT_WORKERS или BOT_REPLICAS
+больше 1) справочник работает без кэша (shared): каждый ник ищется в БД.
+"""
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .db import async_read_session
+from .models import Item, User
+from .statements import statements
+
+
+def canonical_handle(raw: str | None) -> str | None:
+    if not raw:
+        return None
+    handle = raw.strip().lstrip("@").lower()
+    return f"@{handle}" if handle else None
+
+
+class OwnerDirectory:
+    def __init__(self) -> None:
+        self._tg_by_handle: dict[str, int] = {}
+        self._item_handles: dict[int, str] = {}
+        # Без кэша: ники и вещи меняют и другие процессы
+        self.shared = False
+
+    def load(self, session: Session) -> None:
+        """Полная загрузка при старте."""
+        if self.shared:
+            return
+        rows = session.execute(select(User.owner_handle, User.tg_id).where(User.owner_handle.isnot(None)))
+        self._tg_by_handle = {h: tg_id for h, tg_id in rows if h}
+        self.load_items(session)
+
+    def load_items(self, session: Session) -> None:
+        """Перечитать привязку вещей к никам (после синхронизации с таблицей)."""
+        if self.shared:
+            return
+        rows = session.execute(select(Item.id, Item.owner_handle))
+        self._item_handles = {item_id: h for item_id, h in ((i, canonical_handle(h)) for i, h in rows) if h}
+
+    def remember(self, handle: str | None, tg_id: int, old_handle: str | None = None) -> None:
+        if self.shared:
+            return
+        if old_handle and self._tg_by_handle.get(old_handle) == tg_id:
+            del self._tg_by_handle[old_handle]
+        handle = canonical_handle(handle)
+        if handle:
+            self._tg_by_handle[handle] = tg_id
+
+    def cached(self, handle: str | None) -> int | None:
+        handle = canonical_handle(handle)
+        if self.shared or not handle:
+            return None
+        return self._tg_by_handle.get(handle)
+
+    def item_owner(self, item_id: int) -> int | None:
+        """Telegram id владельца вещи, если он уже запускал бота. None — не известно из кэша."""
+        if self.shared:
+            return None
+        handle = self._item_handles.get(item_id)
+        return self._tg_by_handle.get(handle) if handle else None
+
+    def resolve(self, session: Session, handle: str | None) -> int | None:
+        """Из кэша, при промахе — запросом к БД (операции писателя)."""
+        tg_id = self.cached(handle)
+        if tg_id is None and handle:
+            user = statements.execute(
+                session, "user_by_owner_handle", owner_handle=canonical_handle(handle)
+            ).scalar_one_or_none()
+            if user is not None:
+                tg_id = user.tg_id
+                self.remember(handle, tg_id)
+        return tg_id
+
+    async def aresolve(self, handle: str | None) -> int | None:
+        tg_id = self.cached(handle)
+        if tg_id is None and handle:
+            async with async_read_session() as session:
+                user = (
+                    await statements.aexecute(
+                        session, "user_by_owner_handle", owner_handle=canonical_handle(handle)
+                    )
+                ).scalar_one_or_none()
+                tg_id = user.tg_id if user is not None else None
+            if tg_id is not None:
+                self.remember(handle, tg_id)
+        return tg_id
+
+
+owner_directory = OwnerDirectory()
@@ -0,0 +1,119 @@
+"""
+Таймер напоминаний: min-heap моментов срабатывания неотправленных уведомлений.
+
+Загружается из БД при старте (на горизонт REMINDER_HORIZON) и пополняется при
+планировании новых уведомлений — в том числе из потока писателя. Таймер работает
+только у держателя аренды, а уведомления планируют все процессы и реплики, поэтому
+раз в REMINDER_POLL_SECONDS он ещё и читает ближайший момент из БД (MIN по частичному
+индексу неотправленных). В момент срабатывания вызывается переданная функция разбора
+очереди уведомлений. Периодический job остаётся редкой страховочной проверкой.
+"""
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from sqlalchemy import func, select
+
+from .db import async_read_session
+from .models import Notification
+
+log = logging.getLogger(__name__)
+
+REMINDER_HORIZON = timedelta(hours=2)
+REMINDER_POLL_SECONDS = 30.0
+
+
+class ReminderTimer:
+    def __init__(self) -> None:
+        self._heap: list[datetime] = []
+        self._changed: asyncio.Event | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._task: asyncio.Task | None = None
+        self._fire: Callable[[], Awaitable[int]] | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, fire: Callable[[], Awaitable[int]]) -> None:
+        if self.running:
+            return
+        self._fire = fire
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._task = self._loop.create_task(self._run(), name="reminder-timer")
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def load(self) -> int:
+        """Перечитать из БД неотправленные уведомления в пределах горизонта."""
+        until = datetime.utcnow() + REMINDER_HORIZON
+        async with async_read_session() as session:
+            moments = (
+                await session.scalars(
+                    select(Notification.scheduled_for)
+                    .where(Notification.sent == False, Notification.scheduled_for <= until)
+                    .distinct()
+                )
+            ).all()
+        for when in moments:
+            self._push(when)
+        return len(moments)
+
+    async def _poll(self) -> None:
+        """Подхватить ближайший момент, запланированный в другом процессе."""
+        async with async_read_session() as session:
+            when = await session.scalar(select(func.min(Notification.scheduled_for)).where(Notification.sent == False))
+        if when is not None and when <= datetime.utcnow() + REMINDER_HORIZON and when not in self._heap:
+            self._push(when)
+
+    def push(self, when: datetime) -> None:
+        """Добавить момент срабатывания. Можно вызывать из любого потока."""
+        if self._loop is None:
+            return
+        if when > datetime.utcnow() + REMINDER_HORIZON:
+            # Дальние моменты подхватит перечитывание горизонта страховочной проверкой
+            return
+        self._loop.call_soon_threadsafe(self._push, when)
+
+    def _push(self, when: datetime) -> None:
+        heapq.heappush(self._heap, when)
+        self._changed.set()
+
+    async def _run(self) -> None:
+        while True:
+            self._changed.clear()
+            timeout = REMINDER_POLL_SECONDS
+            if self._heap:
+                timeout = min(max((self._heap[0] - datetime.utcnow()).total_seconds(), 0), timeout)
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+            now = datetime.utcnow()
+            if not self._heap or self._heap[0] > now:
+                try:
+                    await self._poll()
+                except Exception:
+                    log.exception("Не удалось прочитать ближайшее напоминание")
+                continue
+            while self._heap and self._heap[0] <= now:
+                heapq.heappop(self._heap)
+            try:
+                await self._fire()
+            except Exception:
+                log.exception("Ошибка при срабатывании таймера напоминаний")
+
+
+reminder_timer = ReminderTimer()
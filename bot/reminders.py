@@ -0,0 +1,260 @@
+"""
+Движок напоминаний и автоотмена неоплаченных броней.
+
+Все напоминания — строки notifications со временем срабатывания:
+- об оплате (T-24h, T-12h, T-2h) — при подтверждении брони владельцем;
+- о подтверждении возврата — при отмене оплаченной брони арендатором, по расписанию из ReminderConfig.
+Наступившие разбираются одной очередью (statements["due_notifications"]) по таймеру reminder_timer.
+"""
+import logging
+import time
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from aiogram import types
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.orm import Session
+
+from .booking_transitions import BookingEvent, apply_system_transition
+from .config import ReminderConfig, load_settings
+from .models import Booking, BookingState, Notification, NotificationType
+from .outbox import enqueue_message, enqueue_messages, outbox_worker
+from .reminder_timer import reminder_timer
+from .statements import statements
+from .writer import submit_write
+
+log = logging.getLogger(__name__)
+
+AUTO_CANCEL_BATCH_SIZE = 500
+
+
+def _booking_start_utc(booking: Booking, tz_name: str = "Europe/Madrid") -> datetime:
+    """Полночь даты начала брони в локальной tz, приведённая к naive UTC."""
+    tz = ZoneInfo(tz_name)
+    local_midnight = datetime.combine(booking.start_date, datetime.min.time(), tzinfo=tz)
+    utc = local_midnight.astimezone(timezone.utc)
+    return utc.replace(tzinfo=None)
+
+
+_PAYMENT_OFFSETS = (
+    (NotificationType.minus_24h, 24),
+    (NotificationType.minus_12h, 12),
+    (NotificationType.minus_2h, 2),
+)
+
+
+def schedule_payment_notifications_many(session: Session, bookings: list) -> list[datetime]:
+    """
+    Запланировать напоминания об оплате для подтверждённых владельцем броней (строки
+    с id и start_date, например из RETURNING): уже запланированные пропускаются,
+    новые — одним INSERT. Операция записи для writer.submit_write: коммитит вызывающий.
+    Возвращает моменты срабатывания запланированных — после коммита их передают push_scheduled.
+    """
+    if not bookings:
+        return []
+    existing = set(
+        session.execute(
+            select(Notification.booking_id, Notification.type).where(
+                Notification.booking_id.in_([b.id for b in bookings]),
+                Notification.type.in_([ntype for ntype, _ in _PAYMENT_OFFSETS]),
+            )
+        ).all()
+    )
+    now = datetime.utcnow()
+    rows = []
+    for booking in bookings:
+        start_dt = _booking_start_utc(booking)
+        for ntype, hours in _PAYMENT_OFFSETS:
+            scheduled = start_dt - timedelta(hours=hours)
+            if scheduled > now and (booking.id, ntype) not in existing:
+                rows.append({"booking_id": booking.id, "type": ntype, "scheduled_for": scheduled})
+    if rows:
+        session.execute(insert(Notification), rows)
+    return [r["scheduled_for"] for r in rows]
+
+
+def refund_reminder_times(canceled_at: datetime, cfg: ReminderConfig) -> list[datetime]:
+    first = canceled_at + timedelta(hours=cfg.refund_start_hours)
+    return [first + timedelta(hours=cfg.refund_interval_hours * k) for k in range(cfg.refund_max_count)]
+
+
+def schedule_refund_notifications(session: Session, booking_id: int, canceled_at: datetime) -> list[datetime]:
+    """
+    Запланировать напоминания подтвердить возврат после отмены оплаченной брони.
+    Операция записи: коммитит вызывающий. Возвращает моменты срабатывания (для push_scheduled).
+    """
+    already = session.scalar(
+        select(Notification.id)
+        .where(Notification.booking_id == booking_id, Notification.type == NotificationType.refund_reminder)
+        .limit(1)
+    )
+    if already:
+        return []
+    times = refund_reminder_times(canceled_at, load_settings().reminders)
+    session.add_all(
+        Notification(booking_id=booking_id, type=NotificationType.refund_reminder, scheduled_for=t) for t in times
+    )
+    return times
+
+
+def push_scheduled(times: list[datetime]) -> None:
+    """
+    Передать таймеру моменты новых напоминаний — только после того, как submit_write
+    вернул управление: до коммита пачки строк ещё нет, а откат savepoint их отменит.
+    """
+    for when in set(times):
+        reminder_timer.push(when)
+
+
+_HOURS_BEFORE = {
+    NotificationType.minus_24h: "24",
+    NotificationType.minus_12h: "12",
+    NotificationType.minus_2h: "2",
+}
+
+
+def _payment_message(n) -> tuple[str, None] | None:
+    if n.state != BookingState.confirmed_unpaid:
+        return None
+    text = (
+        f"Напоминание: бронь «{n.item_name or 'Вещь'}» "
+        f"({n.start_date.strftime('%d.%m')}–{n.end_date.strftime('%d.%m')}) "
+        f"начинается через {_HOURS_BEFORE.get(n.type, '?')} ч. Не забудьте оплатить!"
+    )
+    return text, None
+
+
+def _refund_message(n) -> tuple[str, types.InlineKeyboardMarkup] | None:
+    if (
+        n.state != BookingState.canceled_by_renter
+        or n.paid_confirmed_at is None
+        or n.refund_confirmed_at is not None
+    ):
+        return None
+    text = (
+        f"Напоминание: вы отменили оплаченную бронь «{n.item_name or 'Вещь'}» "
+        f"({n.start_date.strftime('%d.%m')}–{n.end_date.strftime('%d.%m')}).\n\n"
+        "Подтвердите, пожалуйста, что владелец вернул вам деньги (и залог, если был)."
+    )
+    kb = types.InlineKeyboardMarkup()
+    kb.add(
+        types.InlineKeyboardButton(
+            text="✅ Подтвердить возврат",
+            callback_data=f"renter_confirm_refund:{n.booking_id}",
+        )
+    )
+    return text, kb
+
+
+_MESSAGE_BUILDERS = {
+    NotificationType.minus_24h: _payment_message,
+    NotificationType.minus_12h: _payment_message,
+    NotificationType.minus_2h: _payment_message,
+    NotificationType.refund_reminder: _refund_message,
+}
+
+
+def _queue_due_reminders(session: Session, now: datetime) -> int:
+    """
+    Отметить наступившие напоминания отправленными и положить сообщения в outbox.
+    Операция писателя: отметка и сообщения коммитятся вместе.
+    Один запрос на выборку (с бронью и вещью) и один UPDATE на отметку.
+    """
+    due = statements.execute(session, "due_notifications", now=now).all()
+    if not due:
+        return 0
+    queued: list[int] = []
+    refund_bookings: set[int] = set()
+    for n in due:
+        if n.type == NotificationType.refund_reminder and n.booking_id in refund_bookings:
+            # Несколько просроченных напоминаний по одной брони — отправляем одно
+            continue
+        build = _MESSAGE_BUILDERS.get(n.type)
+        message = build(n) if build else None
+        if message is None:
+            continue
+        text, kb = message
+        enqueue_message(session, n.renter_user_id, text, reply_markup=kb, digest=True)
+        queued.append(n.id)
+        if n.type == NotificationType.refund_reminder:
+            refund_bookings.add(n.booking_id)
+    # Неактуальные (бронь уже оплачена, отменена, возврат подтверждён) тоже снимаются с очереди, но без sent_at
+    session.execute(
+        update(Notification)
+        .where(Notification.id.in_([n.id for n in due]))
+        .values(sent=True, sent_at=case((Notification.id.in_(queued), now), else_=None))
+    )
+    if refund_bookings:
+        session.execute(
+            update(Booking).where(Booking.id.in_(refund_bookings)).values(last_refund_reminder_at=now)
+        )
+    return len(queued)
+
+
+async def run_due_reminders() -> int:
+    """
+    Поставить в outbox все наступившие напоминания.
+    Вернуть количество поставленных.
+    """
+    queued = await submit_write(_queue_due_reminders, datetime.utcnow())
+    if queued:
+        outbox_worker.wake()
+    return queued
+
+
+async def sweep_reminders() -> int:
+    """
+    Страховочная проверка: разобрать пропущенные таймером напоминания
+    и перечитать ближайшие моменты срабатывания.
+    """
+    queued = await run_due_reminders()
+    await reminder_timer.load()
+    return queued
+
+
+def _cancel_unpaid(session: Session, today: date, limit: int) -> int:
+    """
+    Отменить пачку неоплаченных броней одним UPDATE ... RETURNING и положить
+    уведомления в outbox одним INSERT в той же транзакции.
+    """
+    rows = apply_system_transition(
+        session, BookingEvent.payment_timeout, Booking.start_date <= today, limit=limit
+    )
+    messages = []
+    for row in rows:
+        item_name = row.item_name or "Вещь"
+        dates_str = f"{row.start_date.strftime('%d.%m')}–{row.end_date.strftime('%d.%m')}"
+        messages.append(
+            (
+                row.renter_user_id,
+                f"Бронь «{item_name}» ({dates_str}) отменена: оплата не подтверждена к дате начала.",
+                None,
+            )
+        )
+        if row.owner_user_id != row.renter_user_id:
+            messages.append(
+                (row.owner_user_id, f"Бронь «{item_name}» ({dates_str}) автоотменена: оплата не получена.", None)
+            )
+    enqueue_messages(session, messages, digest=True)
+    return len(rows)
+
+
+async def auto_cancel_unpaid() -> int:
+    """
+    Автоотмена неоплаченных броней, у которых дата начала уже прошла.
+    Каждая пачка — отдельная транзакция; уведомления после коммита пачки отправляет
+    outbox_worker. Вернуть количество отменённых.
+    """
+    started = time.monotonic()
+    today = date.today()
+    total = 0
+    while True:
+        canceled = await submit_write(_cancel_unpaid, today, AUTO_CANCEL_BATCH_SIZE)
+        total += canceled
+        if canceled:
+            outbox_worker.wake()
+        if canceled < AUTO_CANCEL_BATCH_SIZE:
+            break
+    if total:
+        log.info("Автоотмена неоплаченных броней: %d за %.2f с", total, time.monotonic() - started)
+    return total
@@ -0,0 +1,247 @@
+"""
+Общая очередь исходящих сообщений.
+
+Лимиты Telegram: около 30 сообщений в секунду на бота и около 1 в секунду в один чат.
+Оба лимита соблюдаются токен-бакетами; ответы пользователю (PRIORITY_INTERACTIVE)
+уходят раньше напоминаний и массовых рассылок (PRIORITY_BULK). На RetryAfter
+на паузу ставятся и чат, и общий лимит бота, а сообщение — обратно в очередь.
+
+Ответы хендлеров (message.answer, edit_text и т.п.) тоже идут через очередь: бот
+диспетчера — LimitedBot, который отправляет такие вызовы Bot API через sender.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+log = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+GLOBAL_RATE = 30.0
+CHAT_RATE = 1.0
+CHAT_BURST = 3
+MAX_RETRIES = 5
+
+# Вызовы Bot API, которые считаются в лимиты отправки (ответы на callback и удаление — нет)
+LIMITED_METHODS = frozenset(
+    {
+        "sendMessage",
+        "sendPhoto",
+        "sendDocument",
+        "sendMediaGroup",
+        "copyMessage",
+        "forwardMessage",
+        "editMessageText",
+        "editMessageCaption",
+        "editMessageReplyMarkup",
+    }
+)
+# Выставлен в задаче доставки sender: вызов уже прошёл очередь
+_delivering: contextvars.ContextVar[bool] = contextvars.ContextVar("sender_delivering", default=False)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до появления токена (0 — можно отправлять)."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float) -> None:
+        self._refill(now)
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class _Send:
+    call: Callable[[], Awaitable[Any]]
+    chat_id: int
+    future: asyncio.Future
+    attempts: int = 0
+
+
+@dataclass
+class SenderStats:
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    queued: int = 0
+
+
+@dataclass
+class Sender:
+    global_rate: float = GLOBAL_RATE
+    chat_rate: float = CHAT_RATE
+    chat_burst: int = CHAT_BURST
+    stats: SenderStats = field(default_factory=SenderStats)
+
+    def __post_init__(self) -> None:
+        self._queue: asyncio.PriorityQueue | None = None
+        self._delayed: list[tuple[float, int, int, _Send]] = []
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+        self._chats: dict[int, TokenBucket] = {}
+        self._seq = itertools.count()
+        self._inflight: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def set_global_rate(self, rate: float) -> None:
+        """Поменять общий лимит (до start): в многопроцессном режиме он делится между процессами."""
+        self.global_rate = rate
+        self._global = TokenBucket(rate, max(rate, 1.0))
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="sender")
+
+    async def stop(self) -> None:
+        """Дождаться отправки уже поставленного в очередь и остановиться."""
+        if not self.running:
+            return
+        while self._queue.qsize() or self._delayed or self._inflight:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def send(self, bot: Bot, method: str, chat_id: int, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Any:
+        """Поставить вызов Bot API в очередь и дождаться результата."""
+        return await self.submit(lambda: getattr(bot, method)(chat_id, **kwargs), chat_id, priority)
+
+    async def submit(
+        self, call: Callable[[], Awaitable[Any]], chat_id: int, priority: int = PRIORITY_INTERACTIVE
+    ) -> Any:
+        """Выполнить call в очереди с лимитами чата chat_id и дождаться результата."""
+        if not self.running or _delivering.get():
+            return await call()
+        job = _Send(call, chat_id, asyncio.get_running_loop().create_future())
+        self._put(priority, next(self._seq), job)
+        return await job.future
+
+    def _put(self, priority: int, seq: int, job: _Send) -> None:
+        self.stats.queued += 1
+        self._queue.put_nowait((priority, seq, job))
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10_000:
+                now = time.monotonic()
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.full(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _release_delayed(self, now: float) -> float:
+        """Вернуть в очередь отложенные сообщения, чьё время пришло; вернуть паузу до следующего."""
+        while self._delayed and self._delayed[0][0] <= now:
+            _, priority, seq, job = heapq.heappop(self._delayed)
+            self._queue.put_nowait((priority, seq, job))
+        # Просыпаемся хотя бы раз в секунду: отложенное могло добавиться из _deliver
+        return min(self._delayed[0][0] - now, 1.0) if self._delayed else 1.0
+
+    async def _run(self) -> None:
+        while True:
+            timeout = self._release_delayed(time.monotonic())
+            try:
+                priority, seq, job = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                continue
+            self.stats.queued -= 1
+            now = time.monotonic()
+            chat = self._chat_bucket(job.chat_id)
+            chat_wait = chat.wait_time(now)
+            if chat_wait > 0:
+                # Чат занят — откладываем, остальные чаты тем временем идут дальше
+                self.stats.queued += 1
+                heapq.heappush(self._delayed, (now + chat_wait, priority, seq, job))
+                continue
+            global_wait = self._global.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+            self._global.take()
+            chat.take()
+            task = asyncio.get_running_loop().create_task(self._deliver(priority, seq, job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, priority: int, seq: int, job: _Send) -> None:
+        # Своя задача — свой контекст: флаг не виден вызывающему
+        _delivering.set(True)
+        try:
+            result = await job.call()
+        except RetryAfter as e:
+            job.attempts += 1
+            if job.attempts > MAX_RETRIES:
+                self.stats.failed += 1
+                job.future.set_exception(e)
+                return
+            self.stats.retried += 1
+            now = time.monotonic()
+            self._chat_bucket(job.chat_id).pause(now, e.timeout)
+            # Лимит общий на бота: остальные чаты тоже ждут
+            self._global.pause(now, e.timeout)
+            log.warning("RetryAfter %ss для чата %s", e.timeout, job.chat_id)
+            self.stats.queued += 1
+            heapq.heappush(self._delayed, (now + e.timeout, priority, seq, job))
+        except Exception as e:
+            self.stats.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.stats.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+
+sender = Sender()
+
+
+class LimitedBot(Bot):
+    """Bot, у которого отправка и редактирование сообщений идут через очередь sender."""
+
+    async def request(self, method: str, data: dict | None = None, *args, **kwargs) -> Any:
+        chat_id = (data or {}).get("chat_id")
+        if method not in LIMITED_METHODS or not isinstance(chat_id, int):
+            return await super().request(method, data, *args, **kwargs)
+        return await sender.submit(lambda: super(LimitedBot, self).request(method, data, *args, **kwargs), chat_id)
+
+
+async def send_message(bot: Bot, chat_id: int, text: str, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Any:
+    return await sender.send(bot, "send_message", chat_id, priority, text=text, **kwargs)
+
+
+async def send_photo(bot: Bot, chat_id: int, photo: str, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Any:
+    return await sender.send(bot, "send_photo", chat_id, priority, photo=photo, **kwargs)
@@ -0,0 +1,121 @@
+"""
+Реестр заранее собранных Core-запросов для горячих путей.
+
+Запрос строится один раз при импорте, параметры передаются через bindparam,
+поэтому на вызов не тратится сборка ORM-цепочки, а скомпилированный SQL
+берётся из кэша движка. Для каждого запроса ведётся счётчик вызовов и время.
+"""
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import bindparam, select
+from sqlalchemy.engine import Result
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Executable
+
+from .models import (
+    ACTIVE_BOOKING_STATES,
+    PAYMENT_NOTIFICATION_TYPES,
+    Booking,
+    Item,
+    Notification,
+    NotificationType,
+    User,
+)
+
+
+@dataclass
+class StatementStats:
+    calls: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_seconds * 1000 / self.calls if self.calls else 0.0
+
+
+class StatementRegistry:
+    def __init__(self) -> None:
+        self._statements: dict[str, Executable] = {}
+        self._stats: dict[str, StatementStats] = {}
+
+    def register(self, name: str, stmt: Executable) -> Executable:
+        if name in self._statements:
+            raise ValueError(f"Statement {name!r} is already registered")
+        self._statements[name] = stmt
+        self._stats[name] = StatementStats()
+        return stmt
+
+    def _record(self, name: str, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        st = self._stats[name]
+        st.calls += 1
+        st.total_seconds += elapsed
+        st.max_seconds = max(st.max_seconds, elapsed)
+
+    def execute(self, session: Session, name: str, **params) -> Result:
+        started = time.perf_counter()
+        try:
+            return session.execute(self._statements[name], params)
+        finally:
+            self._record(name, started)
+
+    async def aexecute(self, session: AsyncSession, name: str, **params) -> Result:
+        started = time.perf_counter()
+        try:
+            return await session.execute(self._statements[name], params)
+        finally:
+            self._record(name, started)
+
+    def stats(self) -> dict[str, StatementStats]:
+        return dict(self._stats)
+
+
+statements = StatementRegistry()
+
+# Есть ли активная бронь вещи, пересекающаяся с [start_date, end_date]
+statements.register(
+    "booking_overlap",
+    select(Booking.id)
+    .where(
+        Booking.item_id == bindparam("item_id"),
+        Booking.state.in_(ACTIVE_BOOKING_STATES),
+        Booking.start_date <= bindparam("end_date"),
+        Booking.end_date >= bindparam("start_date"),
+    )
+    .limit(1),
+)
+
+# Неотправленные напоминания, время которых наступило, вместе с бронью и названием вещи.
+# Идёт по частичному индексу ix_notifications_unsent_due
+statements.register(
+    "due_notifications",
+    select(
+        Notification.id,
+        Notification.type,
+        Notification.booking_id,
+        Booking.state,
+        Booking.renter_user_id,
+        Booking.start_date,
+        Booking.end_date,
+        Booking.paid_confirmed_at,
+        Booking.refund_confirmed_at,
+        Item.name.label("item_name"),
+    )
+    .join(Booking, Booking.id == Notification.booking_id)
+    .outerjoin(Item, Item.id == Booking.item_id)
+    .where(
+        Notification.type.in_([*PAYMENT_NOTIFICATION_TYPES, NotificationType.refund_reminder]),
+        Notification.sent == False,
+        Notification.scheduled_for <= bindparam("now"),
+    )
+    .order_by(Notification.scheduled_for),
+)
+
+# Пользователь бота по нику владельца из таблицы
+statements.register(
+    "user_by_owner_handle",
+    select(User).where(User.owner_handle == bindparam("owner_handle")),
+)
@@ -1,8 +1,9 @@
 from typing import Tuple
 
 from .config import load_settings
-from .db import db_session, init_db
+from .db import db_session, init_db, read_session
 from .models import Item
+from .owners import owner_directory
 from .sheets import SheetItem, fetch_items_from_sheet
 
 
@@ -36,11 +37,14 @@ def sync_items_from_google() -> Tuple[int, int]:
     - count_rows — сколько строк было в таблице (после фильтрации пустых).
     """
     settings = load_settings()
-    init_db(settings.db.url)
+    init_db(settings.db.url, settings.db.profile)
 
     sheet_items = fetch_items_from_sheet(settings)
     for si in sheet_items:
         _upsert_item(si)
 
+    with read_session() as session:
+        owner_directory.load_items(session)
+
     return len(sheet_items), len(sheet_items)
 
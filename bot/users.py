@@ -1,24 +1,170 @@
+"""
+Пользователи бота.
+
+Пользователь определяется один раз на апдейт (UserMiddleware) через LRU-кэш в памяти.
+Новые пользователи записываются сразу, смена имени/ника — отложенно, пачками через писателя.
+"""
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+
 from aiogram.types import User as TgUser
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
 
-from .db import db_session
+from .db import async_read_session
 from .models import User
+from .owners import owner_directory
+from .writer import submit_write
+
+log = logging.getLogger(__name__)
+
+USER_CACHE_SIZE = 10_000
+USER_FLUSH_SECONDS = 5.0
+
+
+@dataclass(frozen=True)
+class CachedUser:
+    tg_id: int
+    username: str | None
+    first_name: str | None
+    last_name: str | None
+    owner_handle: str | None
+
+    @classmethod
+    def from_tg(cls, tg: TgUser, owner_handle: str | None = None) -> "CachedUser":
+        return cls(
+            tg_id=tg.id,
+            username=tg.username,
+            first_name=tg.first_name,
+            last_name=tg.last_name,
+            owner_handle=_owner_handle(tg.username) or owner_handle,
+        )
+
+    def same_names(self, tg: TgUser) -> bool:
+        return (self.username, self.first_name, self.last_name) == (tg.username, tg.first_name, tg.last_name)
+
+
+def _owner_handle(username: str | None) -> str | None:
+    # если в таблице владелец использует такой же ник, привязываем
+    return f"@{username.lower()}" if username else None
+
+
+def _upsert_user(
+    session: Session, tg_id: int, username: str | None, first_name: str | None, last_name: str | None
+) -> User:
+    user = session.get(User, tg_id)
+    if user is None:
+        user = User(tg_id=tg_id)
+        session.add(user)
+
+    user.username = username
+    user.first_name = first_name
+    user.last_name = last_name
+
+    handle = _owner_handle(username)
+    if handle:
+        user.owner_handle = handle
+
+    return user
+
+
+def _update_users(session: Session, users: list[CachedUser]) -> None:
+    """Записать накопленные изменения имён одной транзакцией."""
+    for u in users:
+        values = {"username": u.username, "first_name": u.first_name, "last_name": u.last_name}
+        if u.owner_handle:
+            values["owner_handle"] = u.owner_handle
+        session.execute(update(User).where(User.tg_id == u.tg_id).values(**values))
+
+
+class UserCache:
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, flush_seconds: float = USER_FLUSH_SECONDS) -> None:
+        self.maxsize = maxsize
+        self.flush_seconds = flush_seconds
+        self._users: OrderedDict[int, CachedUser] = OrderedDict()
+        self._dirty: dict[int, CachedUser] = {}
+        self._task: asyncio.Task | None = None
+
+    def _remember(self, user: CachedUser) -> None:
+        self._users[user.tg_id] = user
+        self._users.move_to_end(user.tg_id)
+        while len(self._users) > self.maxsize:
+            self._users.popitem(last=False)
+
+    async def _load(self, tg_id: int) -> CachedUser | None:
+        async with async_read_session() as session:
+            row = (
+                await session.execute(
+                    select(User.username, User.first_name, User.last_name, User.owner_handle).where(
+                        User.tg_id == tg_id
+                    )
+                )
+            ).one_or_none()
+        if row is None:
+            return None
+        return CachedUser(tg_id, row.username, row.first_name, row.last_name, row.owner_handle)
+
+    async def resolve(self, tg: TgUser) -> CachedUser:
+        """Пользователь по апдейту Telegram: из кэша, из БД или новая запись."""
+        cached = self._users.get(tg.id)
+        if cached is None:
+            cached = await self._load(tg.id)
+            if cached is None:
+                # Новый пользователь нужен в БД сразу: на него будут ссылаться брони
+                await submit_write(_upsert_user, tg.id, tg.username, tg.first_name, tg.last_name)
+                cached = CachedUser.from_tg(tg)
+                owner_directory.remember(cached.owner_handle, tg.id)
+                self._remember(cached)
+                return cached
+
+        if not cached.same_names(tg):
+            previous = cached
+            cached = CachedUser.from_tg(tg, owner_handle=previous.owner_handle)
+            if cached.owner_handle != previous.owner_handle:
+                owner_directory.remember(cached.owner_handle, tg.id, old_handle=previous.owner_handle)
+            self._dirty[tg.id] = cached
+        self._remember(cached)
+        return cached
 
+    async def flush(self) -> int:
+        """Записать накопленные изменения имён. Возвращает количество пользователей."""
+        if not self._dirty:
+            return 0
+        batch = list(self._dirty.values())
+        self._dirty = {}
+        try:
+            await submit_write(_update_users, batch)
+        except Exception:
+            # Вернуть в очередь, если за это время не пришли более свежие данные
+            for u in batch:
+                self._dirty.setdefault(u.tg_id, u)
+            raise
+        return len(batch)
 
-def get_or_create_user(tg: TgUser) -> User:
-    with db_session() as session:
-        user = session.query(User).get(tg.id)
-        if user is None:
-            user = User(tg_id=tg.id)
-            session.add(user)
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Не удалось записать изменения пользователей")
 
-        user.username = tg.username
-        user.first_name = tg.first_name
-        user.last_name = tg.last_name
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="user-cache-flush")
 
-        if tg.username:
-            handle = f"@{tg.username.lower()}"
-            # если в таблице владелец использует такой же ник, привязываем
-            user.owner_handle = handle
+    async def stop(self) -> None:
+        """Остановить фоновую запись и дописать оставшееся."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
 
-        return user
 
+user_cache = UserCache()
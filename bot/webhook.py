@@ -0,0 +1,209 @@
+"""
+Режим webhook: aiohttp-сервер aiogram вместо long polling.
+
+Запрос Telegram проверяется по секрету, апдейт кладётся в пул и сразу получает 200 —
+обработка не держит HTTP-соединение. Пул — concurrency очередей-разделов по chat_id:
+апдейты одного чата обрабатываются строго по порядку (FSM), разных чатов — параллельно.
+Переполненный раздел отвечает 503 с Retry-After, и Telegram повторит доставку.
+
+Локальная проверка без Telegram: BOT_RUN_MODE=webhook без WEBHOOK_BASE_URL и
+`python -m bench.webhook_replay updates.jsonl` (см. README).
+"""
+import asyncio
+import hmac
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiogram.utils.executor import Executor
+from aiohttp import web
+
+from .config import WebhookConfig
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+_SECRET_KEY = "WEBHOOK_SECRET_TOKEN"
+# Куда отдавать апдейт: по умолчанию локальный пул, во фронте многопроцессного режима — воркерам
+_SUBMIT_KEY = "WEBHOOK_SUBMIT"
+
+# Апдейты, у которых есть чат; у остальных ключ — пользователь
+_CHAT_FIELDS = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+)
+_USER_FIELDS = ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query")
+
+
+def update_chat_id(update: types.Update) -> int:
+    """Ключ раздела апдейта: id чата, а если чата нет — id пользователя."""
+    for name in _CHAT_FIELDS:
+        obj = getattr(update, name, None)
+        if obj is not None:
+            return obj.chat.id
+    if update.callback_query is not None:
+        cq = update.callback_query
+        return cq.message.chat.id if cq.message else cq.from_user.id
+    for name in _USER_FIELDS:
+        obj = getattr(update, name, None)
+        if obj is not None:
+            return obj.from_user.id
+    if update.poll_answer is not None:
+        return update.poll_answer.user.id
+    return update.update_id
+
+
+@dataclass
+class PoolStats:
+    accepted: int = 0
+    rejected: int = 0
+    processed: int = 0
+    failed: int = 0
+    busy_seconds: float = 0.0
+
+
+@dataclass
+class UpdatePool:
+    concurrency: int = 32
+    queue_size: int = 1000
+    stats: PoolStats = field(default_factory=PoolStats)
+
+    def __post_init__(self) -> None:
+        self._dp: Dispatcher | None = None
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    @property
+    def pending(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def start(self, dp: Dispatcher) -> None:
+        if self.running:
+            return
+        self._dp = dp
+        per_queue = max(self.queue_size // self.concurrency, 1)
+        loop = asyncio.get_running_loop()
+        self._queues = [asyncio.Queue(maxsize=per_queue) for _ in range(self.concurrency)]
+        self._tasks = [
+            loop.create_task(self._work(q), name=f"updates-{i}") for i, q in enumerate(self._queues)
+        ]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Доработать принятые апдейты (не дольше timeout) и остановиться."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Пул апдейтов остановлен, не обработано: %d", self.pending)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, update: types.Update) -> bool:
+        """Поставить апдейт в раздел его чата. False — раздел переполнен."""
+        queue = self._queues[update_chat_id(update) % len(self._queues)]
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.stats.rejected += 1
+            return False
+        self.stats.accepted += 1
+        return True
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        Bot.set_current(self._dp.bot)
+        Dispatcher.set_current(self._dp)
+        while True:
+            update = await queue.get()
+            started = time.monotonic()
+            try:
+                await self._dp.updates_handler.notify(update)
+                self.stats.processed += 1
+            except Exception:
+                self.stats.failed += 1
+                log.exception("Ошибка обработки апдейта %s", update.update_id)
+            finally:
+                self.stats.busy_seconds += time.monotonic() - started
+                queue.task_done()
+
+
+update_pool = UpdatePool()
+
+
+class TelegramWebhookHandler(WebhookRequestHandler):
+    """Проверяет секрет и отвечает сразу после постановки апдейта в пул."""
+
+    async def post(self) -> web.Response:
+        self.validate_ip()
+        secret = self.request.app.get(_SECRET_KEY)
+        if secret and not hmac.compare_digest(self.request.headers.get(SECRET_HEADER, ""), secret):
+            raise web.HTTPUnauthorized()
+        dispatcher = self.get_dispatcher()
+        try:
+            update = await self.parse_update(dispatcher.bot)
+        except Exception:
+            raise web.HTTPBadRequest()
+        submit = self.request.app.get(_SUBMIT_KEY, update_pool.submit)
+        if not submit(update):
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response(text="ok")
+
+
+def webhook_app(cfg: WebhookConfig, submit: Callable[[types.Update], bool] | None = None) -> web.Application:
+    app = web.Application()
+    app[_SECRET_KEY] = cfg.secret_token
+    if submit is not None:
+        app[_SUBMIT_KEY] = submit
+    return app
+
+
+async def register_webhook(bot: Bot, cfg: WebhookConfig) -> None:
+    if not cfg.base_url:
+        log.info("WEBHOOK_BASE_URL не задан: webhook в Telegram не регистрируется")
+        return
+    await bot.set_webhook(
+        cfg.base_url + cfg.path,
+        secret_token=cfg.secret_token or None,
+        max_connections=min(cfg.concurrency, 100),
+    )
+    log.info("Webhook зарегистрирован: %s%s", cfg.base_url, cfg.path)
+
+
+def run_webhook(
+    dp: Dispatcher,
+    cfg: WebhookConfig,
+    on_startup: Callable[[Dispatcher], Awaitable[None]],
+    on_shutdown: Callable[[Dispatcher], Awaitable[None]],
+) -> None:
+    """Запустить бота в режиме webhook (блокирует до остановки сервера)."""
+    update_pool.concurrency = cfg.concurrency
+    update_pool.queue_size = cfg.queue_size
+
+    async def _startup(dispatcher: Dispatcher) -> None:
+        await on_startup(dispatcher)
+        update_pool.start(dispatcher)
+        await register_webhook(dispatcher.bot, cfg)
+
+    async def _shutdown(dispatcher: Dispatcher) -> None:
+        await update_pool.stop()
+        await on_shutdown(dispatcher)
+
+    executor = Executor(dp)
+    executor.on_startup(_startup, polling=False)
+    executor.on_shutdown(_shutdown, polling=False)
+    executor.set_webhook(webhook_path=cfg.path, request_handler=TelegramWebhookHandler, web_app=webhook_app(cfg))
+    executor.run_app(host=cfg.host, port=cfg.port)
@@ -0,0 +1,272 @@
+"""
+Многопроцессный режим (BOT_WORKERS > 1).
+
+Фронт-процесс получает апдейты (webhook или long polling) и раскладывает их по
+воркерам по chat_id % BOT_WORKERS: все апдейты одного чата попадают в один процесс,
+поэтому порядок и FSM-состояние чата остаются согласованными. Каждый воркер — обычный
+бот со своим Dispatcher, пулом апдейтов (webhook.update_pool) и писателем; БД общая.
+Outbox каждый воркер доставляет только в свои чаты; фоновые задачи распределяются
+арендами в БД (bot/leases.py), как между репликами.
+Воркеры раз в WORKER_REPORT_SECONDS пишут в лог свою пропускную способность.
+"""
+import asyncio
+import logging
+import multiprocessing as mp
+import queue
+import signal
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY
+from aiohttp import web
+
+from .config import Settings, load_settings
+from .webhook import TelegramWebhookHandler, register_webhook, update_chat_id, update_pool, webhook_app
+
+log = logging.getLogger(__name__)
+
+WORKER_REPORT_SECONDS = 60
+WORKER_STOP_TIMEOUT = 15.0
+POLL_TIMEOUT = 20
+_IDLE = object()
+
+
+@dataclass
+class WorkerSlot:
+    """Место текущего процесса среди воркеров; в обычном режиме — единственный."""
+
+    index: int = 0
+    count: int = 1
+
+    @property
+    def spawned(self) -> bool:
+        return self.count > 1
+
+
+worker_slot = WorkerSlot()
+
+DispatcherFactory = Callable[[], Dispatcher]
+Hook = Callable[[Dispatcher], Awaitable[None]]
+
+
+# --- воркер ---
+
+
+async def _report_throughput() -> None:
+    last, last_at = 0, time.monotonic()
+    while True:
+        await asyncio.sleep(WORKER_REPORT_SECONDS)
+        now, done = time.monotonic(), update_pool.stats.processed
+        log.info(
+            "Воркер %d/%d: %d апдейтов за %.0f с (%.1f/с), в очереди %d, ошибок %d",
+            worker_slot.index,
+            worker_slot.count,
+            done - last,
+            now - last_at,
+            (done - last) / (now - last_at),
+            update_pool.pending,
+            update_pool.stats.failed,
+        )
+        last, last_at = done, now
+
+
+def _next_update(updates: mp.Queue):
+    # С таймаутом, чтобы поток исполнителя не зависал на get() при остановке
+    try:
+        return updates.get(timeout=1)
+    except queue.Empty:
+        return _IDLE
+
+
+async def _serve(dp: Dispatcher, updates: mp.Queue, on_startup: Hook, on_shutdown: Hook) -> None:
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    await on_startup(dp)
+    cfg = load_settings().webhook
+    update_pool.concurrency = cfg.concurrency
+    update_pool.queue_size = cfg.queue_size
+    update_pool.start(dp)
+    reporter = asyncio.get_running_loop().create_task(_report_throughput())
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, _next_update, updates)
+            if data is _IDLE:
+                continue
+            if data is None:
+                break
+            update = types.Update(**data)
+            # Пул полон — ждём, фронт тем временем копит апдейты в очереди процесса
+            while not update_pool.submit(update):
+                await asyncio.sleep(0.05)
+    finally:
+        reporter.cancel()
+        await update_pool.stop()
+        await on_shutdown(dp)
+        await (await dp.bot.get_session()).close()
+
+
+def _worker_main(
+    index: int, count: int, updates: mp.Queue, build_dispatcher: DispatcherFactory, on_startup: Hook, on_shutdown: Hook
+) -> None:
+    # Ctrl+C получает вся группа процессов; останавливает воркеры фронт
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_slot.index, worker_slot.count = index, count
+    dp = build_dispatcher()
+    asyncio.run(_serve(dp, updates, on_startup, on_shutdown))
+    log.info("Воркер %d/%d остановлен", index, count)
+
+
+# --- фронт ---
+
+
+class UpdateRouter:
+    """Раскладывает апдейты по очередям воркеров и следит, что воркеры живы."""
+
+    def __init__(self, settings: Settings, build_dispatcher: DispatcherFactory, on_startup: Hook, on_shutdown: Hook):
+        self._count = settings.bot.workers
+        self._target = (build_dispatcher, on_startup, on_shutdown)
+        self._ctx = mp.get_context("spawn")
+        self._queues = [self._ctx.Queue(maxsize=settings.webhook.queue_size) for _ in range(self._count)]
+        self._procs: list = [None] * self._count
+        self.routed = [0] * self._count
+        self.rejected = 0
+
+    def _spawn(self, index: int) -> None:
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(index, self._count, self._queues[index], *self._target),
+            name=f"bot-worker-{index}",
+        )
+        proc.start()
+        self._procs[index] = proc
+
+    def start(self) -> None:
+        for index in range(self._count):
+            self._spawn(index)
+        log.info("Запущено воркеров: %d", self._count)
+
+    def stop(self) -> None:
+        for q in self._queues:
+            try:
+                q.put(None, timeout=1)
+            except queue.Full:
+                pass
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for proc in self._procs:
+            proc.join(max(deadline - time.monotonic(), 0))
+            if proc.is_alive():
+                log.warning("Воркер %s не остановился вовремя, завершаю", proc.name)
+                proc.terminate()
+
+    def _index(self, update: types.Update) -> int:
+        return update_chat_id(update) % self._count
+
+    def submit(self, update: types.Update) -> bool:
+        """Без ожидания (webhook): False — очередь воркера переполнена."""
+        index = self._index(update)
+        try:
+            self._queues[index].put_nowait(update.to_python())
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.routed[index] += 1
+        return True
+
+    async def put(self, update: types.Update) -> None:
+        """С ожиданием места в очереди (long polling)."""
+        index = self._index(update)
+        await asyncio.get_running_loop().run_in_executor(None, self._queues[index].put, update.to_python())
+        self.routed[index] += 1
+
+    async def watch(self) -> None:
+        """Перезапускать упавшие воркеры и писать в лог распределение апдейтов."""
+        last = list(self.routed)
+        elapsed = 0.0
+        while True:
+            await asyncio.sleep(5)
+            elapsed += 5
+            for index, proc in enumerate(self._procs):
+                if not proc.is_alive():
+                    log.error("Воркер %d упал (код %s), перезапускаю", index, proc.exitcode)
+                    self._spawn(index)
+            if elapsed >= WORKER_REPORT_SECONDS:
+                per_worker = ", ".join(f"{i}: {n - p}" for i, (n, p) in enumerate(zip(self.routed, last)))
+                log.info("Фронт: апдейтов по воркерам за %.0f с — %s; отклонено %d", elapsed, per_worker, self.rejected)
+                last, elapsed = list(self.routed), 0.0
+
+
+async def _poll(bot: Bot, router: UpdateRouter) -> None:
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+        except Exception:
+            log.exception("Ошибка получения апдейтов")
+            await asyncio.sleep(5)
+            continue
+        for update in updates:
+            await router.put(update)
+            offset = update.update_id + 1
+
+
+def _run_polling_front(bot: Bot, router: UpdateRouter) -> None:
+    async def main() -> None:
+        watcher = asyncio.get_running_loop().create_task(router.watch())
+        try:
+            await _poll(bot, router)
+        finally:
+            watcher.cancel()
+            await (await bot.get_session()).close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+def _run_webhook_front(bot: Bot, router: UpdateRouter, settings: Settings) -> None:
+    cfg = settings.webhook
+    app = webhook_app(cfg, submit=router.submit)
+    # Хендлеру webhook Dispatcher нужен только для разбора апдейта
+    app[BOT_DISPATCHER_KEY] = Dispatcher(bot)
+    app.router.add_route("*", cfg.path, TelegramWebhookHandler)
+
+    async def on_startup(_: web.Application) -> None:
+        app["router_watch"] = asyncio.get_running_loop().create_task(router.watch())
+        await register_webhook(bot, cfg)
+
+    async def on_cleanup(_: web.Application) -> None:
+        app["router_watch"].cancel()
+        await (await bot.get_session()).close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    web.run_app(app, host=cfg.host, port=cfg.port)
+
+
+def run_workers(
+    settings: Settings,
+    build_dispatcher: DispatcherFactory,
+    on_startup: Hook,
+    on_shutdown: Hook,
+    prepare: Callable[[Settings], None],
+) -> None:
+    """
+    Запустить фронт и BOT_WORKERS воркеров (блокирует до остановки).
+    prepare — схема и миграции БД, выполняются один раз до запуска воркеров.
+    """
+    prepare(settings)
+    router = UpdateRouter(settings, build_dispatcher, on_startup, on_shutdown)
+    router.start()
+    bot = Bot(token=settings.bot.token)
+    try:
+        if settings.bot.run_mode == "webhook":
+            _run_webhook_front(bot, router, settings)
+        else:
+            _run_polling_front(bot, router)
+    finally:
+        router.stop()
@@ -0,0 +1,153 @@
+"""
+Единственный писатель в БД: операции записи идут через очередь,
+а пришедшие в пределах нескольких миллисекунд коммитятся одной транзакцией.
+
+Операция записи — обычная функция `fn(session, *args, **kwargs)`, которая работает
+с синхронной ORM-сессией и не коммитит сама. Каждая операция выполняется в своём
+SAVEPOINT, поэтому ошибка одной не откатывает остальные операции пачки.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from . import db
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class _WriteOp:
+    fn: Callable[..., Any]
+    args: tuple
+    kwargs: dict
+    future: asyncio.Future
+
+
+@dataclass
+class WriterStats:
+    batches: int = 0
+    ops: int = 0
+    failed_ops: int = 0
+    commit_seconds: float = 0.0
+    max_batch: int = 0
+
+    @property
+    def avg_batch(self) -> float:
+        return self.ops / self.batches if self.batches else 0.0
+
+
+@dataclass
+class DbWriter:
+    window_ms: float = 5.0
+    max_batch: int = 200
+    stats: WriterStats = field(default_factory=WriterStats)
+
+    def __post_init__(self) -> None:
+        self._queue: asyncio.Queue[_WriteOp] | None = None
+        self._task: asyncio.Task | None = None
+        # Один поток — одно соединение на запись, SQLite не борется сам с собой за блокировку
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="db-writer")
+
+    async def stop(self) -> None:
+        """Дописать всё, что уже в очереди, и остановить писателя."""
+        if not self.running:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Поставить операцию в очередь и дождаться результата после коммита."""
+        if not self.running:
+            with db.db_session() as session:
+                return fn(session, *args, **kwargs)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_WriteOp(fn, args, kwargs, future))
+        return await future
+
+    async def _collect_batch(self) -> list[_WriteOp]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window_ms / 1000
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            try:
+                outcomes = await loop.run_in_executor(self._executor, self._commit_batch, batch)
+            except Exception as e:
+                outcomes = [(False, e)] * len(batch)
+            for op, (ok, value) in zip(batch, outcomes):
+                if not op.future.done():
+                    if ok:
+                        op.future.set_result(value)
+                    else:
+                        op.future.set_exception(value)
+                self._queue.task_done()
+
+    def _commit_batch(self, batch: list[_WriteOp]) -> list[tuple[bool, Any]]:
+        started = time.perf_counter()
+        session = db.SessionLocal()
+        outcomes: list[tuple[bool, Any]] = []
+        try:
+            for op in batch:
+                try:
+                    with session.begin_nested():
+                        outcomes.append((True, op.fn(session, *op.args, **op.kwargs)))
+                except Exception as e:
+                    log.exception("Операция записи %s завершилась ошибкой", getattr(op.fn, "__name__", op.fn))
+                    outcomes.append((False, e))
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            log.exception("Групповой коммит из %d операций не удался", len(batch))
+            outcomes = [(False, e)] * len(batch)
+        finally:
+            session.close()
+
+        self.stats.batches += 1
+        self.stats.ops += len(batch)
+        self.stats.failed_ops += sum(1 for ok, _ in outcomes if not ok)
+        self.stats.max_batch = max(self.stats.max_batch, len(batch))
+        self.stats.commit_seconds += time.perf_counter() - started
+        return outcomes
+
+
+db_writer = DbWriter()
+
+
+async def submit_write(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Выполнить `fn(session, *args, **kwargs)` через общего писателя."""
+    return await db_writer.submit(fn, *args, **kwargs)
@@ -1,55 +1,114 @@
+import html
 import logging
 
-from aiogram import Bot, Dispatcher, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram import Dispatcher, types
 from aiogram.utils import executor
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from bot.config import load_settings
+from bot.config import Settings, load_settings
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
 )
-from bot.db import Base, init_db
+from bot.archive import archive_closed_bookings
+from bot.db import Base, ensure_indexes, init_async_db, init_db, read_session
+from bot.fsm_storage import fsm_storage
+from bot.handlers_blackout import register_blackout_handlers
 from bot.handlers_booking import register_booking_handlers
+from bot.handlers_inbox import register_inbox_handlers
 from bot.handlers_search import register_search_handlers
-from bot.payment_reminders import auto_cancel_unpaid, run_payment_reminders
-from bot.refund_reminders import ensure_item_photo_column, ensure_refund_columns, send_refund_reminders
+from bot.jobs import job_runner
+from bot.leases import lease_manager
+from bot.middlewares import UserMiddleware
+from bot.migrations import (
+    backfill_refund_notifications,
+    ensure_item_photo_column,
+    ensure_notification_types,
+    ensure_outbox_digest_column,
+    ensure_refund_columns,
+)
+from bot.outbox import outbox_worker
+from bot.owners import owner_directory
+from bot.reminder_timer import reminder_timer
+from bot.reminders import auto_cancel_unpaid, run_due_reminders, sweep_reminders
+from bot.sender import GLOBAL_RATE, LimitedBot, sender
+from bot.statements import statements
 from bot.sync_items import sync_items_from_google
+from bot.users import user_cache
+from bot.webhook import run_webhook, update_pool
+from bot.workers import run_workers, worker_slot
+from bot.writer import db_writer
 
 
-async def on_startup(dispatcher: Dispatcher) -> None:
-    settings = load_settings()
-    engine = init_db(settings.db.url)
+def prepare_database(settings: Settings) -> None:
+    """Схема, миграции и разовые досчёты. В многопроцессном режиме — один раз во фронте."""
+    engine = init_db(settings.db.url, settings.db.profile)
     Base.metadata.create_all(bind=engine)
     ensure_item_photo_column()
     ensure_refund_columns()
+    ensure_notification_types()
+    ensure_outbox_digest_column()
+    ensure_indexes()
+    backfill_refund_notifications()
+
+
+async def on_startup(dispatcher: Dispatcher) -> None:
+    settings = load_settings()
+    if worker_slot.spawned:
+        init_db(settings.db.url, settings.db.profile)
+    else:
+        prepare_database(settings)
+    init_async_db(settings.db.url, settings.db.profile)
+    # Синхронизацию и смену ника видит один процесс — остальным кэш ников не годится
+    owner_directory.shared = settings.bot.replicas > 1 or settings.bot.workers > 1
+    with read_session() as session:
+        owner_directory.load(session)
+    db_writer.window_ms = settings.db.write_batch_window_ms
+    db_writer.start()
+    user_cache.start()
+    # Реплики за балансировщиком получают апдейты одного чата вперемешку — кэш состояний не годится
+    fsm_storage.shared = settings.bot.replicas > 1
+    fsm_storage.start()
+    # Лимит Telegram общий на бота: делим его между процессами
+    sender.set_global_rate(GLOBAL_RATE / worker_slot.count)
+    sender.start()
+    # Outbox и таймер напоминаний работают ровно в одном процессе среди всех реплик:
+    # кто держит аренду, тот и запускает (в многопроцессном режиме outbox — по разделам)
+    outbox_lease = "outbox"
+    if worker_slot.spawned:
+        outbox_worker.partition = (worker_slot.index, worker_slot.count)
+        outbox_lease = f"outbox:{worker_slot.index}/{worker_slot.count}"
+
+    async def start_outbox() -> None:
+        outbox_worker.start(dispatcher.bot)
+
+    async def start_reminder_timer() -> None:
+        reminder_timer.start(run_due_reminders)
+        await sweep_reminders()
+
+    lease_manager.follow(outbox_lease, start_outbox, outbox_worker.stop)
+    lease_manager.follow("reminder_timer", start_reminder_timer, reminder_timer.stop)
+    await lease_manager.start()
+
+    # Задачи зарегистрированы в каждом процессе, но каждая выполняется только у держателя её аренды
+    job_runner.add("sync_items_periodic", sync_items_from_google, minutes=10)
+    # Напоминания срабатывают по таймеру в точное время; job только страхует и идёт там же, где таймер
+    job_runner.add("reminders_sweep", sweep_reminders, lease="reminder_timer", hours=1)
+    job_runner.add("auto_cancel_unpaid", auto_cancel_unpaid, hours=1)
+    job_runner.add("archive_bookings", archive_closed_bookings, hours=24)
+    job_runner.add("fsm_purge", fsm_storage.purge_expired, hours=1)
+    job_runner.start(settings.bot.timezone)
+
 
-    scheduler = AsyncIOScheduler(timezone=settings.bot.timezone)
-    scheduler.add_job(sync_items_from_google, "interval", minutes=10, id="sync_items_periodic")
-    scheduler.add_job(
-        send_refund_reminders,
-        "interval",
-        hours=24,
-        id="refund_reminders",
-        args=[dispatcher.bot],
-    )
-    scheduler.add_job(
-        run_payment_reminders,
-        "interval",
-        minutes=15,
-        id="payment_reminders",
-        args=[dispatcher.bot],
-    )
-    scheduler.add_job(
-        auto_cancel_unpaid,
-        "interval",
-        hours=1,
-        id="auto_cancel_unpaid",
-        args=[dispatcher.bot],
-    )
-    scheduler.start()
+async def on_shutdown(dispatcher: Dispatcher) -> None:
+    job_runner.stop()
+    await lease_manager.stop()
+    await reminder_timer.stop()
+    await outbox_worker.stop()
+    await sender.stop()
+    await user_cache.stop()
+    await fsm_storage.stop()
+    await db_writer.stop()
 
 
 def register_service_handlers(dp: Dispatcher) -> None:
@@ -57,20 +116,97 @@ def register_service_handlers(dp: Dispatcher) -> None:
     async def cmd_sync_items(message: types.Message, state) -> None:
         await message.answer("Запускаю синхронизацию с таблицей, это может занять несколько секунд...")
         try:
-            count, _ = sync_items_from_google()
+            run = await job_runner.run_now("sync_items_periodic")
         except Exception as e:
-            import traceback
-            traceback.print_exc()
             await message.answer(f"Ошибка при синхронизации: {type(e).__name__}: {e}")
             return
+        if run is None:
+            await message.answer("Синхронизация уже идёт, дождитесь её окончания.")
+            return
+        count, _ = run.value
         await message.answer(f"Синхронизация завершена. В БД сохранено вещей: {count}.")
 
+    @dp.message_handler(commands=["jobs"], state="*")
+    async def cmd_jobs(message: types.Message, state) -> None:
+        if message.from_user.id not in load_settings().bot.admin_ids:
+            return
+        arg = message.get_args().strip()
+        limit = min(int(arg), 20) if arg.isdigit() and int(arg) > 0 else 5
+        lines = []
+        for job_id, runs in (await job_runner.recent_runs(limit)).items():
+            next_run = job_runner.next_run(job_id)
+            if job_runner.running(job_id):
+                status = "выполняется"
+            elif next_run:
+                status = f"следующий запуск {next_run:%d.%m %H:%M}"
+            else:
+                status = "не запланирована"
+            overlaps = job_runner.overlaps.get(job_id, 0)
+            if overlaps:
+                status += f", пропущено из-за наложения: {overlaps}"
+            lines.append(f"<b>{job_id}</b> — {status}")
+            for r in runs:
+                mark = "✅" if r.status == "ok" else "❌"
+                outcome = r.result if r.status == "ok" else r.error
+                lines.append(
+                    f"{mark} {r.started_at:%d.%m %H:%M:%S} UTC · {r.duration_ms / 1000:.1f} с · {r.trigger}"
+                    + (f" · {html.escape(outcome[:100])}" if outcome else "")
+                )
+            if not runs:
+                lines.append("запусков ещё не было")
+            lines.append("")
+        await message.answer("\n".join(lines).strip() or "Задач нет.")
 
-def main() -> None:
+    @dp.message_handler(commands=["db_stats"], state="*")
+    async def cmd_db_stats(message: types.Message, state) -> None:
+        if message.from_user.id not in load_settings().bot.admin_ids:
+            return
+        lines = ["<b>Горячие запросы</b>"]
+        for name, st in statements.stats().items():
+            lines.append(
+                f"• {name}: {st.calls} вызовов, среднее {st.avg_ms:.2f} мс, макс {st.max_seconds * 1000:.2f} мс"
+            )
+        ws = db_writer.stats
+        lines += [
+            "",
+            "<b>Писатель</b>",
+            f"• транзакций: {ws.batches}, операций: {ws.ops} (ошибок: {ws.failed_ops})",
+            f"• средняя пачка: {ws.avg_batch:.1f}, максимальная: {ws.max_batch}",
+        ]
+        ss = sender.stats
+        lines += [
+            "",
+            "<b>Отправка сообщений</b>",
+            f"• отправлено: {ss.sent}, ошибок: {ss.failed}, повторов после 429: {ss.retried}, в очереди: {ss.queued}",
+            f"• outbox: доставлено {outbox_worker.stats.sent}, повторов {outbox_worker.stats.retried}, "
+            f"не доставлено {outbox_worker.stats.failed}, объединено в дайджесты {outbox_worker.stats.digested}",
+        ]
+        fs, size = fsm_storage.stats, await fsm_storage.table_size()
+        lines += [
+            "",
+            "<b>Состояния диалогов (FSM)</b>",
+            f"• в памяти: {fsm_storage.cached}, ждут записи: {fsm_storage.dirty}, "
+            f"попаданий в кэш: {fs.hits}, чтений из БД: {fs.loads}",
+            f"• в БД: {size.rows} ({size.payload_bytes / 1024:.1f} КБ данных), "
+            f"вытеснено брошенных: {fs.evicted}, удалено из БД: {fs.purged}",
+        ]
+        if update_pool.running:
+            ps = update_pool.stats
+            title = f"Воркер {worker_slot.index + 1} из {worker_slot.count}" if worker_slot.spawned else "Webhook"
+            lines += [
+                "",
+                f"<b>{title}</b>",
+                f"• принято апдейтов: {ps.accepted}, отклонено (503): {ps.rejected}, в очереди: {update_pool.pending}",
+                f"• обработано: {ps.processed}, ошибок: {ps.failed}, время обработки: {ps.busy_seconds:.1f} с",
+            ]
+        await message.answer("\n".join(lines))
+
+
+def build_dispatcher() -> Dispatcher:
     settings = load_settings()
-    bot = Bot(token=settings.bot.token, parse_mode=types.ParseMode.HTML)
-    storage = MemoryStorage()
-    dp = Dispatcher(bot, storage=storage)
+    # Ответы хендлеров идут через очередь sender с общими лимитами отправки
+    bot = LimitedBot(token=settings.bot.token, parse_mode=types.ParseMode.HTML)
+    dp = Dispatcher(bot, storage=fsm_storage)
 
     @dp.errors_handler()
     async def errors_handler(update, exception):
@@ -79,11 +215,27 @@ def main() -> None:
         traceback.print_exc()
         return True
 
+    dp.middleware.setup(UserMiddleware())
+
     register_service_handlers(dp)
     register_search_handlers(dp)
     register_booking_handlers(dp)
+    register_blackout_handlers(dp)
+    register_inbox_handlers(dp)
+    return dp
+
+
+def main() -> None:
+    settings = load_settings()
+    if settings.bot.workers > 1:
+        run_workers(settings, build_dispatcher, on_startup, on_shutdown, prepare=prepare_database)
+        return
 
-    executor.start_polling(dp, on_startup=on_startup)
+    dp = build_dispatcher()
+    if settings.bot.run_mode == "webhook":
+        run_webhook(dp, settings.webhook, on_startup, on_shutdown)
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
 
 
 if __name__ == "__main__":
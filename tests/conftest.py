@@ -0,0 +1,12 @@
+import pytest
+
+from bot.db import Base, init_async_db, init_db
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Временный SQLite-файл со схемой; синхронный и асинхронный движки смотрят в него."""
+    url = f"sqlite:///{tmp_path / 'bot.db'}"
+    Base.metadata.create_all(init_db(url))
+    init_async_db(url)
+    return url
@@ -0,0 +1,91 @@
+"""Архивация броней: что переносится, а что остаётся в рабочей таблице."""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import select
+
+from bot.archive import _archive_batch
+from bot.db import db_session
+from bot.models import Booking, BookingArchive, BookingState, Item, Notification, NotificationType
+
+KEEP_DAYS = 30
+
+
+def test_archive_keeps_refund_pending_cancellations(database):
+    today = date.today()
+    now = datetime.utcnow()
+    long_ago = today - timedelta(days=KEEP_DAYS + 10)
+    old = now - timedelta(days=KEEP_DAYS + 10)
+    soon = today + timedelta(days=5)
+
+    def booking(state: BookingState, start: date, updated_at: datetime, **kwargs) -> Booking:
+        return Booking(
+            item_id=item.id,
+            renter_user_id=20,
+            owner_user_id=10,
+            start_date=start,
+            end_date=start,
+            state=state,
+            updated_at=updated_at,
+            **kwargs,
+        )
+
+    with db_session() as session:
+        item = Item(sheet_row=1, name="Байдарка", price_raw="15 €", owner_handle="@owner")
+        session.add(item)
+        session.flush()
+        cases = {
+            "ended": booking(BookingState.paid_confirmed, long_ago, old, paid_confirmed_at=old),
+            "refund_pending": booking(BookingState.canceled_by_renter, soon, old, paid_confirmed_at=old),
+            "refunded": booking(
+                BookingState.canceled_by_renter, soon, old, paid_confirmed_at=old, refund_confirmed_at=old
+            ),
+            "unpaid_cancel": booking(BookingState.canceled_by_owner, soon, old),
+            "recent_cancel": booking(BookingState.canceled_by_owner, soon, now),
+            "upcoming": booking(BookingState.confirmed_unpaid, soon, old),
+        }
+        session.add_all(cases.values())
+        session.flush()
+        ids = {name: b.id for name, b in cases.items()}
+        session.add(
+            Notification(booking_id=ids["refunded"], type=NotificationType.refund_reminder, scheduled_for=now)
+        )
+
+    with db_session() as session:
+        assert _archive_batch(session, today, now, KEEP_DAYS, limit=100) == 3
+
+    with db_session() as session:
+        archived = set(session.scalars(select(BookingArchive.id)))
+        remaining = set(session.scalars(select(Booking.id)))
+        notifications = session.scalars(select(Notification.booking_id)).all()
+    assert archived == {ids["ended"], ids["refunded"], ids["unpaid_cancel"]}
+    assert remaining == {ids["refund_pending"], ids["recent_cancel"], ids["upcoming"]}
+    # напоминания перенесённых броней удаляются вместе с ними
+    assert notifications == []
+
+
+def test_archive_batch_respects_limit(database):
+    today = date.today()
+    now = datetime.utcnow()
+    old = now - timedelta(days=KEEP_DAYS + 10)
+    with db_session() as session:
+        item = Item(sheet_row=1, name="Лыжи", price_raw="5 €", owner_handle="@owner")
+        session.add(item)
+        session.flush()
+        session.add_all(
+            Booking(
+                item_id=item.id,
+                renter_user_id=20,
+                owner_user_id=10,
+                start_date=old.date(),
+                end_date=old.date(),
+                state=BookingState.paid_confirmed,
+                updated_at=old,
+            )
+            for _ in range(5)
+        )
+
+    with db_session() as session:
+        assert _archive_batch(session, today, now, KEEP_DAYS, limit=2) == 2
+    with db_session() as session:
+        assert _archive_batch(session, today, now, KEEP_DAYS, limit=10) == 3
+        assert _archive_batch(session, today, now, KEEP_DAYS, limit=10) == 0
@@ -0,0 +1,92 @@
+"""Переходы брони как compare-and-set: повтор и гонка дают конфликт (None), а не второй переход."""
+import asyncio
+from datetime import date, timedelta
+
+from bot.booking_transitions import BookingEvent, apply_transition, apply_transition_many
+from bot.db import db_session
+from bot.models import Booking, BookingState, Item
+from bot.writer import db_writer, submit_write
+
+OWNER = 10
+RENTER = 20
+
+
+def _pending_bookings(count: int = 1) -> list[int]:
+    with db_session() as session:
+        item = Item(sheet_row=1, name="Палатка", price_raw="10 €", owner_handle="@owner")
+        session.add(item)
+        session.flush()
+        start = date.today() + timedelta(days=7)
+        bookings = [
+            Booking(
+                item_id=item.id,
+                renter_user_id=RENTER,
+                owner_user_id=OWNER,
+                start_date=start + timedelta(days=i),
+                end_date=start + timedelta(days=i),
+                state=BookingState.pending_owner_confirm,
+            )
+            for i in range(count)
+        ]
+        session.add_all(bookings)
+        session.flush()
+        return [b.id for b in bookings]
+
+
+def _state(booking_id: int) -> BookingState:
+    with db_session() as session:
+        return session.get(Booking, booking_id).state
+
+
+def test_double_click_is_skipped(database):
+    (booking_id,) = _pending_bookings()
+    with db_session() as session:
+        row = apply_transition(session, booking_id, BookingEvent.owner_confirm, OWNER)
+    assert row.state == BookingState.confirmed_unpaid
+    assert row.item_name == "Палатка"
+
+    with db_session() as session:
+        assert apply_transition(session, booking_id, BookingEvent.owner_confirm, OWNER) is None
+        # Отклонить уже подтверждённый запрос тоже нельзя
+        assert apply_transition(session, booking_id, BookingEvent.owner_decline, OWNER) is None
+    assert _state(booking_id) == BookingState.confirmed_unpaid
+
+
+def test_wrong_actor_is_skipped(database):
+    (booking_id,) = _pending_bookings()
+    with db_session() as session:
+        assert apply_transition(session, booking_id, BookingEvent.owner_confirm, RENTER) is None
+    assert _state(booking_id) == BookingState.pending_owner_confirm
+
+
+def test_race_in_one_batch_has_single_winner(database):
+    (booking_id,) = _pending_bookings()
+
+    async def race() -> list:
+        db_writer.start()
+        try:
+            # Владелец подтверждает, арендатор в то же время отменяет — обе операции в одной пачке писателя
+            return await asyncio.gather(
+                submit_write(apply_transition, booking_id, BookingEvent.owner_confirm, OWNER),
+                submit_write(apply_transition, booking_id, BookingEvent.renter_cancel, RENTER),
+                submit_write(apply_transition, booking_id, BookingEvent.owner_decline, OWNER),
+            )
+        finally:
+            await db_writer.stop()
+
+    confirmed, canceled, declined = asyncio.run(race())
+    assert confirmed is not None and confirmed.state == BookingState.confirmed_unpaid
+    # Отмена арендатором допустима и из confirmed_unpaid — она выигрывает следующей
+    assert canceled is not None and canceled.state == BookingState.canceled_by_renter
+    assert declined is None
+    assert _state(booking_id) == BookingState.canceled_by_renter
+
+
+def test_many_returns_only_applied_rows(database):
+    ids = _pending_bookings(3)
+    with db_session() as session:
+        apply_transition(session, ids[0], BookingEvent.owner_decline, OWNER)
+    with db_session() as session:
+        rows = apply_transition_many(session, ids, BookingEvent.owner_confirm, OWNER)
+    assert sorted(r.id for r in rows) == ids[1:]
+    assert _state(ids[0]) == BookingState.canceled_by_owner
@@ -0,0 +1,199 @@
+"""
+Апдейты через настоящий Dispatcher из main.build_dispatcher(): подменён только запрос
+к Bot API, так что ответы хендлеров идут через LimitedBot и очередь sender, как в
+проде. БД — временный SQLite. Проверяет, что хендлеры получают `user` от UserMiddleware.
+"""
+import asyncio
+import time
+from datetime import date, timedelta
+
+import pytest
+from aiogram import Bot, Dispatcher, types
+from aiogram.bot.base import BaseBot
+from sqlalchemy import select
+
+import main
+from bot.db import db_session
+from bot.handlers_inbox import INBOX_LIMIT
+from bot.models import Booking, BookingState, Item, OutboxMessage, User
+from bot.outbox import outbox_worker
+from bot.sender import LimitedBot, sender
+from bot.writer import db_writer
+
+USER = {"id": 501, "is_bot": False, "first_name": "Renter", "username": "renter"}
+CHAT = {"id": 501, "type": "private", "first_name": "Renter"}
+
+
+def _message(text: str, message_id: int = 1) -> dict:
+    return {"message_id": message_id, "date": int(time.time()), "chat": CHAT, "from": USER, "text": text}
+
+
+@pytest.fixture
+def dispatcher(database, monkeypatch):
+    monkeypatch.setenv("BOT_TOKEN", "123456:TEST-token")
+    monkeypatch.setenv("GOOGLE_SPREADSHEET_ID", "test")
+    monkeypatch.setenv("GOOGLE_SERVICE_ACCOUNT_FILE", "test.json")
+    monkeypatch.setenv("DATABASE_URL", database)
+
+    dp = main.build_dispatcher()
+    assert isinstance(dp.bot, LimitedBot)
+    calls: list[tuple[str, dict]] = []
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        calls.append((method, dict(data or {})))
+        if method in ("sendMessage", "editMessageText"):
+            return _message(data.get("text", ""), message_id=len(calls) + 100)
+        return True
+
+    # Ниже LimitedBot.request: вызовы по-прежнему проходят через sender
+    monkeypatch.setattr(BaseBot, "request", request)
+    return dp, calls
+
+
+def _process(dp: Dispatcher, *updates: dict) -> None:
+    async def run() -> None:
+        Bot.set_current(dp.bot)
+        Dispatcher.set_current(dp)
+        db_writer.start()
+        sender.start()
+        try:
+            for update in updates:
+                # Как при polling: у каждого апдейта своя задача, контекст (и кэш состояния FSM) не общий
+                await asyncio.create_task(dp.process_update(types.Update(**update)))
+        finally:
+            # Как on_shutdown: отправки deliver_now дописывают результат до остановки писателя
+            await outbox_worker.stop()
+            await sender.stop()
+            await db_writer.stop()
+
+    asyncio.run(run())
+
+
+def _sent_texts(calls) -> list[str]:
+    return [data.get("text") for method, data in calls if method == "sendMessage"]
+
+
+def test_message_handler_receives_user(dispatcher):
+    dp, calls = dispatcher
+    sent_before = sender.stats.sent
+    _process(dp, {"update_id": 1, "message": _message("📋 Мои бронирования")})
+    assert "У вас пока нет броней." in _sent_texts(calls)
+    # message.answer прошёл очередь sender, а не ушёл в Bot API напрямую
+    assert sender.stats.sent > sent_before
+
+
+def test_callback_handler_receives_user(dispatcher):
+    dp, calls = dispatcher
+    callback = {
+        "id": "cb-1",
+        "from": USER,
+        "chat_instance": "1",
+        "data": "bulkblock:start",
+        "message": _message("меню", message_id=7),
+    }
+    _process(dp, {"update_id": 2, "callback_query": callback})
+    assert "answerCallbackQuery" in [method for method, _ in calls]
+    # owner_handle взят из ника пользователя, которого определил middleware
+    assert "В таблице нет вещей с вашим ником во столбце «Контакт»." in _sent_texts(calls)
+
+
+def test_item_card_uses_entity_after_read_session(dispatcher):
+    dp, calls = dispatcher
+    with db_session() as session:
+        item = Item(sheet_row=2, name="Дрель", price_raw="5 €/день", owner_handle="@owner", area="Центр")
+        session.add(item)
+        session.flush()
+        item_id = item.id
+    callback = {
+        "id": "cb-2",
+        "from": USER,
+        "chat_instance": "1",
+        "data": f"item:{item_id}",
+        "message": _message("список", message_id=8),
+    }
+    _process(dp, {"update_id": 3, "callback_query": callback})
+    edits = [data.get("text", "") for method, data in calls if method == "editMessageText"]
+    assert edits and "Дрель" in edits[0]
+
+
+def test_renter_paid_only_from_renter(dispatcher):
+    dp, calls = dispatcher
+    owner = {"id": 777, "is_bot": False, "first_name": "Owner", "username": "own"}
+    with db_session() as session:
+        item = Item(sheet_row=3, name="Палатка", price_raw="10 €", owner_handle="@own")
+        session.add(item)
+        session.flush()
+        start = date.today() + timedelta(days=3)
+        booking = Booking(
+            item_id=item.id,
+            renter_user_id=USER["id"],
+            owner_user_id=owner["id"],
+            start_date=start,
+            end_date=start,
+            state=BookingState.confirmed_unpaid,
+        )
+        session.add(booking)
+        session.flush()
+        booking_id = booking.id
+
+    def press(update_id: int, user: dict) -> dict:
+        message = _message("бронь", message_id=9) | {"chat": {"id": user["id"], "type": "private"}}
+        callback = {"id": f"cb-{update_id}", "from": user, "chat_instance": "1", "data": f"renter_paid:{booking_id}"}
+        return {"update_id": update_id, "callback_query": callback | {"message": message}}
+
+    _process(dp, press(4, owner))
+    assert not [data for method, data in calls if method == "sendMessage"]
+
+    _process(dp, press(5, USER))
+    sent = [data for method, data in calls if method == "sendMessage"]
+    assert [data["chat_id"] for data in sent] == [owner["id"]]
+    assert "@renter сообщает, что оплатил" in sent[0]["text"]
+
+
+def test_inbox_approve_all_beyond_shown_page(dispatcher):
+    dp, calls = dispatcher
+    owner = {"id": 777, "is_bot": False, "first_name": "Owner", "username": "own"}
+    owner_chat = {"id": owner["id"], "type": "private"}
+    renters = (601, 602)
+    total = INBOX_LIMIT + 5
+    with db_session() as session:
+        session.add_all([User(tg_id=owner["id"], username="own"), *(User(tg_id=r) for r in renters)])
+        item = Item(sheet_row=4, name="Лодка", price_raw="20 €", owner_handle="@own")
+        session.add(item)
+        session.flush()
+        start = date.today() + timedelta(days=5)
+        session.add_all(
+            Booking(
+                item_id=item.id,
+                renter_user_id=renters[i % 2],
+                owner_user_id=owner["id"],
+                start_date=start + timedelta(days=i),
+                end_date=start + timedelta(days=i),
+                state=BookingState.pending_owner_confirm,
+            )
+            for i in range(total)
+        )
+
+    inbox = _message("/inbox", message_id=10) | {"from": owner, "chat": owner_chat}
+    press = {
+        "id": "cb-all",
+        "from": owner,
+        "chat_instance": "1",
+        "data": "inbox:all",
+        "message": _message("inbox", message_id=11) | {"chat": owner_chat},
+    }
+    _process(dp, {"update_id": 6, "message": inbox}, {"update_id": 7, "callback_query": press})
+
+    assert f"Подтверждено броней: {total}. Ожидается оплата." in [
+        data.get("text") for method, data in calls if method == "editMessageText"
+    ]
+    with db_session() as session:
+        states = session.scalars(select(Booking.state)).all()
+        outbox = session.execute(select(OutboxMessage.chat_id, OutboxMessage.digest, OutboxMessage.sent_at)).all()
+    assert set(states) == {BookingState.confirmed_unpaid}
+    # по сообщению на арендатора в каждой пачке, без окна дайджеста, отправлены сразу этим процессом
+    assert sorted(row.chat_id for row in outbox) == sorted(renters * 2)
+    assert not any(row.digest for row in outbox)
+    assert all(row.sent_at for row in outbox)
+    to_renters = [data["chat_id"] for method, data in calls if method == "sendMessage" and data["chat_id"] in renters]
+    assert sorted(to_renters) == sorted(renters * 2)
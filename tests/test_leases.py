@@ -0,0 +1,45 @@
+"""Аренды в БД: захват, продление, перехват после истечения."""
+import asyncio
+from datetime import datetime, timedelta
+
+from bot.db import db_session
+from bot.leases import LeaseManager, _acquire
+
+TTL = timedelta(seconds=30)
+
+
+def test_acquire_renew_and_steal_after_expiry(database):
+    now = datetime.utcnow()
+    with db_session() as session:
+        assert _acquire(session, "job", "a", now, TTL)
+        # чужая действующая аренда не перехватывается
+        assert not _acquire(session, "job", "b", now + timedelta(seconds=10), TTL)
+        # владелец продлевает
+        assert _acquire(session, "job", "a", now + timedelta(seconds=20), TTL)
+        assert not _acquire(session, "job", "b", now + timedelta(seconds=40), TTL)
+        # продление пропущено — после истечения аренду забирает другой
+        assert _acquire(session, "job", "b", now + timedelta(seconds=51), TTL)
+        assert not _acquire(session, "job", "a", now + timedelta(seconds=52), TTL)
+
+
+def test_lease_manager_hands_over_after_expiry(database):
+    async def run() -> None:
+        # heartbeat_seconds=0: локальный срок совпадает со сроком в БД
+        first = LeaseManager(ttl=timedelta(seconds=0.3), heartbeat_seconds=0)
+        second = LeaseManager(ttl=timedelta(seconds=0.3), heartbeat_seconds=0)
+        assert await first.ensure("sync")
+        assert not await second.ensure("sync")
+        assert first.held() == ["sync"] and second.held() == []
+
+        await asyncio.sleep(0.4)
+        assert not first.holds("sync")
+        assert await second.ensure("sync")
+        # прежний владелец при следующем heartbeat узнаёт, что аренда потеряна
+        await first._beat(["sync"])
+        assert not first.holds("sync")
+
+        await second.stop()
+        # отданная при остановке аренда достаётся сразу, без ожидания срока
+        assert await first.ensure("sync")
+
+    asyncio.run(run())
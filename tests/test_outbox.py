@@ -0,0 +1,73 @@
+"""Сборка дайджестов outbox и разбиение по лимитам Telegram."""
+import json
+from types import SimpleNamespace
+
+from bot.outbox import DIGEST_MAX_BUTTONS, DIGEST_MAX_TEXT, build_deliveries
+
+
+def _row(row_id: int, chat_id: int, text: str, buttons: int = 0, digest: bool = True, parse_mode=None):
+    markup = None
+    if buttons:
+        keyboard = [[{"text": f"b{i}", "callback_data": f"x:{row_id}:{i}"}] for i in range(buttons)]
+        markup = json.dumps({"inline_keyboard": keyboard})
+    return SimpleNamespace(
+        id=row_id,
+        chat_id=chat_id,
+        text=text,
+        reply_markup=markup,
+        parse_mode=parse_mode,
+        priority=1,
+        attempts=0,
+        digest=digest,
+    )
+
+
+def _buttons(delivery) -> int:
+    if not delivery.reply_markup:
+        return 0
+    return sum(len(r) for r in json.loads(delivery.reply_markup)["inline_keyboard"])
+
+
+def test_digest_groups_per_chat_and_keeps_plain_rows_single():
+    rows = [
+        _row(1, 100, "первое"),
+        _row(2, 100, "второе", buttons=1),
+        _row(3, 200, "другой чат"),
+        _row(4, 100, "срочное", digest=False),
+    ]
+    deliveries = build_deliveries(rows)
+    by_rows = {tuple(r.id for r in d.rows): d for d in deliveries}
+    assert set(by_rows) == {(4,), (1, 2), (3,)}
+
+    digest = by_rows[(1, 2)]
+    assert digest.text.startswith("🔔 Уведомлений: 2")
+    assert "1) первое" in digest.text and "2) второе" in digest.text
+    # кнопки нумеруются по сообщению, к которому относятся
+    assert json.loads(digest.reply_markup)["inline_keyboard"][0][0]["text"] == "2 · b0"
+    # одиночное сообщение из дайджест-группы уходит как есть
+    assert by_rows[(3,)].text == "другой чат"
+
+
+def test_digest_splits_at_text_limit():
+    part = "x" * (DIGEST_MAX_TEXT // 3)
+    rows = [_row(i, 100, part) for i in range(1, 8)]
+    deliveries = build_deliveries(rows)
+    assert sum(len(d.rows) for d in deliveries) == len(rows)
+    assert len(deliveries) > 1
+    assert all(len(d.text) <= 4096 for d in deliveries)
+    # порядок сообщений в чате сохраняется
+    assert [r.id for d in deliveries for r in d.rows] == list(range(1, 8))
+
+
+def test_digest_splits_at_button_limit():
+    per_row = DIGEST_MAX_BUTTONS // 2 + 1
+    rows = [_row(i, 100, f"бронь {i}", buttons=per_row) for i in range(1, 4)]
+    deliveries = build_deliveries(rows)
+    assert len(deliveries) == 3
+    assert all(_buttons(d) <= DIGEST_MAX_BUTTONS for d in deliveries)
+
+
+def test_digest_does_not_mix_parse_modes():
+    rows = [_row(1, 100, "a"), _row(2, 100, "<b>b</b>", parse_mode="HTML")]
+    deliveries = build_deliveries(rows)
+    assert sorted(len(d.rows) for d in deliveries) == [1, 1]
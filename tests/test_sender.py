@@ -0,0 +1,61 @@
+"""Токен-бакеты и очередь sender: лимиты, RetryAfter с повтором и общей паузой."""
+import asyncio
+import time
+
+from aiogram.utils.exceptions import RetryAfter
+
+from bot.sender import Sender, TokenBucket
+
+
+def test_token_bucket_refill_and_pause():
+    bucket = TokenBucket(rate=2.0, capacity=2)
+    now = bucket.updated
+    assert bucket.wait_time(now) == 0
+    bucket.take()
+    bucket.take()
+    assert bucket.wait_time(now) == 0.5
+    assert bucket.wait_time(now + 0.5) == 0
+    # пауза на 3 с: токен появится не раньше, чем через 3 с и ещё один интервал
+    bucket.pause(now + 0.5, 3)
+    assert bucket.wait_time(now + 3.4) > 0
+    assert bucket.wait_time(now + 4.01) == 0
+
+
+def test_retry_after_requeues_and_pauses_all_chats():
+    sender = Sender()
+    log: list[tuple[str, int, float]] = []
+
+    def call(chat_id: int, fail_first: bool):
+        attempts = {"n": 0}
+
+        async def run() -> int:
+            attempts["n"] += 1
+            if fail_first and attempts["n"] == 1:
+                log.append(("retry_after", chat_id, time.monotonic()))
+                raise RetryAfter(1)
+            log.append(("sent", chat_id, time.monotonic()))
+            return chat_id
+
+        return run
+
+    async def run() -> list:
+        sender.start()
+        try:
+            first = asyncio.ensure_future(sender.submit(call(1, fail_first=True), 1))
+            # дожидаемся RetryAfter, затем пишем в другой чат
+            while not log:
+                await asyncio.sleep(0.01)
+            second = await sender.submit(call(2, fail_first=False), 2)
+            return [await first, second]
+        finally:
+            await sender.stop()
+
+    assert asyncio.run(run()) == [1, 2]
+    assert sender.stats.retried == 1 and sender.stats.sent == 2 and sender.stats.failed == 0
+
+    (_, _, limited_at), *rest = log
+    sent_at = {chat_id: at for event, chat_id, at in rest if event == "sent"}
+    # повтор в тот же чат — не раньше, чем через retry_after
+    assert sent_at[1] - limited_at >= 1.0
+    # другой чат тоже ждёт: лимит общий на бота
+    assert sent_at[2] - limited_at >= 0.9
@@ -0,0 +1,53 @@
+"""Групповой коммит писателя: ошибка одной операции откатывает только её SAVEPOINT."""
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from bot.db import db_session
+from bot.models import Item
+from bot.writer import DbWriter
+
+
+def _add_item(session, row: int, fail: bool = False) -> int:
+    item = Item(sheet_row=row, name=f"Вещь {row}", price_raw="1 €", owner_handle="@owner")
+    session.add(item)
+    session.flush()
+    if fail:
+        raise ValueError("ошибка операции")
+    return item.id
+
+
+def test_failing_op_is_isolated_within_batch(database):
+    # Окно побольше, чтобы все три операции гарантированно попали в одну пачку
+    writer = DbWriter(window_ms=200)
+
+    async def run() -> list:
+        writer.start()
+        try:
+            return await asyncio.gather(
+                writer.submit(_add_item, 1),
+                writer.submit(_add_item, 2, fail=True),
+                writer.submit(_add_item, 3),
+                return_exceptions=True,
+            )
+        finally:
+            await writer.stop()
+
+    first, failed, third = asyncio.run(run())
+    assert isinstance(first, int) and isinstance(third, int)
+    assert isinstance(failed, ValueError)
+    assert writer.stats.batches == 1 and writer.stats.ops == 3
+
+    with db_session() as session:
+        rows = session.scalars(select(Item.sheet_row).order_by(Item.sheet_row)).all()
+    assert rows == [1, 3]
+
+
+def test_submit_without_running_writer_commits_directly(database):
+    writer = DbWriter()
+    assert asyncio.run(writer.submit(_add_item, 5)) > 0
+    with pytest.raises(ValueError):
+        asyncio.run(writer.submit(_add_item, 6, fail=True))
+    with db_session() as session:
+        assert session.scalars(select(Item.sheet_row)).all() == [5]